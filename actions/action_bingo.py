@@ -1,20 +1,77 @@
+import re
 from typing import Any, Text, Dict, List
 from rasa_sdk import Action, Tracker
 from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.events import SlotSet
 from .engine import bingo as bingo_engine
 from .engine.db import migrate
+from .engine.executor import run_blocking
+from instrumentation import instrumented
 
 
+@instrumented
 class ActionBingo(Action):
     def name(self) -> Text:
         return "action_bingo"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        migrate()
-        board = bingo_engine.generate_bingo_board(3)
-        lines = [" | ".join(row) for row in board]
-        dispatcher.utter_message(text="Bingo de valores 3x3:\n\n" + "\n".join(lines))
-        return [SlotSet("bingo_board", board)]
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        await run_blocking(migrate)
+        user_id = tracker.sender_id
+        game = await run_blocking(bingo_engine.start_game, user_id)
+        dispatcher.utter_message(
+            text="Bingo de valores 3x3:\n\n" + game.render(user_id) + "\n\nPide \"canta un valor\" para empezar."
+        )
+        return [SlotSet("bingo_game_id", game.game_id), SlotSet("bingo_board", game.boards[user_id])]
 
 
+@instrumented
+class ActionBingoCantar(Action):
+    def name(self) -> Text:
+        return "action_bingo_cantar"
+
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        await run_blocking(migrate)
+        user_id = tracker.sender_id
+        game_id = tracker.get_slot("bingo_game_id")
+        played = await run_blocking(bingo_engine.call_next, game_id, user_id) if game_id else None
+        if played is None:
+            dispatcher.utter_message(text="No hay un bingo en curso. Di \"bingo de valores\" para empezar uno.")
+            return []
+        game, value, awarded = played
+        if value is None:
+            dispatcher.utter_message(text="Ya se cantaron todos los valores. ¡Empieza otro bingo!")
+            return []
+        text = f"Valor cantado: {value}\n\n{game.render(user_id)}"
+        if user_id in awarded:
+            text += f"\n\n¡Bingo! Ganaste {bingo_engine.BINGO_XP} XP."
+        dispatcher.utter_message(text=text)
+        return []
+
+
+@instrumented
+class ActionBingoMarcar(Action):
+    def name(self) -> Text:
+        return "action_bingo_marcar"
+
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        await run_blocking(migrate)
+        user_id = tracker.sender_id
+        game_id = tracker.get_slot("bingo_game_id")
+        numbers = re.findall(r"\d+", tracker.latest_message.get("text", ""))
+        if len(numbers) < 2:
+            dispatcher.utter_message(text="Dime la fila y la columna, por ejemplo: marca 1 2.")
+            return []
+        row, col = int(numbers[0]) - 1, int(numbers[1]) - 1
+        played = await run_blocking(bingo_engine.mark_cell, game_id, user_id, user_id, row, col) if game_id else None
+        if played is None:
+            dispatcher.utter_message(text="No hay un bingo en curso. Di \"bingo de valores\" para empezar uno.")
+            return []
+        game, marked, awarded = played
+        if not marked:
+            dispatcher.utter_message(text="Esa casilla no está en el tablero o su valor aún no se ha cantado.")
+            return []
+        text = game.render(user_id)
+        if user_id in awarded:
+            text += f"\n\n¡Bingo! Ganaste {bingo_engine.BINGO_XP} XP."
+        dispatcher.utter_message(text=text)
+        return []
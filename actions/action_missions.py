@@ -3,31 +3,41 @@ from rasa_sdk import Action, Tracker
 from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.events import SlotSet
 from .engine import missions as missions_engine
-from .engine.db import migrate
+from .engine.db import get_streak, migrate
+from .engine.executor import run_blocking
+from instrumentation import instrumented
 
 
+@instrumented
 class ActionMisionHoy(Action):
     def name(self) -> Text:
         return "action_mision_hoy"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        migrate()
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        await run_blocking(migrate)
         age_range = tracker.get_slot("edad_rango")
-        m = missions_engine.daily_mission(age_range)
+        m = await run_blocking(missions_engine.daily_mission, age_range)
         dispatcher.utter_message(text=f"Misión de hoy: {m.get('title')}\n\n{m.get('description')}")
         return [SlotSet("mission_title", m.get("title"))]
 
 
+@instrumented
 class ActionCompletarMision(Action):
     def name(self) -> Text:
         return "action_completar_mision"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        migrate()
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        await run_blocking(migrate)
         user_id = tracker.sender_id
         title = tracker.get_slot("mission_title") or "Misión"
-        missions_engine.complete_mission(user_id, {"title": title})
-        dispatcher.utter_message(text="¡Misión completada! Ganaste 20 XP.")
+        completed = await run_blocking(missions_engine.complete_mission, user_id, {"title": title})
+        if completed:
+            streak = await run_blocking(get_streak, user_id)
+            dispatcher.utter_message(
+                text=f"¡Misión completada! Ganaste {missions_engine.MISSION_XP} XP. 🔥 Racha: {streak['current']} días."
+            )
+        else:
+            dispatcher.utter_message(text="Ya completaste esta misión. ¡Vuelve por la siguiente!")
         return []
 
 
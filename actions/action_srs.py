@@ -4,27 +4,31 @@ from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.events import SlotSet
 from .engine import srs as srs_engine
 from .engine.db import migrate
+from .engine.executor import run_blocking
+from instrumentation import instrumented
 
 
+@instrumented
 class ActionMostrarVerso(Action):
     def name(self) -> Text:
         return "action_mostrar_verso"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        migrate()
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        await run_blocking(migrate)
         age_range = tracker.get_slot("edad_rango")
-        verse = srs_engine.verse_of_the_day(age_range)
+        verse = await run_blocking(srs_engine.verse_of_the_day, age_range)
         dispatcher.utter_message(text=f"Verso del día:\n\n{verse['reference']}\n{verse['text']}")
         # guardar item_id en slot para repaso
         return [SlotSet("ultimo_versiculo", verse.get("item_id"))]
 
 
+@instrumented
 class ActionRepasoVerso(Action):
     def name(self) -> Text:
         return "action_repaso_verso"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        migrate()
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        await run_blocking(migrate)
         user_id = tracker.sender_id
         item_id = tracker.get_slot("ultimo_versiculo") or "Juan::3::16"
         ease = float(tracker.get_slot("srs_ease") or 2.5)
@@ -36,7 +40,7 @@ class ActionRepasoVerso(Action):
             result = "good"
         else:
             result = "again"
-        out = srs_engine.review_result(user_id, item_id, ease, interval_days, result)
+        out = await run_blocking(srs_engine.review_result, user_id, item_id, ease, interval_days, result)
         dispatcher.utter_message(text=f"¡Anotado! Próximo repaso en {out['interval_days']} días.")
         return [SlotSet("srs_ease", out["ease"]), SlotSet("srs_interval", out["interval_days"]) ]
 
@@ -3,17 +3,20 @@ from rasa_sdk import Action, Tracker
 from rasa_sdk.executor import CollectingDispatcher
 from rasa_sdk.events import SlotSet
 from .engine import trivia as trivia_engine
-from .engine.db import migrate
+from .engine.db import get_streak, migrate
+from .engine.executor import run_blocking
+from instrumentation import instrumented
 
 
+@instrumented
 class ActionIniciarTrivia(Action):
     def name(self) -> Text:
         return "action_iniciar_trivia"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        migrate()
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        await run_blocking(migrate)
         user_id = tracker.sender_id
-        session = trivia_engine.start_trivia(user_id, 5)
+        session = await run_blocking(trivia_engine.start_trivia, user_id, 5)
         if not session.get("questions"):
             dispatcher.utter_message(text="No hay preguntas disponibles ahora.")
             return []
@@ -23,12 +26,13 @@ class ActionIniciarTrivia(Action):
         return [SlotSet("quiz_session_id", "local"), SlotSet("quiz_data", session)]
 
 
+@instrumented
 class ActionResponderTrivia(Action):
     def name(self) -> Text:
         return "action_responder_trivia"
 
-    def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
-        migrate()
+    async def run(self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+        await run_blocking(migrate)
         user_id = tracker.sender_id
         session = tracker.get_slot("quiz_data") or {}
         text = tracker.latest_message.get("text", "").strip()
@@ -37,11 +41,14 @@ class ActionResponderTrivia(Action):
         except Exception:
             dispatcher.utter_message(text="Responde con 1, 2, 3 o 4.")
             return []
-        session, verdict = trivia_engine.answer_trivia(user_id, session, ans)
+        session, verdict = await run_blocking(trivia_engine.answer_trivia, user_id, session, ans)
         idx = session.get("current", 0)
         total = len(session.get("questions", []))
         if idx >= total:
-            dispatcher.utter_message(text=f"¡Terminaste! Puntaje: {session.get('score',0)}/{total}")
+            streak = await run_blocking(get_streak, user_id)
+            dispatcher.utter_message(
+                text=f"¡Terminaste! Puntaje: {session.get('score',0)}/{total}\n🔥 Racha: {streak['current']} días"
+            )
             return [SlotSet("quiz_data", None)]
         q = session["questions"][idx]
         options = "\n".join([f"{i+1}. {opt}" for i, opt in enumerate(q.get("options", []))])
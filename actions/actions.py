@@ -12,73 +12,103 @@ import json
 import random
 from datetime import datetime
 import re
-from collections import defaultdict
-import unicodedata
+import logging
 
 # Importar el sistema de métricas SQLite
 from sqlite_metrics import (
-    save_quiz_result, save_user_query, save_usage_stat,
+    METRICS_ASYNC, save_quiz_result, save_user_query, save_usage_stat,
     get_user_quiz_history, get_leaderboard, get_usage_stats
 )
-
-# Índice global en memoria para búsquedas rápidas
-BIBLE_INDEX = {}
-TOPIC_INDEX = defaultdict(list)
+from .engine.content import ContentIndex, lean_content, normalize
+from .engine.db import get_xp_leaderboard, get_xp_rank, migrate
+from .engine.executor import run_blocking
+from .engine.selection import QuestionBank, pick_unseen
+from .engine.singleflight import SingleFlight
+import instrumentation
+import memory_budget
+from instrumentation import instrumented
+
+logger = logging.getLogger(__name__)
+
+# Índice global en memoria para búsquedas rápidas (inmutable, ver engine/content.py)
+CONTENT = ContentIndex([])
 QUIZ_DATA = {}
 
-def normalize(text):
-    return ''.join(
-        c for c in unicodedata.normalize('NFD', text.lower())
-        if unicodedata.category(c) != 'Mn'
-    )
+# Búsquedas por tema idénticas y concurrentes (p. ej. durante un sermón) comparten un solo cálculo
+SEARCHES = SingleFlight("search")
+
+
+async def record_metric(save, *args):
+    """Guarda una métrica: con la ingesta asíncrona (por defecto) es encolarla, sin salto de hilo"""
+    if METRICS_ASYNC:
+        return save(*args)
+    return await run_blocking(save, *args)
+
 
 class BibleIndexer:
     """Clase para manejar la indexación bíblica en memoria"""
     
     @staticmethod
-    def load_bible_data():
+    def load_bible_data(path: str = "data/bible_content.json"):
         """Carga y indexa el contenido bíblico al arrancar"""
         try:
-            with open("data/bible_content.json", "r", encoding="utf-8") as f:
+            with instrumentation.timed("content"), \
+                    open(path, "r", encoding="utf-8") as f:
                 data = json.load(f)
             
-            # Indexar versículos para búsqueda O(1)
-            for verse in data["verses"]:
-                key = (verse["book"].lower(), verse["chapter"], verse["verse"])
-                BIBLE_INDEX[key] = verse["text"]
-            
-            # Crear índice de temas para búsqueda full-text
-            for verse in data["verses"]:
-                text = verse["text"].lower()
-                words = re.findall(r'\b\w+\b', text)
-                for word in words:
-                    if len(word) > 2:  # Ignorar palabras muy cortas
-                        TOPIC_INDEX[word].append({
-                            "book": verse["book"],
-                            "chapter": verse["chapter"],
-                            "verse": verse["verse"],
-                            "text": verse["text"]
-                        })
-            
-            # Cargar preguntas del quiz
-            if "quiz_questions" in data:
-                QUIZ_DATA["questions"] = data["quiz_questions"]
-            
-            return data
+            return BibleIndexer.index_bible_data(data)
         except Exception as e:
-            print(f"Error cargando datos bíblicos: {e}")
+            logger.error("Error cargando datos bíblicos: %s", e)
             return {"verses": [], "stories": [], "concepts": []}
+    
+    @staticmethod
+    def index_bible_data(data):
+        """Reconstruye los índices globales a partir del contenido (p. ej. un corpus sintético)"""
+        global CONTENT, BIBLE_DATA
+        
+        # Versículos para búsqueda O(1) e índice de temas para búsqueda full-text
+        CONTENT = ContentIndex(data["verses"])
+        
+        # Por encima del presupuesto de memoria (MAIKA_MEMORY_BUDGET_MB) se pasa
+        # a la representación compacta: sin versículos en crudo, cadenas
+        # internadas e historias/conceptos leídos bajo demanda
+        size = memory_budget.over_budget([CONTENT, data])
+        if size is not None:
+            data = lean_content(data)
+            logger.warning(
+                "Contenido en memoria (%.1f MB) supera el presupuesto de %.1f MB; usando representación compacta",
+                size / (1024 * 1024), memory_budget.MEMORY_BUDGET_MB,
+            )
+        
+        # Cargar preguntas del quiz
+        QUIZ_DATA.clear()
+        if "quiz_questions" in data:
+            QUIZ_DATA["questions"] = data["quiz_questions"]
+            QUIZ_DATA["bank"] = QuestionBank(data["quiz_questions"])
+        
+        BIBLE_DATA = data
+        return data
 
 # Cargar datos al importar el módulo
 BIBLE_DATA = BibleIndexer.load_bible_data()
 
+# Estructuras en memoria visibles en /memory y en `python memory_budget.py`
+memory_budget.register("content_index", lambda: CONTENT)
+memory_budget.register("bible_data", lambda: BIBLE_DATA,
+                       lambda data: sum(len(v) for v in data.values() if isinstance(v, (list, dict))))
+memory_budget.register("quiz_data", lambda: QUIZ_DATA, lambda quiz: len(quiz.get("questions", [])))
+
+# Endpoint /metrics y/o línea de log periódica (MAIKA_METRICS_PORT, MAIKA_METRICS_LOG_INTERVAL)
+instrumentation.start_exporters()
+
+@instrumented
 class ActionBuscarVersiculo(Action):
     def name(self) -> Text:
         return "action_buscar_versiculo"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         # Extraer entidades
         entities = tracker.latest_message.get("entities", [])
@@ -110,8 +140,8 @@ class ActionBuscarVersiculo(Action):
         user_id = tracker.sender_id
         intent = tracker.latest_message.get("intent", {}).get("name", "preguntar_versiculo")
         entities_str = str(tracker.latest_message.get("entities", []))
-        save_user_query(user_id, intent, entities_str)
-        save_usage_stat(user_id, "verse_search", True)
+        await record_metric(save_user_query, user_id, intent, entities_str)
+        await record_metric(save_usage_stat, user_id, "verse_search", True)
         
         # Búsqueda O(1) usando el índice
         if libro and capitulo and versiculo:
@@ -128,9 +158,10 @@ class ActionBuscarVersiculo(Action):
             elif libro_normalizado == "filipenses":
                 libro_normalizado = "filipenses"
             
-            key = (libro_normalizado, capitulo, versiculo)
-            if key in BIBLE_INDEX:
-                response = f"**{libro.title()} {capitulo}:{versiculo}**\n\n{BIBLE_INDEX[key]}"
+            # Un acceso a dict en memoria: más barato inline que coalescido en el pool de hilos
+            text = CONTENT.lookup(libro_normalizado, capitulo, versiculo)
+            if text is not None:
+                response = f"**{libro.title()} {capitulo}:{versiculo}**\n\n{text}"
                 dispatcher.utter_message(text=response)
                 
                 # Preguntar si fue útil
@@ -141,45 +172,31 @@ class ActionBuscarVersiculo(Action):
         dispatcher.utter_message(text="No encontré ese versículo específico, pero aquí tienes algunos versículos inspiradores:")
         
         # Mostrar algunos versículos de ejemplo
-        sample_verses = list(BIBLE_INDEX.items())[:3]
-        for (book, chapter, verse), text in sample_verses:
-            response = f"**{book.title()} {chapter}:{verse}**\n{text}"
+        for verse in CONTENT.verses(3):
+            response = f"**{verse['book'].title()} {verse['chapter']}:{verse['verse']}**\n{verse['text']}"
             dispatcher.utter_message(text=response)
         
         dispatcher.utter_message(text="¿Te fue útil esta respuesta?")
         return []
 
+@instrumented
 class ActionSearchTopic(Action):
     """Búsqueda por tema usando índice full-text"""
     
     def name(self) -> Text:
         return "action_buscar_por_tema"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         # Extraer tema de búsqueda
         message = tracker.latest_message.get("text", "").lower()
         
-        # Buscar palabras clave en el mensaje
+        # Buscar palabras clave en el mensaje (sin duplicados, como máximo 5)
         keywords = re.findall(r'\b\w+\b', message)
-        relevant_verses = []
-        
-        for keyword in keywords:
-            norm_keyword = normalize(keyword)
-            for word, verses in TOPIC_INDEX.items():
-                if norm_keyword in normalize(word):
-                    relevant_verses.extend(verses)
-        
-        # Eliminar duplicados y limitar resultados
-        unique_verses = []
-        seen = set()
-        for verse in relevant_verses:
-            key = (verse["book"], verse["chapter"], verse["verse"])
-            if key not in seen:
-                unique_verses.append(verse)
-                seen.add(key)
+        query = tuple(normalize(keyword) for keyword in keywords)
+        unique_verses = await SEARCHES.do(("topic",) + query, CONTENT.search, keywords, 5)
         
         # Mostrar los 3-5 versículos más relevantes
         if unique_verses:
@@ -192,21 +209,21 @@ class ActionSearchTopic(Action):
             dispatcher.utter_message(text="No encontré versículos específicos sobre ese tema, pero aquí tienes algunos versículos inspiradores:")
             
             # Mostrar versículos aleatorios
-            sample_verses = random.sample(list(BIBLE_INDEX.items()), 3)
-            for (book, chapter, verse), text in sample_verses:
-                response = f"**{book.title()} {chapter}:{verse}**\n{text}"
+            for verse in CONTENT.sample(3):
+                response = f"**{verse['book'].title()} {verse['chapter']}:{verse['verse']}**\n{verse['text']}"
                 dispatcher.utter_message(text=response)
         
         dispatcher.utter_message(text="¿Te fue útil esta respuesta?")
         return []
 
+@instrumented
 class ActionObtenerHistoriaBiblica(Action):
     def name(self) -> Text:
         return "action_obtener_historia_biblica"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         # Extraer concepto de la historia
         concepto = next((entity["value"] for entity in tracker.latest_message["entities"] 
@@ -232,13 +249,14 @@ class ActionObtenerHistoriaBiblica(Action):
         dispatcher.utter_message(text="¿Te fue útil esta respuesta?")
         return []
 
+@instrumented
 class ActionExplicarConcepto(Action):
     def name(self) -> Text:
         return "action_explicar_concepto"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         # Extraer concepto
         concepto = next((entity["value"] for entity in tracker.latest_message["entities"] 
@@ -271,13 +289,14 @@ class ActionExplicarConcepto(Action):
         dispatcher.utter_message(text="¿Te fue útil esta respuesta?")
         return []
 
+@instrumented
 class ActionGenerarDevocional(Action):
     def name(self) -> Text:
         return "action_generar_devocional"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         devocionales = [
             {
@@ -308,13 +327,14 @@ class ActionGenerarDevocional(Action):
         dispatcher.utter_message(text="¿Te fue útil esta respuesta?")
         return []
 
+@instrumented
 class ActionObtenerEventos(Action):
     def name(self) -> Text:
         return "action_obtener_eventos"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         eventos = [
             "**Domingo 10:00** - Servicio de Adoración",
@@ -332,13 +352,14 @@ class ActionObtenerEventos(Action):
         dispatcher.utter_message(text="¿Te fue útil esta respuesta?")
         return []
 
+@instrumented
 class ActionObtenerHorarios(Action):
     def name(self) -> Text:
         return "action_obtener_horarios"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         church_info = BIBLE_DATA.get("church", {}) if isinstance(BIBLE_DATA, dict) else {}
         
@@ -358,13 +379,14 @@ class ActionObtenerHorarios(Action):
         dispatcher.utter_message(text="¿Te fue útil esta respuesta?")
         return []
 
+@instrumented
 class ActionOracionGuiada(Action):
     def name(self) -> Text:
         return "action_oracion_guiada"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         # Extraer tema de oración
         tema = next((entity["value"] for entity in tracker.latest_message["entities"] 
@@ -388,13 +410,14 @@ class ActionOracionGuiada(Action):
         dispatcher.utter_message(text="¿Te fue útil esta respuesta?")
         return []
 
+@instrumented
 class ActionAyudaEspiritual(Action):
     def name(self) -> Text:
         return "action_ayuda_espiritual"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         recursos = [
             "**Recuerda que Dios está contigo** - 'No te desampararé, ni te dejaré' (Hebreos 13:5)",
@@ -412,13 +435,14 @@ class ActionAyudaEspiritual(Action):
         dispatcher.utter_message(text="¿Te fue útil esta respuesta?")
         return []
 
+@instrumented
 class ActionEstudioBiblico(Action):
     def name(self) -> Text:
         return "action_estudio_biblico"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         estudios = [
             {
@@ -449,13 +473,14 @@ class ActionEstudioBiblico(Action):
         dispatcher.utter_message(text="¿Te fue útil esta respuesta?")
         return []
 
+@instrumented
 class ActionConsejoPastoral(Action):
     def name(self) -> Text:
         return "action_consejo_pastoral"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         church_info = BIBLE_DATA.get("church", {}) if isinstance(BIBLE_DATA, dict) else {}
         
@@ -475,15 +500,16 @@ class ActionConsejoPastoral(Action):
         return []
 
 # GAMIFICACIÓN - SISTEMA DE QUIZ
+@instrumented
 class ActionStartQuiz(Action):
     """Inicia un quiz bíblico de 3 preguntas"""
     
     def name(self) -> Text:
         return "action_start_quiz"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         if "questions" not in QUIZ_DATA:
             dispatcher.utter_message(text="Lo siento, no hay preguntas disponibles en este momento.")
@@ -491,16 +517,18 @@ class ActionStartQuiz(Action):
         
         # Guardar estadística de uso
         user_id = tracker.sender_id
-        save_usage_stat(user_id, "quiz_start", True)
+        await record_metric(save_usage_stat, user_id, "quiz_start", True)
         
-        # Seleccionar 3 preguntas aleatorias
-        questions = random.sample(QUIZ_DATA["questions"], 3)
+        # Seleccionar 3 preguntas que el usuario no haya visto (O(k), ver engine/selection.py)
+        await run_blocking(migrate)
+        questions = await run_blocking(pick_unseen, QUIZ_DATA["bank"], user_id, "quiz", 3)
         
         # Guardar las preguntas en el slot para el quiz
         quiz_data = {
             "questions": questions,
             "current_question": 0,
             "score": 0,
+            "answers": [],
             "start_time": datetime.now().isoformat()
         }
         
@@ -508,22 +536,23 @@ class ActionStartQuiz(Action):
         question = questions[0]
         options_text = "\n".join([f"{i+1}. {option}" for i, option in enumerate(question["options"])])
         
-        response = f"**Quiz Bíblico**\n\nPregunta 1 de 3:\n\n{question['question']}\n\n{options_text}\n\nResponde con el número de tu opción (1, 2, 3 o 4)."
+        response = f"**Quiz Bíblico**\n\nPregunta 1 de {len(questions)}:\n\n{question['question']}\n\n{options_text}\n\nResponde con el número de tu opción (1, 2, 3 o 4)."
         
         dispatcher.utter_message(text=response)
         
         # Guardar en slot para usar en el procesamiento
         return [SlotSet("quiz_data", quiz_data)]
 
+@instrumented
 class ActionProcessQuizAnswer(Action):
     """Procesa la respuesta del quiz y muestra la siguiente pregunta"""
     
     def name(self) -> Text:
         return "action_process_quiz_answer"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         # Obtener la respuesta del usuario
         user_answer = tracker.latest_message.get("text", "").strip()
@@ -561,6 +590,7 @@ class ActionProcessQuizAnswer(Action):
         
         # Actualizar datos del quiz
         quiz_data["score"] = score
+        quiz_data.setdefault("answers", []).append(answer_number)
         quiz_data["current_question"] = current_question + 1
         
         # Verificar si es la última pregunta
@@ -570,8 +600,8 @@ class ActionProcessQuizAnswer(Action):
             
             # Guardar resultado en SQLite
             user_id = tracker.sender_id
-            save_quiz_result(user_id, score, len(questions), quiz_data)
-            save_usage_stat(user_id, "quiz_complete", True)
+            await record_metric(save_quiz_result, user_id, score, len(questions), quiz_data)
+            await record_metric(save_usage_stat, user_id, "quiz_complete", True)
             
             response = f"**Quiz terminado!**\n\nPuntuación: {score}/{len(questions)} ({percentage:.1f}%)\n\n"
             
@@ -598,15 +628,16 @@ class ActionProcessQuizAnswer(Action):
             # Actualizar slot con los nuevos datos
             return [SlotSet("quiz_data", quiz_data)]
 
+@instrumented
 class ActionConfirmResponse(Action):
     """Maneja las confirmaciones de utilidad de las respuestas"""
     
     def name(self) -> Text:
         return "action_confirm_response"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         # Detectar si la respuesta fue útil o no
         message = tracker.latest_message.get("text", "").lower()
@@ -620,7 +651,7 @@ class ActionConfirmResponse(Action):
         entities = str(tracker.latest_message.get("entities", []))
         
         # Actualizar la última consulta con el feedback
-        save_user_query(user_id, intent, entities, is_helpful)
+        await record_metric(save_user_query, user_id, intent, entities, is_helpful)
         
         if is_helpful:
             dispatcher.utter_message(text="¡Me alegra haber podido ayudarte! ¿Hay algo más en lo que pueda asistirte?")
@@ -629,15 +660,16 @@ class ActionConfirmResponse(Action):
         
         return []
 
+@instrumented
 class ActionFallback(Action):
     """Maneja casos donde no se entiende la intención del usuario"""
     
     def name(self) -> Text:
         return "action_fallback"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         response = "No estoy seguro de entenderte completamente. Puedo ayudarte con:\n\n"
         response += "• Buscar versículos bíblicos\n"
@@ -652,21 +684,27 @@ class ActionFallback(Action):
         dispatcher.utter_message(text=response)
         return []
 
+@instrumented
 class ActionShowStats(Action):
     """Muestra estadísticas del usuario"""
     
     def name(self) -> Text:
         return "action_show_stats"
 
-    def run(self, dispatcher: CollectingDispatcher,
-            tracker: Tracker,
-            domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
+    async def run(self, dispatcher: CollectingDispatcher,
+                  tracker: Tracker,
+                  domain: Dict[Text, Any]) -> List[Dict[Text, Any]]:
         
         user_id = tracker.sender_id
         
         # Obtener historial del usuario
-        quiz_history = get_user_quiz_history(user_id, 5)
-        leaderboard = get_leaderboard(5)
+        quiz_history = await run_blocking(get_user_quiz_history, user_id, 5)
+        leaderboard = await run_blocking(get_leaderboard, 5)
+        
+        # Ranking semanal de XP (trivia, SRS, misiones, bingo), mantenido en cada add_xp
+        await run_blocking(migrate)
+        weekly_rank = await run_blocking(get_xp_rank, user_id, "week")
+        weekly_top = await run_blocking(get_xp_leaderboard, "week", 5)
         
         response = "**Tus Estadísticas:**\n\n"
         
@@ -681,5 +719,12 @@ class ActionShowStats(Action):
         for i, player in enumerate(leaderboard, 1):
             response += f"{i}. Usuario {player['user_id'][:8]}... - {player['best_percentage']:.1f}% ({player['best_score']}/{3})\n"
         
+        if weekly_top:
+            response += "\n**XP de la semana:**\n"
+            for player in weekly_top:
+                response += f"{player['rank']}. Usuario {player['user_id'][:8]}... - {player['xp']} XP\n"
+            if weekly_rank:
+                response += f"Tu puesto: {weekly_rank['rank']} de {weekly_rank['players']} ({weekly_rank['xp']} XP)\n"
+        
         dispatcher.utter_message(text=response)
         return []
@@ -1,21 +1,197 @@
+import os
 import random
+import time
+from functools import lru_cache
 from .utils import load_json, get_content_path
-from .db import add_xp
+from .db import add_xp, award_xp_once, load_session, save_session
 
+DEFAULT_VALUES = ["Amor", "Gozo", "Paz", "Paciencia", "Bondad", "Fe", "Mansedumbre", "Templanza", "Gratitud"]
+BINGO_XP = 30
 
-def generate_bingo_board(size: int = 3) -> list[list[str]]:
-    bank = load_json(get_content_path("bible_content.json"), {"values": [
-        "Amor", "Gozo", "Paz", "Paciencia", "Bondad", "Fe", "Mansedumbre", "Templanza", "Gratitud"
-    ]})
-    values = list(bank.get("values", []))
-    random.shuffle(values)
+# Valores del bingo en memoria; se recargan solo si cambia el archivo
+_values: tuple[str, ...] | None = None
+_values_mtime: float | None = None
+
+
+def bingo_values() -> tuple[str, ...]:
+    global _values, _values_mtime
+    try:
+        mtime = os.stat(get_content_path("bible_content.json")).st_mtime
+    except OSError:
+        mtime = None
+    if _values is None or mtime != _values_mtime:
+        bank = load_json(get_content_path("bible_content.json"), {"values": DEFAULT_VALUES})
+        _values = tuple(bank.get("values") or DEFAULT_VALUES)
+        _values_mtime = mtime
+    return _values
+
+
+@lru_cache(maxsize=None)
+def win_masks(size: int) -> tuple[int, ...]:
+    # Bit (fila * size + columna) por casilla: filas, columnas y las dos diagonales
+    rows = [sum(1 << (r * size + c) for c in range(size)) for r in range(size)]
+    cols = [sum(1 << (r * size + c) for r in range(size)) for c in range(size)]
+    diagonals = [
+        sum(1 << (i * size + i) for i in range(size)),
+        sum(1 << (i * size + size - 1 - i) for i in range(size)),
+    ]
+    return tuple(rows + cols + diagonals)
+
+
+def has_bingo(marks: int, size: int = 3) -> bool:
+    return any(marks & mask == mask for mask in win_masks(size))
+
+
+def _cells(values: tuple[str, ...], size: int, rng: random.Random) -> list[str]:
     needed = size * size
-    picked = (values[:needed] if len(values) >= needed else (values * ((needed // len(values)) + 1))[:needed])
-    return [picked[i*size:(i+1)*size] for i in range(size)]
+    if len(values) >= needed:
+        return rng.sample(values, needed)
+    picked = list(values) * ((needed // len(values)) + 1)
+    rng.shuffle(picked)
+    return picked[:needed]
+
+
+def generate_boards(player_ids: list[str], size: int = 3, seed: int | str = 0) -> dict[str, list[list[str]]]:
+    # Cada tablero depende solo de (seed, jugador): se puede regenerar sin guardarlo
+    values = bingo_values()
+    boards = {}
+    for player_id in player_ids:
+        cells = _cells(values, size, random.Random(f"{seed}|{player_id}"))
+        boards[player_id] = [cells[i*size:(i+1)*size] for i in range(size)]
+    return boards
+
+
+def generate_bingo_board(size: int = 3, seed: int | str | None = None) -> list[list[str]]:
+    seed = random.randrange(1 << 30) if seed is None else seed
+    return generate_boards([""], size, seed)[""]
+
+
+class BingoGame:
+    # Bingo en vivo para un grupo: las marcas de cada tablero son un entero
+    # (un bit por casilla) y cada valor cantado se resuelve con un índice
+    # valor -> [(jugador, bits)], sin recorrer los tableros.
+    def __init__(self, game_id: str, host_id: str, player_ids: list[str], size: int = 3,
+                 seed: int | str = 0, marks: dict[str, int] | None = None,
+                 called: list[str] | None = None, rewarded: list[str] | None = None):
+        self.game_id = game_id
+        self.host_id = host_id
+        self.size = size
+        self.seed = seed
+        self.boards = generate_boards(player_ids, size, seed)
+        self.marks = {player_id: 0 for player_id in player_ids}
+        self.marks.update(marks or {})
+        self.called = list(called or [])
+        self.rewarded = list(rewarded or [])
+
+        cells: dict[str, list[tuple[str, int]]] = {}
+        for player_id, board in self.boards.items():
+            by_value: dict[str, int] = {}
+            for i, value in enumerate(v for row in board for v in row):
+                by_value[value] = by_value.get(value, 0) | (1 << i)
+            for value, bits in by_value.items():
+                cells.setdefault(value, []).append((player_id, bits))
+        self._cells = cells
+
+    def call(self, value: str) -> list[str]:
+        # Marca el valor en todos los tableros que lo tienen; devuelve los nuevos ganadores
+        self.called.append(value)
+        winners = []
+        for player_id, bits in self._cells.get(value, ()):
+            before = self.marks[player_id]
+            self.marks[player_id] = before | bits
+            if not has_bingo(before, self.size) and has_bingo(self.marks[player_id], self.size):
+                winners.append(player_id)
+        return winners
+
+    def mark(self, player_id: str, row: int, col: int) -> bool:
+        # Marca manual de una casilla que coincide con un valor cantado
+        if self.boards[player_id][row][col] not in self.called:
+            return False
+        self.marks[player_id] |= 1 << (row * self.size + col)
+        return True
+
+    def next_value(self, rng: random.Random | None = None) -> str | None:
+        # Un valor de los tableros que aún no se cantó (None cuando ya se cantaron todos)
+        pending = sorted(set(self._cells) - set(self.called))
+        return (rng or random).choice(pending) if pending else None
+
+    def render(self, player_id: str) -> str:
+        # Tablero de un jugador con las casillas marcadas
+        lines = []
+        for r, row in enumerate(self.boards[player_id]):
+            cells = [f"✔{v}" if self.marks[player_id] >> (r * self.size + c) & 1 else v for c, v in enumerate(row)]
+            lines.append(" | ".join(cells))
+        return "\n".join(lines)
+
+    def winners(self) -> list[str]:
+        return [p for p, marks in self.marks.items() if has_bingo(marks, self.size)]
+
+    def reward_winners(self) -> list[str]:
+        # Premia de una vez a los ganadores que aún no recibieron XP. El premio queda
+        # registrado en xp_awards junto con la XP: otro proceso con la misma partida, o
+        # un reintento antes de save(), no vuelve a premiar (devuelve solo los nuevos)
+        new = [p for p in self.winners() if p not in self.rewarded]
+        awarded = reward_bingo_many(new, self.game_id)
+        self.rewarded.extend(new)
+        return awarded
+
+    def state(self) -> dict:
+        # Los tableros no se guardan: se regeneran desde la semilla
+        return {
+            "host_id": self.host_id, "players": list(self.boards), "size": self.size, "seed": self.seed,
+            "marks": self.marks, "called": self.called, "rewarded": self.rewarded,
+        }
+
+    def save(self) -> None:
+        save_session(self.game_id, self.host_id, "bingo", self.state())
+
+    @classmethod
+    def load(cls, game_id: str, host_id: str) -> "BingoGame | None":
+        state = load_session(game_id, host_id)
+        if state is None:
+            return None
+        return cls(game_id, host_id, state["players"], state["size"], state["seed"],
+                   state["marks"], state["called"], state["rewarded"])
+
+
+def start_game(host_id: str, player_ids: list[str] | None = None, size: int = 3) -> BingoGame:
+    # Partida nueva guardada en el shard del anfitrión; sin jugadores, juega solo él
+    game_id = f"bingo:{host_id}:{int(time.time() * 1000)}"
+    game = BingoGame(game_id, host_id, player_ids or [host_id], size, seed=random.randrange(1 << 30))
+    game.save()
+    return game
+
+
+def call_next(game_id: str, host_id: str) -> tuple[BingoGame, str | None, list[str]] | None:
+    # Canta el siguiente valor, premia a los nuevos ganadores y guarda la partida
+    game = BingoGame.load(game_id, host_id)
+    if game is None:
+        return None
+    value = game.next_value()
+    if value is not None:
+        game.call(value)
+    awarded = game.reward_winners()
+    game.save()
+    return game, value, awarded
+
+
+def mark_cell(game_id: str, host_id: str, player_id: str, row: int, col: int) -> tuple[BingoGame, bool, list[str]] | None:
+    # Marca manual de un jugador; False si la casilla no está en el tablero o su valor no se cantó
+    game = BingoGame.load(game_id, host_id)
+    if game is None or player_id not in game.boards:
+        return None
+    marked = 0 <= row < game.size and 0 <= col < game.size and game.mark(player_id, row, col)
+    awarded = game.reward_winners() if marked else []
+    if marked:
+        game.save()
+    return game, marked, awarded
 
 
 def reward_bingo(user_id: str, completed: bool) -> None:
     if completed:
-        add_xp(user_id, "bingo_complete", 30, None)
+        add_xp(user_id, "bingo_complete", BINGO_XP, None)
 
 
+def reward_bingo_many(user_ids: list[str], game_id: str) -> list[str]:
+    events = [(user_id, "bingo_complete", BINGO_XP, None) for user_id in user_ids]
+    return award_xp_once(events, f"bingo:{game_id}")
@@ -0,0 +1,138 @@
+import json
+import time
+from datetime import datetime
+
+import sqlite_metrics
+
+from . import db
+from .selection import pick_unseen
+from .trivia import TRIVIA_XP, trivia_bank
+
+UNANSWERED = -1
+
+
+# Ronda de trivia para toda una clase: el set de preguntas se guarda una vez
+# en la sesión del maestro (solo ids), cada alumno tiene un vector de
+# respuestas en classroom_answers y al cerrar se puntúa a todos juntos y se
+# escriben XP y quiz_results en una sola transacción por shard, con un premio
+# único por alumno y ronda.
+class ClassroomRound:
+    def __init__(self, session_id: str, teacher_id: str, members: list[str], questions: list[dict],
+                 started_at: str | None = None, closed: bool = False):
+        self.session_id = session_id
+        self.teacher_id = teacher_id
+        self.members = list(members)
+        self.questions = questions
+        self.started_at = started_at or datetime.utcnow().isoformat()
+        self.closed = closed
+
+    def state(self) -> dict:
+        state = {
+            "teacher_id": self.teacher_id, "members": self.members,
+            "started_at": self.started_at, "closed": int(self.closed),
+        }
+        if all("id" in q for q in self.questions):
+            state["question_ids"] = [q["id"] for q in self.questions]
+        else:
+            state["questions"] = self.questions
+        return state
+
+    def save(self) -> None:
+        db.save_session(self.session_id, self.teacher_id, "classroom", self.state())
+
+    @classmethod
+    def load(cls, session_id: str, teacher_id: str) -> "ClassroomRound | None":
+        state = db.load_session(session_id, teacher_id)
+        if state is None:
+            return None
+        questions = state.get("questions")
+        if questions is None:
+            ids = state.get("question_ids", [])
+            found = {q["id"]: q for q in trivia_bank().by_ids(ids)}
+            # Una pregunta retirada del banco deja su hueco: las respuestas guardadas siguen
+            # alineadas por posición y esa pregunta no puntúa
+            questions = [found.get(i, {"id": i, "question": None, "options": [], "correct": None}) for i in ids]
+        return cls(session_id, teacher_id, state["members"], questions, state["started_at"], bool(state["closed"]))
+
+    def answer(self, member_id: str, index: int, choice: int) -> None:
+        # Una respuesta de un alumno: cambia un carácter de su vector, sin tocar la sesión.
+        # El "cerrada" que cuenta es el de la base, no el de esta copia
+        if self.closed:
+            raise ValueError("La ronda ya está cerrada")
+        if member_id not in self.members or not 0 <= index < len(self.questions):
+            raise ValueError("Alumno o pregunta fuera de la ronda")
+        if not db.set_classroom_answer(self.session_id, self.teacher_id, member_id, index, choice, len(self.questions)):
+            self.closed = True
+            raise ValueError("La ronda ya está cerrada")
+
+    def submit(self, member_id: str, choices: list[int]) -> None:
+        # Todas las respuestas de un alumno de una vez (p. ej. desde una hoja de la clase)
+        if self.closed:
+            raise ValueError("La ronda ya está cerrada")
+        if member_id not in self.members:
+            raise ValueError("Alumno fuera de la ronda")
+        vector = _encode(choices[:len(self.questions)], len(self.questions))
+        if not db.save_classroom_answers(self.session_id, self.teacher_id, member_id, vector):
+            self.closed = True
+            raise ValueError("La ronda ya está cerrada")
+
+    def answers(self, stored: dict[str, str] | None = None) -> dict[str, list[int]]:
+        stored = db.get_classroom_answers(self.session_id, self.teacher_id) if stored is None else stored
+        return {m: _decode(stored.get(m), len(self.questions)) for m in self.members}
+
+    def scores(self, answers: dict[str, list[int]] | None = None) -> dict[str, int]:
+        answers = self.answers() if answers is None else answers
+        correct = [None if q.get("correct") is None else int(q["correct"]) for q in self.questions]
+        return {m: sum(1 for a, c in zip(answers[m], correct) if a == c) for m in self.members}
+
+    def close(self, metrics=None) -> dict[str, int] | None:
+        # Puntúa a toda la clase y escribe los premios; None si otro cierre ya los escribió.
+        # Cerrar y leer las respuestas va en una transacción (después no se aceptan más);
+        # XP y quiz_results llevan una fila por alumno en xp_awards, en la transacción de su
+        # shard. Si un shard falla la ronda queda cerrada con premios pendientes y volver a
+        # llamar a close() completa solo los que faltan
+        stored = db.close_classroom(self.session_id, self.teacher_id)
+        self.closed = True
+        if stored is None:
+            return None
+        answers = self.answers(stored)
+        scores = self.scores(answers)
+        total = len(self.questions)
+        meta = json.dumps({"session": self.session_id})
+        events = [(m, "classroom_quiz", TRIVIA_XP * s, meta) for m, s in scores.items() if s]
+        # Mismo formato que CURRENT_TIMESTAMP, como el resto de filas de métricas
+        timestamp = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        quiz_results = [
+            (m, s, total, (s / total) * 100 if total else 0.0,
+             sqlite_metrics.encode_quiz_payload({"questions": self.questions, "answers": answers[m],
+                                                 "start_time": self.started_at}),
+             timestamp)
+            for m, s in scores.items()
+        ]
+        db.award_xp_once(events, self.session_id, quiz_results, metrics)
+        # Solo un cierre concurrente se queda con el resultado
+        if not db.claim_session(self.session_id, self.teacher_id, "awarded"):
+            return None
+        return scores
+
+
+def _encode(choices: list[int], size: int) -> str:
+    marks = [str(c) if 0 <= c <= 9 else "-" for c in choices]
+    return "".join(marks) + "-" * (size - len(marks))
+
+
+def _decode(vector: str | None, size: int) -> list[int]:
+    vector = (vector or "").ljust(size, "-")[:size]
+    return [UNANSWERED if c == "-" else int(c) for c in vector]
+
+
+def start_round(teacher_id: str, member_ids: list[str], num_questions: int = 5,
+                difficulty: str | None = None, category: str | None = None) -> ClassroomRound | None:
+    # Las preguntas no se repiten entre rondas del mismo maestro
+    questions = pick_unseen(trivia_bank(), teacher_id, "classroom", num_questions, difficulty, category)
+    if not questions:
+        return None
+    session_id = f"classroom:{teacher_id}:{int(time.time() * 1000)}"
+    round_ = ClassroomRound(session_id, teacher_id, member_ids, questions)
+    round_.save()
+    return round_
@@ -0,0 +1,223 @@
+import bisect
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import unicodedata
+from array import array
+from collections.abc import Mapping, Sequence
+
+
+def normalize(text: str) -> str:
+    return ''.join(
+        c for c in unicodedata.normalize('NFD', text.lower())
+        if unicodedata.category(c) != 'Mn'
+    )
+
+
+# Índice de contenido inmutable y compacto: los versículos viven en un único
+# str y los postings del índice de temas en arrays de enteros, así que tras
+# gc.freeze() un proceso pre-fork comparte estas páginas con sus workers sin
+# que los conteos de referencias las vayan copiando (copy-on-write).
+class ContentIndex:
+    def __init__(self, verses: list[dict]):
+        parts: list[str] = []
+        offsets = array("L", [0])
+        keys: dict[str, int] = {}
+        vocabulary: dict[str, int] = {}
+        postings: list[array] = []
+        position = 0
+        for i, verse in enumerate(verses):
+            record = f"{verse['book']}\t{verse['chapter']}\t{verse['verse']}\t{verse['text']}\n"
+            parts.append(record)
+            position += len(record)
+            offsets.append(position)
+            keys.setdefault(self._key(verse["book"], verse["chapter"], verse["verse"]), i)
+
+            # Palabras de más de 2 letras, en el orden en que aparecen por primera vez
+            for word in re.findall(r'\b\w+\b', verse["text"].lower()):
+                if len(word) <= 2:
+                    continue
+                w = vocabulary.get(word)
+                if w is None:
+                    w = vocabulary[word] = len(postings)
+                    postings.append(array("L"))
+                if not postings[w] or postings[w][-1] != i:
+                    postings[w].append(i)
+
+        self._blob = "".join(parts)
+        self._offsets = offsets
+        self._keys = keys
+        self._postings = postings
+        # Vocabulario normalizado en un solo str para buscar subcadenas con str.find
+        words = [normalize(word) for word in vocabulary]
+        self._words = "\n" + "\n".join(words) + "\n"
+        starts = array("L")
+        pos = 1
+        for word in words:
+            starts.append(pos)
+            pos += len(word) + 1
+        self._word_starts = starts
+
+    @staticmethod
+    def _key(book: str, chapter, verse) -> str:
+        return f"{str(book).lower()}|{chapter}|{verse}"
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def verse(self, i: int) -> dict:
+        book, chapter, verse, text = self._blob[self._offsets[i]:self._offsets[i + 1] - 1].split("\t", 3)
+        return {"book": book, "chapter": chapter, "verse": verse, "text": text}
+
+    def lookup(self, book: str, chapter, verse) -> str | None:
+        i = self._keys.get(self._key(book, chapter, verse))
+        return None if i is None else self.verse(i)["text"]
+
+    def verses(self, limit: int | None = None):
+        for i in range(len(self) if limit is None else min(limit, len(self))):
+            yield self.verse(i)
+
+    def sample(self, k: int, rng: random.Random | None = None) -> list[dict]:
+        ids = (rng or random).sample(range(len(self)), min(k, len(self)))
+        return [self.verse(i) for i in ids]
+
+    def matching_words(self, keyword: str):
+        # Índices de las palabras del vocabulario que contienen `keyword` (ya normalizado)
+        if not keyword or "\n" in keyword:
+            return
+        pos = self._words.find(keyword)
+        while pos != -1:
+            w = bisect.bisect_right(self._word_starts, pos) - 1
+            yield w
+            next_start = self._word_starts[w + 1] if w + 1 < len(self._word_starts) else len(self._words)
+            pos = self._words.find(keyword, next_start)
+
+    def search(self, keywords: list[str], limit: int) -> list[dict]:
+        # Mismo orden que recorrer el vocabulario por palabra clave, sin duplicados
+        seen: set[int] = set()
+        out: list[dict] = []
+        for keyword in keywords:
+            for w in self.matching_words(normalize(keyword)):
+                for i in self._postings[w]:
+                    if i in seen:
+                        continue
+                    seen.add(i)
+                    out.append(self.verse(i))
+                    if len(out) >= limit:
+                        return out
+        return out
+
+
+# Representaciones compactas para cuando el contenido supera el presupuesto
+# de memoria (MAIKA_MEMORY_BUDGET_MB, ver memory_budget.py)
+
+# Solo las cadenas cortas se repiten lo suficiente como para que internarlas ahorre
+INTERN_MAX_LEN = 64
+
+
+def intern_strings(obj):
+    # Copia de `obj` con claves y cadenas cortas internadas (una sola copia por valor)
+    if isinstance(obj, str):
+        return sys.intern(obj) if len(obj) <= INTERN_MAX_LEN else obj
+    if isinstance(obj, dict):
+        return {intern_strings(k): intern_strings(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [intern_strings(v) for v in obj]
+    if isinstance(obj, tuple):
+        return tuple(intern_strings(v) for v in obj)
+    return obj
+
+
+class SpillFile:
+    # Archivo temporal (ya borrado del disco) donde se vuelcan textos largos;
+    # se lee con pread, que no mueve el offset compartido tras un fork
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> tuple[int, int]:
+        data = text.encode("utf-8")
+        with self._lock:
+            offset = self._size
+            os.pwrite(self._file.fileno(), data, offset)
+            self._size += len(data)
+        return offset, len(data)
+
+    def read(self, offset: int, length: int) -> str:
+        return os.pread(self._file.fileno(), length, offset).decode("utf-8")
+
+    def close(self):
+        self._file.close()
+
+
+class LazyRecord(Mapping):
+    # Registro cuyo campo largo se lee del SpillFile solo cuando se pide
+    __slots__ = ("_head", "_field", "_spill", "_offset", "_length")
+
+    def __init__(self, head: dict, field: str, spill: SpillFile, offset: int, length: int):
+        self._head = head
+        self._field = field
+        self._spill = spill
+        self._offset = offset
+        self._length = length
+
+    def __getitem__(self, key):
+        if key == self._field:
+            return self._spill.read(self._offset, self._length)
+        return self._head[key]
+
+    def __iter__(self):
+        yield from self._head
+        yield self._field
+
+    def __len__(self) -> int:
+        return len(self._head) + 1
+
+
+class LazyRecords(Sequence):
+    # Lista de registros (historias, conceptos) que mantiene en memoria solo los
+    # campos cortos; el cuerpo de cada uno (`field`) vive en el SpillFile
+    def __init__(self, records: list[dict], field: str, spill: SpillFile | None = None):
+        self.field = field
+        self._spill = spill or SpillFile()
+        self._heads: list[dict] = []
+        self._offsets = array("Q")
+        self._lengths = array("L")
+        for record in records:
+            head = intern_strings({k: v for k, v in record.items() if k != field})
+            offset, length = self._spill.write(str(record.get(field, "")))
+            self._heads.append(head)
+            self._offsets.append(offset)
+            self._lengths.append(length)
+
+    def __len__(self) -> int:
+        return len(self._heads)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return LazyRecord(self._heads[i], self.field, self._spill, self._offsets[i], self._lengths[i])
+
+
+# Campo largo de cada colección que se carga bajo demanda en modo compacto
+LAZY_FIELDS = {"stories": "summary", "concepts": "definition"}
+
+
+def lean_content(data: dict, spill: SpillFile | None = None) -> dict:
+    # - los versículos ya viven en ContentIndex: se descarta su copia en crudo
+    # - historias y conceptos guardan su cuerpo en disco y lo leen al usarlo
+    # - el resto se queda con sus cadenas internadas
+    spill = spill or SpillFile()
+    lean = {}
+    for key, value in data.items():
+        if key == "verses":
+            lean[key] = []
+        elif key in LAZY_FIELDS and isinstance(value, list):
+            lean[key] = LazyRecords(value, LAZY_FIELDS[key], spill)
+        else:
+            lean[key] = intern_strings(value)
+    return lean
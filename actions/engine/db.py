@@ -1,93 +1,203 @@
+import json
 import os
 import sqlite3
+import threading
 from contextlib import contextmanager
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
+import sqlite_storage
 
-DB_PATH = os.getenv("MAIKA_DB", "metrics.db")
+from .leaderboard import RankCache, period_key, period_keys
+from .streaks import advance, current_as_of
 
 
-def _ensure_parent_dir(path: str) -> None:
-    parent = os.path.dirname(os.path.abspath(path))
-    if parent and not os.path.exists(parent):
-        os.makedirs(parent, exist_ok=True)
+DB_PATH = sqlite_storage.DB_PATH
+SHARDS = sqlite_storage.SHARDS
+COMPACT_AFTER_DAYS = int(os.getenv("MAIKA_COMPACT_AFTER_DAYS", "90"))
+
+
+# Fachada sobre sqlite_storage: la conexión persistente y los pragmas son los
+# mismos que usa sqlite_metrics cuando ambos apuntan al mismo archivo.
+# Con MAIKA_SHARDS > 1 cada usuario vive en el shard que indica su hash.
+def _storage(user_id: str | None = None) -> sqlite_storage.Storage:
+    if user_id is None:
+        return sqlite_storage.get_storage(DB_PATH)
+    return sqlite_storage.get_user_storage(user_id, DB_PATH, SHARDS)
 
 
 @contextmanager
-def get_connection(readonly: bool = False):
-    uri = DB_PATH
-    _ensure_parent_dir(uri)
-    conn = sqlite3.connect(uri)
-    conn.row_factory = sqlite3.Row
-    try:
+def get_connection(readonly: bool = False, user_id: str | None = None):
+    with _storage(user_id).connection() as conn:
         yield conn
         if not readonly:
             conn.commit()
-    finally:
-        conn.close()
 
 
 def migrate() -> None:
-    with get_connection() as conn:
-        cur = conn.cursor()
+    # Tras la primera llamada del proceso no toca la base
+    for storage in sqlite_storage.all_storages(DB_PATH, SHARDS):
+        storage.ensure_schema("engine", _create_schema)
+        storage.run_once("engine_xp_leaderboard_v1", _backfill_xp_leaderboard)
+        storage.run_once("engine_user_streaks_v1", _backfill_streaks)
 
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS users (
-                user_id TEXT PRIMARY KEY,
-                created_at TEXT NOT NULL,
-                display_name TEXT
-            )
-            """
+
+def _create_schema(cur: sqlite3.Cursor) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            created_at TEXT NOT NULL,
+            display_name TEXT
         )
+        """
+    )
 
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS xp_events (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                kind TEXT NOT NULL,
-                amount INTEGER NOT NULL,
-                meta_json TEXT,
-                created_at TEXT NOT NULL,
-                FOREIGN KEY(user_id) REFERENCES users(user_id)
-            )
-            """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS xp_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            meta_json TEXT,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(user_id)
         )
+        """
+    )
 
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS srs_reviews (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                item_id TEXT NOT NULL,
-                due_at TEXT NOT NULL,
-                ease REAL NOT NULL DEFAULT 2.5,
-                interval_days INTEGER NOT NULL DEFAULT 0,
-                last_result TEXT,
-                updated_at TEXT NOT NULL,
-                FOREIGN KEY(user_id) REFERENCES users(user_id)
-            )
-            """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS srs_reviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            due_at TEXT NOT NULL,
+            ease REAL NOT NULL DEFAULT 2.5,
+            interval_days INTEGER NOT NULL DEFAULT 0,
+            last_result TEXT,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(user_id)
         )
+        """
+    )
 
-        cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS sessions (
-                id TEXT PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                kind TEXT NOT NULL,
-                state_json TEXT,
-                created_at TEXT NOT NULL,
-                updated_at TEXT NOT NULL,
-                FOREIGN KEY(user_id) REFERENCES users(user_id)
-            )
-            """
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            state_json TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(user_id)
+        )
+        """
+    )
+
+    # Agregados diarios de xp_events compactados (ver compact_xp_events)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS xp_daily (
+            day TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            events INTEGER NOT NULL DEFAULT 0,
+            amount INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id, kind)
+        )
+        """
+    )
+    # Total de un usuario (get_user_xp) sin recorrer ninguna de las dos tablas
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_xp_events_user ON xp_events(user_id, amount)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_xp_daily_user ON xp_daily(user_id, amount)")
+
+    # XP por periodo (day:AAAA-MM-DD, week:AAAA-Unn, all) y usuario, sumado en cada add_xp
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS xp_leaderboard (
+            period TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            xp INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (period, user_id)
+        )
+        """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_xp_leaderboard_rank ON xp_leaderboard(period, xp DESC, user_id)"
+    )
+
+    # Racha diaria por usuario, actualizada en cada add_xp
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_streaks (
+            user_id TEXT PRIMARY KEY,
+            current_streak INTEGER NOT NULL DEFAULT 0,
+            longest_streak INTEGER NOT NULL DEFAULT 0,
+            last_active_day TEXT NOT NULL
+        )
+        """
+    )
+
+    # Una fila por misión completada y periodo (día o semana): reclamarla dos veces no suma XP
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS mission_completions (
+            user_id TEXT NOT NULL,
+            mission_id TEXT NOT NULL,
+            period TEXT NOT NULL,
+            completed_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, mission_id, period)
+        )
+        """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_mission_completions_period ON mission_completions(mission_id, period, user_id)"
+    )
+
+    # Respuestas de cada alumno en una ronda de clase: un carácter por pregunta ("-" = sin responder)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS classroom_answers (
+            session_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            answers TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (session_id, user_id)
         )
+        """
+    )
+
+    # Premios de una sola vez por usuario (ganar un bingo, el cierre de una ronda de clase):
+    # la fila se escribe en la misma transacción que la XP, así que reintentar no repite premios
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS xp_awards (
+            user_id TEXT NOT NULL,
+            award_id TEXT NOT NULL,
+            awarded_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, award_id)
+        )
+        """
+    )
+
+    # Preguntas ya vistas por usuario y banco, como bitset indexado por id de pregunta
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS question_seen (
+            user_id TEXT NOT NULL,
+            bank TEXT NOT NULL,
+            bits BLOB NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, bank)
+        )
+        """
+    )
 
 
 def ensure_user(user_id: str, display_name: str | None = None) -> None:
-    with get_connection() as conn:
+    with get_connection(user_id=user_id) as conn:
         cur = conn.cursor()
         cur.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
         if cur.fetchone() is None:
@@ -97,25 +207,497 @@ def ensure_user(user_id: str, display_name: str | None = None) -> None:
             )
 
 
+def _backfill_xp_leaderboard(cur: sqlite3.Cursor) -> None:
+    # Una agregación en SQL por el historial de los archivos que ya tenían XP; las claves
+    # son las de period_key (la semana, como en week_of_year, sin depender de '%U')
+    cur.execute(
+        """
+        INSERT INTO xp_leaderboard(period, user_id, xp)
+        SELECT period, user_id, SUM(amount) FROM (
+            SELECT 'day:' || substr(created_at, 1, 10) AS period, user_id, amount FROM xp_events
+            UNION ALL
+            SELECT printf('week:%s-U%02d', strftime('%Y', day),
+                          (strftime('%j', day) + 6 - strftime('%w', day)) / 7), user_id, amount
+            FROM (SELECT substr(created_at, 1, 10) AS day, user_id, amount FROM xp_events)
+            UNION ALL
+            SELECT 'all', user_id, amount FROM xp_events
+            UNION ALL
+            SELECT 'all', user_id, amount FROM xp_daily
+        )
+        GROUP BY period, user_id
+        """
+    )
+
+
+# Misma regla que streaks.advance, sobre los valores previos de la fila
+_STREAK_NEXT = """
+    CASE
+        WHEN user_streaks.last_active_day >= excluded.last_active_day THEN user_streaks.current_streak
+        WHEN user_streaks.last_active_day = date(excluded.last_active_day, '-1 day')
+            THEN user_streaks.current_streak + 1
+        ELSE 1
+    END
+"""
+
+
+def _backfill_streaks(cur: sqlite3.Cursor) -> int:
+    # Una pasada en streaming por los días activos, ordenados por usuario y fecha
+    # (incluye los días ya compactados en xp_daily)
+    rows = cur.connection.execute(
+        """
+        SELECT user_id, substr(created_at, 1, 10) AS day FROM xp_events
+        UNION
+        SELECT user_id, day FROM xp_daily
+        ORDER BY user_id, day
+        """
+    )
+    streaks = []
+    user, state = None, (0, 0, None)
+    for user_id, day in rows:
+        if user_id != user:
+            if user is not None:
+                streaks.append((user, state[0], state[1], state[2].isoformat()))
+            user, state = user_id, (0, 0, None)
+        state = advance(*state, date.fromisoformat(day))
+    if user is not None:
+        streaks.append((user, state[0], state[1], state[2].isoformat()))
+    cur.executemany(
+        """
+        INSERT OR REPLACE INTO user_streaks(user_id, current_streak, longest_streak, last_active_day)
+        VALUES (?,?,?,?)
+        """,
+        streaks,
+    )
+    return len(streaks)
+
+
+def backfill_streaks() -> int:
+    # Recalcula todas las rachas desde el historial (python sqlite_metrics.py backfill-streaks)
+    users = 0
+    for storage in sqlite_storage.all_storages(DB_PATH, SHARDS):
+        with storage.transaction() as conn:
+            users += _backfill_streaks(conn.cursor())
+    return users
+
+
+def _insert_xp(conn: sqlite3.Connection, events: list[tuple[str, str, int, str | None]],
+               now: str) -> list[tuple[str, str, int]]:
+    conn.executemany(
+        "INSERT INTO xp_events(user_id, kind, amount, meta_json, created_at) VALUES (?,?,?,?,?)",
+        [(user_id, kind, amount, meta_json, now) for user_id, kind, amount, meta_json in events],
+    )
+    periods = period_keys(datetime.fromisoformat(now).date())
+    conn.executemany(
+        """
+        INSERT INTO xp_leaderboard(period, user_id, xp) VALUES (?,?,?)
+        ON CONFLICT(period, user_id) DO UPDATE SET xp = xp + excluded.xp
+        """,
+        [(period, event[0], event[2]) for event in events for period in periods],
+    )
+    conn.executemany(
+        f"""
+        INSERT INTO user_streaks(user_id, current_streak, longest_streak, last_active_day) VALUES (?,1,1,?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            current_streak = {_STREAK_NEXT},
+            longest_streak = MAX(user_streaks.longest_streak, {_STREAK_NEXT}),
+            last_active_day = MAX(user_streaks.last_active_day, excluded.last_active_day)
+        """,
+        [(user_id, now[:10]) for user_id in dict.fromkeys(event[0] for event in events)],
+    )
+    if not _rank_caches or not events:
+        return []
+    # XP total resultante por (periodo, usuario), para fijarlo en los rankings en memoria
+    users = list(dict.fromkeys(event[0] for event in events))
+    return conn.execute(
+        f"""
+        SELECT period, user_id, xp FROM xp_leaderboard
+        WHERE period IN ({",".join("?" * len(periods))}) AND user_id IN ({",".join("?" * len(users))})
+        """,
+        (*periods, *users),
+    ).fetchall()
+
+
+# Rankings en memoria por ventana (solo el periodo en curso de cada una)
+_rank_caches: dict[str, RankCache] = {}
+_rank_caches_lock = threading.Lock()
+
+
+def _offer_xp(totals: list[tuple[str, str, int]]) -> None:
+    # Tras confirmar la escritura, los rankings ya cargados se actualizan sin releer
+    for cache in list(_rank_caches.values()):
+        for period, user_id, xp in totals:
+            if cache.period == period:
+                cache.set(user_id, xp)
+
+
 def add_xp(user_id: str, kind: str, amount: int, meta_json: str | None = None) -> None:
     ensure_user(user_id)
-    with get_connection() as conn:
-        conn.execute(
-            "INSERT INTO xp_events(user_id, kind, amount, meta_json, created_at) VALUES (?,?,?,?,?)",
-            (user_id, kind, amount, meta_json, datetime.utcnow().isoformat()),
-        )
+    events = [(user_id, kind, amount, meta_json)]
+    now = datetime.utcnow().isoformat()
+    with get_connection(user_id=user_id) as conn:
+        totals = _insert_xp(conn, events, now)
+    _offer_xp(totals)
+
+
+def add_xp_many(events: list[tuple[str, str, int, str | None]], quiz_results: list[tuple] | None = None,
+                metrics=None) -> int:
+    # Premios de un grupo (user_id, kind, amount, meta_json): una transacción por shard.
+    # Las filas de quiz_results (user_id primero) van con `metrics` (MetricsManager o
+    # ShardedMetricsManager, por defecto el de sqlite_metrics); si comparte el archivo,
+    # en esa misma transacción
+    _add_xp_many(events, quiz_results, metrics)
+    return len(events)
+
+
+def award_xp_once(events: list[tuple[str, str, int, str | None]], award_id: str,
+                  quiz_results: list[tuple] | None = None, metrics=None) -> list[str]:
+    # Como add_xp_many, pero cada usuario recibe `award_id` una sola vez: su fila en xp_awards
+    # va en la misma transacción que su XP (y que sus quiz_results si comparten archivo), así
+    # que si falla un shard, repetir la llamada completa solo lo que faltó. Devuelve los
+    # usuarios premiados en esta llamada
+    return _add_xp_many(events, quiz_results, metrics, award_id)
+
+
+def _add_xp_many(events: list[tuple[str, str, int, str | None]], quiz_results: list[tuple] | None,
+                 metrics, award_id: str | None = None) -> list[str]:
+    if quiz_results and metrics is None:
+        import sqlite_metrics
+
+        metrics = sqlite_metrics.metrics_manager
+    by_storage: dict[sqlite_storage.Storage, tuple[list, list]] = {}
+    for event in events:
+        by_storage.setdefault(_storage(event[0]), ([], []))[0].append(event)
+    for row in quiz_results or []:
+        by_storage.setdefault(_storage(row[0]), ([], []))[1].append(row)
+    now = datetime.utcnow().isoformat()
+    totals: list[tuple[str, str, int]] = []
+    awarded: list[str] = []
+    for storage, (shard_events, shard_results) in by_storage.items():
+        with storage.transaction() as conn:
+            users = list(dict.fromkeys([e[0] for e in shard_events] + [r[0] for r in shard_results]))
+            if award_id is not None:
+                users = [
+                    user_id for user_id in users
+                    if conn.execute(
+                        "INSERT OR IGNORE INTO xp_awards(user_id, award_id, awarded_at) VALUES (?,?,?)",
+                        (user_id, award_id, now),
+                    ).rowcount
+                ]
+                shard_events = [e for e in shard_events if e[0] in users]
+                shard_results = [r for r in shard_results if r[0] in users]
+            awarded.extend(users)
+            conn.executemany(
+                "INSERT OR IGNORE INTO users(user_id, created_at) VALUES (?,?)",
+                [(user_id, now) for user_id in dict.fromkeys(e[0] for e in shard_events)],
+            )
+            totals.extend(_insert_xp(conn, shard_events, now))
+            manager = None
+            if shard_results:
+                manager = metrics.shard_for(shard_results[0][0]) if hasattr(metrics, "shard_for") else metrics
+            if manager is not None and manager.storage is storage:
+                # write_batch confirma la transacción de la conexión: XP y resultados en un solo commit
+                manager.write_batch({"quiz_results": shard_results})
+                manager = None
+        if manager is not None:
+            # En otro archivo no hay transacción común: se escriben tras confirmar la XP
+            manager.write_batch({"quiz_results": shard_results})
+    _offer_xp(totals)
+    return awarded
 
 
 def get_user_xp(user_id: str) -> int:
-    with get_connection(True) as conn:
+    with get_connection(True, user_id) as conn:
         cur = conn.execute(
-            "SELECT COALESCE(SUM(amount),0) AS total FROM xp_events WHERE user_id = ?",
-            (user_id,),
+            """
+            SELECT (SELECT COALESCE(SUM(amount),0) FROM xp_events WHERE user_id = ?)
+                 + (SELECT COALESCE(SUM(amount),0) FROM xp_daily WHERE user_id = ?) AS total
+            """,
+            (user_id, user_id),
         )
         row = cur.fetchone()
         return int(row[0] if row else 0)
 
 
+def compact_xp_events(older_than_days: int = COMPACT_AFTER_DAYS) -> int:
+    # Acumula los días completos anteriores al corte en xp_daily y borra los eventos crudos
+    cutoff_day = (datetime.utcnow() - timedelta(days=older_than_days)).date().isoformat()
+    deleted = 0
+    for storage in sqlite_storage.all_storages(DB_PATH, SHARDS):
+        with storage.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO xp_daily(day, user_id, kind, events, amount)
+                SELECT substr(created_at, 1, 10), user_id, kind, COUNT(*), SUM(amount)
+                FROM xp_events
+                WHERE created_at < ?
+                GROUP BY substr(created_at, 1, 10), user_id, kind
+                ON CONFLICT(day, user_id, kind) DO UPDATE SET
+                    events = events + excluded.events,
+                    amount = amount + excluded.amount
+                """,
+                (cutoff_day,),
+            )
+            cur = conn.execute("DELETE FROM xp_events WHERE created_at < ?", (cutoff_day,))
+            deleted += cur.rowcount
+            # Los rankings diarios y semanales viejos ya no se consultan
+            cutoff = datetime.fromisoformat(cutoff_day).date()
+            for window in ("day", "week"):
+                conn.execute(
+                    "DELETE FROM xp_leaderboard WHERE period >= ? AND period < ?",
+                    (f"{window}:", period_key(window, cutoff)),
+                )
+        with storage.connection() as conn:
+            conn.execute("PRAGMA incremental_vacuum").fetchall()
+    return deleted
+
+
+def _rank_cache(window: str, day: date | None = None) -> RankCache:
+    period = period_key(window, day or datetime.utcnow().date())
+    with _rank_caches_lock:
+        cache = _rank_caches.get(window)
+        if cache is None or cache.period != period:
+            cache = _rank_caches[window] = RankCache(period)
+    if not cache.fresh():
+        # Solo el top-K de cada shard, leído en orden de idx_xp_leaderboard_rank
+        rows: list[tuple[str, int]] = []
+        players = 0
+        for storage in sqlite_storage.all_storages(DB_PATH, SHARDS):
+            with storage.connection() as conn:
+                rows.extend(conn.execute(
+                    "SELECT user_id, xp FROM xp_leaderboard WHERE period = ? ORDER BY xp DESC, user_id LIMIT ?",
+                    (period, cache.capacity),
+                ).fetchall())
+                players += conn.execute(
+                    "SELECT COUNT(*) FROM xp_leaderboard WHERE period = ?", (period,)
+                ).fetchone()[0]
+        cache.load(rows, players)
+    return cache
+
+
+def get_xp_leaderboard(window: str = "week", limit: int = 10, day: date | None = None) -> list[dict]:
+    # Top-K de XP del día, la semana o de siempre
+    cache = _rank_cache(window, day)
+    top = cache.top(limit)
+    if top is None:
+        rows: list[tuple[str, int]] = []
+        for storage in sqlite_storage.all_storages(DB_PATH, SHARDS):
+            with storage.connection() as conn:
+                rows.extend(conn.execute(
+                    "SELECT user_id, xp FROM xp_leaderboard WHERE period = ? ORDER BY xp DESC, user_id LIMIT ?",
+                    (cache.period, limit),
+                ).fetchall())
+        top = sorted(rows, key=lambda row: (-row[1], row[0]))[:limit]
+    return [{"rank": i + 1, "user_id": user_id, "xp": xp} for i, (user_id, xp) in enumerate(top)]
+
+
+def get_xp_rank(user_id: str, window: str = "week", day: date | None = None) -> dict | None:
+    cache = _rank_cache(window, day)
+    found = cache.rank(user_id)
+    if found is None and not cache.complete:
+        # Fuera del top-K: su XP en su shard y cuántos lo superan, contado sobre el índice
+        with get_connection(True, user_id) as conn:
+            row = conn.execute(
+                "SELECT xp FROM xp_leaderboard WHERE period = ? AND user_id = ?", (cache.period, user_id)
+            ).fetchone()
+        if row is not None:
+            above = 0
+            for storage in sqlite_storage.all_storages(DB_PATH, SHARDS):
+                with storage.connection() as conn:
+                    above += conn.execute(
+                        "SELECT COUNT(*) FROM xp_leaderboard WHERE period = ? AND xp > ?", (cache.period, row[0])
+                    ).fetchone()[0]
+            found = (above + 1, row[0])
+    if found is None:
+        return None
+    return {"rank": found[0], "xp": found[1], "players": max(cache.players, found[0])}
+
+
+def get_streak(user_id: str, today: date | None = None) -> dict:
+    # Lectura O(1) de la fila del usuario; sin recorrer xp_events
+    with get_connection(True, user_id) as conn:
+        row = conn.execute(
+            "SELECT current_streak, longest_streak, last_active_day FROM user_streaks WHERE user_id = ?",
+            (user_id,),
+        ).fetchone()
+    if row is None:
+        return {"current": 0, "longest": 0, "last_active_day": None}
+    last_day = date.fromisoformat(row[2])
+    return {
+        "current": current_as_of(row[0], last_day, today or datetime.utcnow().date()),
+        "longest": row[1],
+        "last_active_day": row[2],
+    }
+
+
+def get_seen_questions(user_id: str, bank: str) -> bytearray:
+    with get_connection(True, user_id) as conn:
+        row = conn.execute(
+            "SELECT bits FROM question_seen WHERE user_id = ? AND bank = ?",
+            (user_id, bank),
+        ).fetchone()
+        return bytearray(row[0]) if row else bytearray()
+
+
+@contextmanager
+def seen_questions(user_id: str, bank: str):
+    # Bitset de preguntas vistas para leer y modificar en una sola transacción: dos quizzes
+    # simultáneos del mismo usuario no se pisan las marcas. BEGIN IMMEDIATE toma el lock de
+    # escritura antes de leer, así tampoco otro proceso escribe entre la lectura y el guardado.
+    with _storage(user_id).transaction() as conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT bits FROM question_seen WHERE user_id = ? AND bank = ?",
+            (user_id, bank),
+        ).fetchone()
+        seen = bytearray(row[0]) if row else bytearray()
+        before = bytes(seen)
+        yield seen
+        if seen != before:
+            conn.execute(
+                """
+                INSERT INTO question_seen(user_id, bank, bits, updated_at) VALUES (?,?,?,?)
+                ON CONFLICT(user_id, bank) DO UPDATE SET bits = excluded.bits, updated_at = excluded.updated_at
+                """,
+                (user_id, bank, bytes(seen), datetime.utcnow().isoformat()),
+            )
+
+
+def complete_mission_once(user_id: str, mission_id: str, period: str, amount: int,
+                          meta_json: str | None = None) -> bool:
+    ensure_user(user_id)
+    now = datetime.utcnow().isoformat()
+    with get_connection(user_id=user_id) as conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO mission_completions(user_id, mission_id, period, completed_at) VALUES (?,?,?,?)",
+            (user_id, mission_id, period, now),
+        )
+        if cur.rowcount == 0:
+            return False
+        events = [(user_id, "mission_complete", amount, meta_json)]
+        totals = _insert_xp(conn, events, now)
+    _offer_xp(totals)
+    return True
+
+
+def completed_users(user_ids: list[str], mission_id: str, period: str) -> set[str]:
+    # Estado de todo un grupo: una consulta por shard sobre el índice (mission_id, period)
+    by_storage: dict[sqlite_storage.Storage, list[str]] = {}
+    for user_id in user_ids:
+        by_storage.setdefault(_storage(user_id), []).append(user_id)
+    done: set[str] = set()
+    for storage, members in by_storage.items():
+        with storage.connection() as conn:
+            cur = conn.execute(
+                f"""
+                SELECT user_id FROM mission_completions
+                WHERE mission_id = ? AND period = ? AND user_id IN ({",".join("?" * len(members))})
+                """,
+                (mission_id, period, *members),
+            )
+            done.update(row[0] for row in cur)
+    return done
+
+
+def save_session(session_id: str, user_id: str, kind: str, state: dict) -> None:
+    now = datetime.utcnow().isoformat()
+    with get_connection(user_id=user_id) as conn:
+        conn.execute(
+            """
+            INSERT INTO sessions(id, user_id, kind, state_json, created_at, updated_at) VALUES (?,?,?,?,?,?)
+            ON CONFLICT(id) DO UPDATE SET state_json = excluded.state_json, updated_at = excluded.updated_at
+            """,
+            (session_id, user_id, kind, json.dumps(state), now, now),
+        )
+
+
+def load_session(session_id: str, user_id: str) -> dict | None:
+    # Las sesiones viven en el shard de su dueño
+    with get_connection(True, user_id) as conn:
+        row = conn.execute("SELECT state_json FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+
+def _claim_session(conn: sqlite3.Connection, session_id: str, field: str = "closed") -> bool:
+    cur = conn.execute(
+        f"""
+        UPDATE sessions SET state_json = json_set(state_json, '$.{field}', 1), updated_at = ?
+        WHERE id = ? AND COALESCE(json_extract(state_json, '$.{field}'), 0) = 0
+        """,
+        (datetime.utcnow().isoformat(), session_id),
+    )
+    return cur.rowcount == 1
+
+
+def claim_session(session_id: str, user_id: str, field: str = "closed") -> bool:
+    # Marca `field` en el estado de la sesión solo si no estaba marcado (un único ganador)
+    with get_connection(user_id=user_id) as conn:
+        return _claim_session(conn, session_id, field)
+
+
+# Solo se escriben respuestas mientras la sesión siga abierta: la condición va en la misma
+# sentencia, así que una ronda cargada antes de que otro proceso la cerrara no las acepta
+_SESSION_OPEN = "EXISTS (SELECT 1 FROM sessions WHERE id = ? AND COALESCE(json_extract(state_json, '$.closed'), 0) = 0)"
+
+
+def set_classroom_answer(session_id: str, owner_id: str, user_id: str, index: int, choice: int, size: int) -> bool:
+    # Las filas viven en el shard del dueño de la sesión; el cambio de un carácter es atómico en SQL.
+    # False si la ronda ya está cerrada
+    mark = str(choice) if 0 <= choice <= 9 else "-"
+    initial = "-" * index + mark + "-" * (size - index - 1)
+    with get_connection(user_id=owner_id) as conn:
+        cur = conn.execute(
+            f"""
+            INSERT INTO classroom_answers(session_id, user_id, answers, updated_at)
+            SELECT ?, ?, ?, ? WHERE {_SESSION_OPEN}
+            ON CONFLICT(session_id, user_id) DO UPDATE SET
+                answers = substr(answers, 1, ?) || ? || substr(answers, ? + 2),
+                updated_at = excluded.updated_at
+            """,
+            (session_id, user_id, initial, datetime.utcnow().isoformat(), session_id, index, mark, index),
+        )
+        return cur.rowcount == 1
+
+
+def save_classroom_answers(session_id: str, owner_id: str, user_id: str, answers: str) -> bool:
+    with get_connection(user_id=owner_id) as conn:
+        cur = conn.execute(
+            f"""
+            INSERT INTO classroom_answers(session_id, user_id, answers, updated_at)
+            SELECT ?, ?, ?, ? WHERE {_SESSION_OPEN}
+            ON CONFLICT(session_id, user_id) DO UPDATE SET
+                answers = excluded.answers, updated_at = excluded.updated_at
+            """,
+            (session_id, user_id, answers, datetime.utcnow().isoformat(), session_id),
+        )
+        return cur.rowcount == 1
+
+
+def close_classroom(session_id: str, owner_id: str) -> dict[str, str] | None:
+    # Marca la ronda cerrada y lee las respuestas en la misma transacción: ninguna respuesta
+    # se escribe después de la lectura sin ser rechazada. None si otro cierre ya terminó de
+    # premiar (campo "awarded"); si solo estaba cerrada, se devuelven las respuestas para
+    # completar los premios pendientes
+    with _storage(owner_id).transaction() as conn:
+        # La escritura va primero: toma el lock antes de leer
+        _claim_session(conn, session_id)
+        row = conn.execute(
+            "SELECT COALESCE(json_extract(state_json, '$.awarded'), 0) FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None or row[0]:
+            return None
+        cur = conn.execute("SELECT user_id, answers FROM classroom_answers WHERE session_id = ?", (session_id,))
+        return {r[0]: r[1] for r in cur}
+
+
+def get_classroom_answers(session_id: str, owner_id: str) -> dict[str, str]:
+    with get_connection(True, owner_id) as conn:
+        cur = conn.execute(
+            "SELECT user_id, answers FROM classroom_answers WHERE session_id = ?", (session_id,)
+        )
+        return {row[0]: row[1] for row in cur}
+
+
 def upsert_srs_review(
     user_id: str,
     item_id: str,
@@ -124,7 +706,7 @@ def upsert_srs_review(
     interval_days: int,
     last_result: str | None,
 ) -> None:
-    with get_connection() as conn:
+    with get_connection(user_id=user_id) as conn:
         cur = conn.cursor()
         cur.execute(
             "SELECT id FROM srs_reviews WHERE user_id = ? AND item_id = ?",
@@ -151,7 +733,7 @@ def upsert_srs_review(
 
 
 def get_due_srs_items(user_id: str, now_iso: str) -> list[sqlite3.Row]:
-    with get_connection(True) as conn:
+    with get_connection(True, user_id) as conn:
         cur = conn.execute(
             "SELECT * FROM srs_reviews WHERE user_id = ? AND due_at <= ? ORDER BY due_at ASC",
             (user_id, now_iso),
@@ -0,0 +1,46 @@
+import asyncio
+import atexit
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import profiling
+
+# Hilos para trabajo bloqueante (SQLite, lectura de archivos) fuera del event loop
+IO_WORKERS = int(os.getenv("MAIKA_IO_WORKERS", "4"))
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="maika-io")
+    return _executor
+
+
+def shutdown(wait: bool = True) -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
+
+
+atexit.register(shutdown)
+
+
+async def run_blocking(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    # El event loop del servidor de acciones sigue atendiendo otras conversaciones;
+    # el contexto se copia para que la instrumentación (y el perfilado, si la
+    # acción fue muestreada) atribuya el trabajo a la acción
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, profiling.wrap_blocking(fn), *args, **kwargs)
+    return await loop.run_in_executor(get_executor(), call)
@@ -0,0 +1,99 @@
+import bisect
+import os
+import threading
+import time
+from datetime import date
+
+from .utils import week_of_year
+
+WINDOWS = ("day", "week", "all")
+XP_RANK_TTL = float(os.getenv("MAIKA_XP_RANK_TTL", "60"))
+XP_RANK_CACHE_SIZE = int(os.getenv("MAIKA_XP_RANK_CACHE_SIZE", "100"))
+
+
+def period_key(window: str, day: date) -> str:
+    # Clave del bucket de xp_leaderboard; comparables como texto dentro de cada ventana
+    if window == "day":
+        return f"day:{day.isoformat()}"
+    if window == "week":
+        return f"week:{day.year}-U{week_of_year(day):02d}"
+    if window == "all":
+        return "all"
+    raise ValueError(f"Ventana desconocida: {window}")
+
+
+def period_keys(day: date) -> list[str]:
+    return [period_key(window, day) for window in WINDOWS]
+
+
+# Top-K de un periodo en memoria del proceso: claves (-xp, user_id) ordenadas,
+# así que el puesto de quien está en el top es un bisect y el top-K un slice.
+# Quien queda fuera se resuelve en SQL sobre idx_xp_leaderboard_rank (ver
+# db.get_xp_rank). Las escrituras del propio proceso fijan el XP total del
+# usuario, así que repetirlas tras una recarga que ya las incluía no suma dos
+# veces; las de otros procesos se ven al recargar cuando vence el TTL (como
+# LeaderboardCache en sqlite_metrics).
+class RankCache:
+    def __init__(self, period: str, capacity: int | None = None, ttl: float = XP_RANK_TTL):
+        self.period = period
+        self.capacity = XP_RANK_CACHE_SIZE if capacity is None else capacity
+        self.ttl = ttl
+        self.players = 0
+        # True si el periodo entero cabe en el top-K: quien no está, no sumó XP
+        self.complete = False
+        self._keys: list[tuple[int, str]] = []
+        self._xp: dict[str, int] = {}
+        self._loaded_at: float | None = None
+        self._lock = threading.Lock()
+
+    def fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def load(self, rows: list[tuple[str, int]], players: int):
+        # rows: las primeras filas (user_id, xp) del periodo de cada shard; players: total del periodo
+        keys = sorted((-xp, user_id) for user_id, xp in rows)[:self.capacity]
+        with self._lock:
+            self._keys = keys
+            self._xp = {user_id: -neg for neg, user_id in keys}
+            self.players = players
+            self.complete = players <= self.capacity
+            self._loaded_at = time.monotonic()
+
+    def set(self, user_id: str, xp: int):
+        # XP total del usuario en el periodo, leído tras confirmar su escritura
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            key = (-xp, user_id)
+            old = self._xp.get(user_id)
+            if old is not None:
+                del self._keys[bisect.bisect_left(self._keys, (-old, user_id))]
+            elif not self.complete and self._keys and key > self._keys[-1]:
+                # Sigue fuera del top-K
+                return
+            elif self.complete:
+                self.players += 1
+            self._xp[user_id] = xp
+            bisect.insort(self._keys, key)
+            if len(self._keys) > self.capacity:
+                _, dropped = self._keys.pop()
+                del self._xp[dropped]
+                self.complete = False
+
+    def rank(self, user_id: str) -> tuple[int, int] | None:
+        # (puesto, xp) con empates compartiendo puesto; None si no está en el top-K
+        with self._lock:
+            xp = self._xp.get(user_id)
+            if xp is None:
+                return None
+            return bisect.bisect_left(self._keys, (-xp,)) + 1, xp
+
+    def top(self, limit: int) -> list[tuple[str, int]] | None:
+        # None si el top pedido excede lo que hay en memoria (hay que leer de SQLite)
+        with self._lock:
+            if limit > len(self._keys) and not self.complete:
+                return None
+            return [(user_id, -neg) for neg, user_id in self._keys[:limit]]
+
+    def __len__(self) -> int:
+        return len(self._keys)
@@ -1,28 +1,82 @@
-from datetime import datetime
+import os
+from datetime import date, datetime
 import json
-from .utils import load_json, get_content_path
-from .db import add_xp
+from .utils import load_json, get_content_path, week_of_year
+from .db import complete_mission_once, completed_users
 
+DEFAULT_DAILY = {"title": "Lee un versículo", "description": "Lee y comparte un versículo que te inspire hoy."}
+DEFAULT_WEEKLY = {"title": "Aprende un Salmo", "description": "Memoriza un verso del Salmo 23 esta semana."}
+MISSION_XP = 20
 
-def daily_mission(age_range: str | None = None) -> dict:
-    data = load_json(get_content_path("missions_weekly.json"), {"daily": [], "weekly": []})
-    daily = data.get("daily", [])
-    if not daily:
-        return {"title": "Lee un versículo", "description": "Lee y comparte un versículo que te inspire hoy."}
-    idx = int(datetime.utcnow().strftime("%j")) % len(daily)
-    return daily[idx]
 
+# Calendario de misiones precalculado por versión del contenido: la misión
+# de un día o de una semana es una posición en una lista (O(1) por fecha)
+class MissionCalendar:
+    def __init__(self, data: dict):
+        daily = [self._with_id("daily", m) for m in data.get("daily") or [DEFAULT_DAILY]]
+        weekly = [self._with_id("weekly", m) for m in data.get("weekly") or [DEFAULT_WEEKLY]]
+        # %j va de 1 a 366 y %U de 0 a 53
+        self._by_day = [daily[j % len(daily)] for j in range(367)]
+        self._by_week = [weekly[u % len(weekly)] for u in range(54)]
+        self._by_title = {m["title"]: m for m in weekly + daily}
 
-def weekly_mission(age_range: str | None = None) -> dict:
-    data = load_json(get_content_path("missions_weekly.json"), {"daily": [], "weekly": []})
-    weekly = data.get("weekly", [])
-    if not weekly:
-        return {"title": "Aprende un Salmo", "description": "Memoriza un verso del Salmo 23 esta semana."}
-    idx = int(datetime.utcnow().strftime("%U")) % len(weekly)
-    return weekly[idx]
+    @staticmethod
+    def _with_id(kind: str, mission: dict) -> dict:
+        return {**mission, "id": str(mission.get("id") or f"{kind}:{mission.get('title')}"), "kind": kind}
 
+    def daily(self, day: date) -> dict:
+        return self._by_day[day.timetuple().tm_yday]
 
-def complete_mission(user_id: str, mission: dict) -> None:
-    add_xp(user_id, "mission_complete", 20, json.dumps({"title": mission.get("title")}))
+    def weekly(self, day: date) -> dict:
+        return self._by_week[week_of_year(day)]
 
+    @staticmethod
+    def period(kind: str, day: date) -> str:
+        return f"{day.year}-U{week_of_year(day):02d}" if kind == "weekly" else day.isoformat()
 
+    def resolve(self, mission: dict, day: date) -> tuple[str, str]:
+        # (id, periodo) de una misión; desde el slot solo llega el título
+        if mission.get("id") and mission.get("kind"):
+            return str(mission["id"]), self.period(mission["kind"], day)
+        known = self._by_title.get(mission.get("title"))
+        if known is None:
+            return f"daily:{mission.get('title')}", self.period("daily", day)
+        return known["id"], self.period(known["kind"], day)
+
+
+_calendar: MissionCalendar | None = None
+_calendar_mtime: float | None = None
+
+
+def mission_calendar() -> MissionCalendar:
+    global _calendar, _calendar_mtime
+    try:
+        mtime = os.stat(get_content_path("missions_weekly.json")).st_mtime
+    except OSError:
+        mtime = None
+    if _calendar is None or mtime != _calendar_mtime:
+        _calendar = MissionCalendar(load_json(get_content_path("missions_weekly.json"), {"daily": [], "weekly": []}))
+        _calendar_mtime = mtime
+    return _calendar
+
+
+def daily_mission(age_range: str | None = None, day: date | None = None) -> dict:
+    return mission_calendar().daily(day or datetime.utcnow().date())
+
+
+def weekly_mission(age_range: str | None = None, day: date | None = None) -> dict:
+    return mission_calendar().weekly(day or datetime.utcnow().date())
+
+
+def complete_mission(user_id: str, mission: dict, day: date | None = None) -> bool:
+    # Idempotente: solo la primera vez en el periodo suma XP
+    mission_id, period = mission_calendar().resolve(mission, day or datetime.utcnow().date())
+    return complete_mission_once(
+        user_id, mission_id, period, MISSION_XP, json.dumps({"title": mission.get("title")})
+    )
+
+
+def group_mission_status(user_ids: list[str], mission: dict, day: date | None = None) -> dict[str, bool]:
+    mission_id, period = mission_calendar().resolve(mission, day or datetime.utcnow().date())
+    done = completed_users(user_ids, mission_id, period)
+    return {user_id: user_id in done for user_id in user_ids}
@@ -0,0 +1,102 @@
+import random
+from array import array
+
+from . import db
+
+
+# Banco de preguntas indexado: cada pregunta tiene un bit (su id) en el
+# conjunto de "ya vistas" del usuario y aparece en los buckets precalculados
+# de su dificultad y categoría (None = cualquiera). Elegir k preguntas no
+# vistas cuesta O(k) mientras queden suficientes sin ver en el bucket.
+class QuestionBank:
+    def __init__(self, questions: list[dict]):
+        self.questions = questions
+        ids = [q.get("id") for q in questions]
+        # Los ids del contenido son estables entre versiones del banco; sin ellos, la posición
+        if all(isinstance(i, int) and i >= 0 for i in ids) and len(set(ids)) == len(ids):
+            self._bits = array("L", ids)
+        else:
+            self._bits = array("L", range(len(questions)))
+
+        buckets: dict[tuple[str | None, str | None], array] = {}
+        for position, question in enumerate(questions):
+            difficulty = question.get("difficulty")
+            category = question.get("category")
+            for key in {(None, None), (difficulty, None), (None, category), (difficulty, category)}:
+                buckets.setdefault(key, array("L")).append(position)
+        self._buckets = buckets
+        self._by_id = {bit: position for position, bit in enumerate(self._bits)}
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def by_ids(self, ids: list[int]) -> list[dict]:
+        return [self.questions[self._by_id[i]] for i in ids if i in self._by_id]
+
+    def bucket_size(self, difficulty: str | None = None, category: str | None = None) -> int:
+        return len(self._buckets.get((difficulty, category), ()))
+
+    @staticmethod
+    def _is_seen(seen: bytearray, bit: int) -> bool:
+        return (bit >> 3) < len(seen) and bool(seen[bit >> 3] & (1 << (bit & 7)))
+
+    @staticmethod
+    def _mark(seen: bytearray, bit: int, value: bool = True) -> None:
+        if (bit >> 3) >= len(seen):
+            if not value:
+                return
+            seen.extend(bytes((bit >> 3) + 1 - len(seen)))
+        if value:
+            seen[bit >> 3] |= 1 << (bit & 7)
+        else:
+            seen[bit >> 3] &= ~(1 << (bit & 7)) & 0xFF
+
+    def sample(self, k: int, seen: bytearray, difficulty: str | None = None,
+               category: str | None = None, rng: random.Random | None = None) -> list[dict]:
+        # Elige hasta k preguntas del bucket que el usuario no haya visto y las marca en `seen`
+        rng = rng or random
+        bucket = self._buckets.get((difficulty, category))
+        if not bucket:
+            return []
+        k = min(k, len(bucket))
+        picked: list[int] = []
+        chosen: set[int] = set()
+
+        # Muestreo por rechazo: con la mayoría del bucket sin ver, ~k intentos
+        for _ in range(4 * k + 8):
+            if len(picked) >= k:
+                break
+            position = bucket[rng.randrange(len(bucket))]
+            if position in chosen or self._is_seen(seen, self._bits[position]):
+                continue
+            chosen.add(position)
+            picked.append(position)
+
+        if len(picked) < k:
+            # Quedan pocas sin ver: se buscan recorriendo el bucket
+            unseen = [p for p in bucket if p not in chosen and not self._is_seen(seen, self._bits[p])]
+            rng.shuffle(unseen)
+            for position in unseen[:k - len(picked)]:
+                chosen.add(position)
+                picked.append(position)
+
+        if len(picked) < k:
+            # Ya vio todo el bucket: empieza otra vuelta sin repetir dentro de este quiz
+            for position in bucket:
+                self._mark(seen, self._bits[position], False)
+            rest = [p for p in bucket if p not in chosen]
+            rng.shuffle(rest)
+            picked.extend(rest[:k - len(picked)])
+
+        for position in picked:
+            self._mark(seen, self._bits[position])
+        return [self.questions[p] for p in picked]
+
+
+def pick_unseen(bank: QuestionBank, user_id: str, bank_name: str, k: int,
+                difficulty: str | None = None, category: str | None = None,
+                rng: random.Random | None = None) -> list[dict]:
+    # Selección sin repetir lo que el usuario ya vio; el bitset se lee y guarda en SQLite
+    # dentro de la misma transacción
+    with db.seen_questions(user_id, bank_name) as seen:
+        return bank.sample(k, seen, difficulty, category, rng)
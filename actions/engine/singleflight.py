@@ -0,0 +1,35 @@
+import asyncio
+from typing import Any, Callable, Hashable
+
+import instrumentation
+
+from .executor import run_blocking
+
+
+# Coalescencia de llamadas idénticas concurrentes: mientras una búsqueda con
+# la misma clave está en curso, las siguientes esperan su resultado en lugar
+# de repetirla. Vive en el event loop del servidor de acciones; el trabajo
+# en sí corre en el pool de run_blocking().
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[..., Any], *args: Any) -> Any:
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(run_blocking(fn, *args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _, key=key: self._inflight.pop(key, None))
+            instrumentation.inc("maika_singleflight_total", {"group": self.name, "result": "leader"})
+        else:
+            self.coalesced += 1
+            instrumentation.inc("maika_singleflight_total", {"group": self.name, "result": "coalesced"})
+        # shield: si una petición se cancela, las demás siguen esperando el mismo resultado
+        return await asyncio.shield(task)
+
+    def inflight(self) -> int:
+        return len(self._inflight)
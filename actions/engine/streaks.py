@@ -0,0 +1,24 @@
+from datetime import date, timedelta
+
+
+# Racha diaria: días consecutivos con al menos una actividad que sume XP.
+# La misma regla se aplica en SQL en cada add_xp (ver db._insert_xp) y aquí
+# para el backfill desde el historial.
+def advance(current: int, longest: int, last_day: date | None, day: date) -> tuple[int, int, date]:
+    if last_day is None:
+        current = 1
+    elif day <= last_day:
+        # Mismo día (o un evento fuera de orden): la racha no cambia
+        return current, longest, last_day
+    elif day - last_day == timedelta(days=1):
+        current += 1
+    else:
+        current = 1
+    return current, max(longest, current), day
+
+
+def current_as_of(current: int, last_day: date | None, today: date) -> int:
+    # Una racha sigue viva hasta que termina el día siguiente a la última actividad
+    if last_day is None or (today - last_day).days > 1:
+        return 0
+    return current
@@ -1,20 +1,37 @@
-import random
+import os
 import json
 from .utils import load_json, get_content_path
 from .db import add_xp
+from .selection import QuestionBank, pick_unseen
+
+TRIVIA_XP = 10
+
+# Banco indexado en memoria; se reconstruye solo si cambia el archivo
+_bank: QuestionBank | None = None
+_bank_mtime: float | None = None
 
 
 def load_trivia_bank() -> dict:
     return load_json(get_content_path("trivia_bank.json"), {"questions": []})
 
 
-def start_trivia(user_id: str, num_questions: int = 5) -> dict:
-    bank = load_trivia_bank()
-    questions = list(bank.get("questions", []))
-    if not questions:
+def trivia_bank() -> QuestionBank:
+    global _bank, _bank_mtime
+    try:
+        mtime = os.stat(get_content_path("trivia_bank.json")).st_mtime
+    except OSError:
+        mtime = None
+    if _bank is None or mtime != _bank_mtime:
+        _bank = QuestionBank(list(load_trivia_bank().get("questions", [])))
+        _bank_mtime = mtime
+    return _bank
+
+
+def start_trivia(user_id: str, num_questions: int = 5, difficulty: str | None = None,
+                 category: str | None = None) -> dict:
+    selected = pick_unseen(trivia_bank(), user_id, "trivia", num_questions, difficulty, category)
+    if not selected:
         return {"questions": []}
-    random.shuffle(questions)
-    selected = questions[:num_questions]
     return {"questions": selected, "current": 0, "score": 0}
 
 
@@ -28,7 +45,7 @@ def answer_trivia(user_id: str, session: dict, answer_index: int) -> tuple[dict,
     is_correct = (answer_index == correct)
     if is_correct:
         session["score"] = int(session.get("score", 0)) + 1
-        add_xp(user_id, "trivia_correct", 10, json.dumps({"q": q.get("question")}))
+        add_xp(user_id, "trivia_correct", TRIVIA_XP, json.dumps({"q": q.get("question")}))
         verdict = "correct"
     else:
         verdict = "incorrect"
@@ -1,20 +1,29 @@
 import json
 import os
-from datetime import datetime
+from datetime import date, datetime
+
+import instrumentation
 
 
 def load_json(path: str, default: dict | list | None = None):
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return default if default is not None else {}
+    with instrumentation.timed("content"):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return default if default is not None else {}
 
 
 def iso_now() -> str:
     return datetime.utcnow().isoformat()
 
 
+def week_of_year(day: date) -> int:
+    # Igual que strftime("%U"): semanas que empiezan en domingo, 0 antes del primer domingo
+    yday = day.timetuple().tm_yday - 1
+    return (yday + 7 - (day.weekday() + 1) % 7) // 7
+
+
 def get_content_path(*parts: str) -> str:
     base = os.path.join("data", "content")
     return os.path.join(base, *parts)
@@ -0,0 +1,155 @@
+"""
+Servidor de acciones pre-fork
+El proceso padre carga e indexa el contenido una sola vez, congela el heap
+con gc.freeze() y abre el socket; los workers se crean con fork() y
+comparten esas páginas en copy-on-write en lugar de cargar cada uno su
+propia copia del índice.
+
+Uso:
+    python -m actions.prefork --workers 8 --port 5055
+"""
+
+import argparse
+import gc
+import inspect
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("MAIKA_WORKERS", str(os.cpu_count() or 1)))
+
+
+def preload(action_package: str = "actions") -> None:
+    """Importa las acciones (construye los índices) y deja el heap listo para compartir"""
+    import importlib
+    import instrumentation
+    import sqlite_metrics
+    import sqlite_storage
+
+    # Los hilos de los exportadores no sobreviven al fork (y podrían hacerlo con
+    # un lock tomado): solo los arrancan los workers, en after_fork()
+    instrumentation.defer_exporters()
+    importlib.import_module(f"{action_package}.actions")
+    for module in ("action_bingo", "action_missions", "action_srs", "action_trivia"):
+        importlib.import_module(f"{action_package}.{module}")
+
+    # Las conexiones SQLite y el hilo escritor de métricas no deben cruzar un
+    # fork: cada worker abre los suyos
+    sqlite_metrics.metrics_writer.close()
+    sqlite_storage.close_all()
+
+    # Sacar del recolector todo lo cargado hasta aquí: el GC de los workers no
+    # vuelve a recorrer (ni a escribir) esos objetos
+    gc.collect()
+    gc.freeze()
+
+
+def bind_socket(host: str, port: int, backlog: int = 1024) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve_worker(sock: socket.socket, action_package: str = "actions") -> None:
+    """Corre el servidor de rasa_sdk de un worker sobre el socket heredado"""
+    from rasa_sdk.endpoint import create_app
+
+    app = create_app(action_package)
+    options = {"sock": sock, "workers": 1, "access_log": False}
+    # Sanic >= 22.9 arranca su propio gestor de procesos salvo que se pida uno solo
+    if "single_process" in inspect.signature(app.run).parameters:
+        options["single_process"] = True
+    app.run(**options)
+
+
+def shutdown_worker() -> None:
+    """Lo que atexit haría al salir: os._exit() no lo ejecuta en los workers"""
+    import sqlite_metrics
+    import sqlite_storage
+    from actions.engine import executor
+
+    # Primero el pool (sus tareas pueden encolar métricas), luego el escritor vacía la cola
+    executor.shutdown()
+    sqlite_metrics.metrics_writer.close()
+    sqlite_storage.close_all()
+
+
+def _spawn(sock: socket.socket, action_package: str, worker: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        import instrumentation
+
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        try:
+            instrumentation.after_fork(worker)
+            serve_worker(sock, action_package)
+        finally:
+            try:
+                shutdown_worker()
+            except Exception:
+                logger.exception("Error cerrando el worker %d", worker)
+            os._exit(0)
+    return pid
+
+
+def run(workers: int, host: str = "0.0.0.0", port: int = 5055, action_package: str = "actions") -> None:
+    """Arranca `workers` procesos y los reemplaza si mueren hasta recibir SIGTERM/SIGINT"""
+    preload(action_package)
+    sock = bind_socket(host, port)
+    # pid -> número de worker (se reutiliza al reiniciar uno caído)
+    children = {_spawn(sock, action_package, i): i for i in range(workers)}
+    logger.info("Servidor de acciones en %s:%d con %d workers", host, port, workers)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        worker = children.pop(pid, None)
+        if worker is not None and not stopping:
+            logger.warning("Worker %d terminó (estado %d); reiniciando", pid, status)
+            time.sleep(0.5)
+            children[_spawn(sock, action_package, worker)] = worker
+    sock.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Servidor de acciones pre-fork con contenido compartido")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("MAIKA_ACTIONS_PORT", "5055")))
+    parser.add_argument("--actions", default="actions", help="Paquete de acciones")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    run(args.workers, args.host, args.port, args.actions)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""
+Benchmark de las acciones del bot
+Ejecuta el run() de cada acción con tracker y dispatcher falsos sobre un
+corpus y una base de datos sintéticos, reporta p50/p95/p99 y ops/s por
+escenario y guarda (o compara contra) una línea base JSON.
+
+Uso:
+    python -m benchmarks.bench_actions --verses 31102 --users 10000 \\
+        --iterations 500 --output benchmarks/results/bible-10k.json \\
+        --baseline benchmarks/results/baseline.json
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks.harness import (
+    CORPUS_SIZES, WORDS, FakeDispatcher, FakeTracker, compare, load_baseline,
+    measure, save_baseline, seed_databases, synthetic_corpus,
+)
+
+
+def build_scenarios(corpus: Dict[str, Any], users: int, seed: int = 0) -> Dict[str, Callable[[int], Tuple[Any, FakeTracker]]]:
+    """
+    Escenarios por nombre: cada uno prepara (acción, tracker) para la iteración i
+
+    Las acciones se importan aquí, después de fijar MAIKA_DB, para que el
+    manager global de métricas apunte a la base sintética.
+    """
+    from actions import actions, action_bingo, action_missions, action_srs, action_trivia
+    from actions.engine import trivia as trivia_engine
+
+    rng = random.Random(seed)
+    verses = corpus["verses"]
+
+    def user(i: int) -> str:
+        return f"bench-user-{rng.randrange(users)}" if users else f"bench-user-{i}"
+
+    def verse_search(i):
+        verse = rng.choice(verses)
+        entities = [
+            {"entity": "libro_biblico", "value": verse["book"]},
+            {"entity": "capitulo", "value": verse["chapter"]},
+            {"entity": "versiculo", "value": verse["verse"]},
+        ]
+        text = f"{verse['book']} {verse['chapter']}:{verse['verse']}"
+        return actions.ActionBuscarVersiculo(), FakeTracker(user(i), text, "preguntar_versiculo", entities)
+
+    def topic_search(i):
+        text = "versículos sobre " + " y ".join(rng.sample(WORDS, 2))
+        return actions.ActionSearchTopic(), FakeTracker(user(i), text, "buscar_por_tema")
+
+    def quiz_start(i):
+        return actions.ActionStartQuiz(), FakeTracker(user(i), "quiero hacer un quiz", "iniciar_quiz")
+
+    def quiz_answer(i):
+        questions = rng.sample(actions.QUIZ_DATA["questions"], 3)
+        # Una de cada tres respuestas cierra el quiz y escribe el resultado
+        quiz_data = {"questions": questions, "current_question": i % 3, "score": 0,
+                     "answers": [0] * (i % 3), "start_time": "2026-01-01T00:00:00"}
+        return actions.ActionProcessQuizAnswer(), FakeTracker(
+            user(i), str(rng.randint(1, 4)), "responder_quiz", slots={"quiz_data": quiz_data}
+        )
+
+    def trivia_start(i):
+        return action_trivia.ActionIniciarTrivia(), FakeTracker(user(i), "trivia", "iniciar_trivia")
+
+    trivia_session = trivia_engine.start_trivia("bench", 5)
+
+    def trivia_answer(i):
+        session = copy.deepcopy(trivia_session)
+        session["current"] = i % max(1, len(session.get("questions", [])))
+        return action_trivia.ActionResponderTrivia(), FakeTracker(
+            user(i), str(rng.randint(1, 4)), "responder_trivia", slots={"quiz_data": session}
+        )
+
+    def srs_verse(i):
+        return action_srs.ActionMostrarVerso(), FakeTracker(user(i), "verso del día", "verso_del_dia")
+
+    def srs_review(i):
+        slots = {"ultimo_versiculo": f"Juan::3::{rng.randint(1, 36)}", "srs_ease": 2.5,
+                 "srs_interval": rng.choice([0, 1, 3, 7])}
+        return action_srs.ActionRepasoVerso(), FakeTracker(
+            user(i), rng.choice(["fácil", "bien", "otra vez"]), "repasar_verso", slots=slots
+        )
+
+    def bingo(i):
+        return action_bingo.ActionBingo(), FakeTracker(user(i), "bingo", "jugar_bingo")
+
+    def mission_today(i):
+        return action_missions.ActionMisionHoy(), FakeTracker(
+            user(i), "misión de hoy", "mision_hoy", slots={"edad_rango": "8-12"}
+        )
+
+    def mission_complete(i):
+        return action_missions.ActionCompletarMision(), FakeTracker(
+            user(i), "completé la misión", "completar_mision", slots={"mission_title": "Verso y dibujo"}
+        )
+
+    def stats(i):
+        return actions.ActionShowStats(), FakeTracker(user(i), "mis estadísticas", "ver_estadisticas")
+
+    return {
+        "verse_search": verse_search,
+        "topic_search": topic_search,
+        "quiz_start": quiz_start,
+        "quiz_answer": quiz_answer,
+        "trivia_start": trivia_start,
+        "trivia_answer": trivia_answer,
+        "srs_verse": srs_verse,
+        "srs_review": srs_review,
+        "bingo": bingo,
+        "mission_today": mission_today,
+        "mission_complete": mission_complete,
+        "stats": stats,
+    }
+
+
+def run_benchmarks(verses: int, users: int, iterations: int, only: Optional[List[str]] = None,
+                   seed: int = 0) -> Dict[str, Dict[str, float]]:
+    """Indexa el corpus sintético, puebla la base y mide cada escenario"""
+    from actions.actions import BibleIndexer
+    from sqlite_metrics import flush_metrics
+
+    corpus = synthetic_corpus(verses, seed)
+    started = time.perf_counter()
+    BibleIndexer.index_bible_data(corpus)
+    index_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    seed_databases(users, seed=seed)
+    seed_seconds = time.perf_counter() - started
+
+    loop = asyncio.new_event_loop()
+    results: Dict[str, Dict[str, float]] = {}
+    try:
+        for name, prepare in build_scenarios(corpus, users, seed).items():
+            if only and name not in only:
+                continue
+
+            def call(prepared):
+                action, tracker = prepared
+                loop.run_until_complete(action.run(FakeDispatcher(), tracker, {}))
+
+            results[name] = measure(call, iterations, prepare=prepare)
+            print(f"{name:18s} p50={results[name]['p50_ms']:8.3f}ms "
+                  f"p95={results[name]['p95_ms']:8.3f}ms p99={results[name]['p99_ms']:8.3f}ms "
+                  f"{results[name]['ops_per_sec']:10.1f} ops/s", file=sys.stderr)
+    finally:
+        flush_metrics(timeout=30)
+        loop.close()
+
+    results["_setup"] = {"index_seconds": round(index_seconds, 3), "seed_seconds": round(seed_seconds, 3)}
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de las acciones con tracker y dispatcher falsos")
+    parser.add_argument("--verses", default="small",
+                        help=f"Versículos del corpus sintético: número o {sorted(CORPUS_SIZES)}")
+    parser.add_argument("--users", type=int, default=1000, help="Usuarios sintéticos en la base")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--scenario", action="append", default=None, help="Escenario a medir (repetible)")
+    parser.add_argument("--db", default=None, help="Archivo SQLite (por defecto uno temporal)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Guardar resultados como línea base JSON")
+    parser.add_argument("--baseline", default=None, help="Comparar contra una línea base JSON")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Empeoramiento de p95 tolerado")
+    args = parser.parse_args(argv)
+
+    verses = CORPUS_SIZES.get(args.verses) or int(args.verses)
+    if args.db is None:
+        args.db = os.path.join(tempfile.mkdtemp(prefix="maika-bench-"), "bench.db")
+    # Debe fijarse antes de importar sqlite_metrics / actions
+    os.environ["MAIKA_DB"] = args.db
+
+    results = run_benchmarks(verses, args.users, args.iterations, args.scenario, args.seed)
+    meta = {
+        "verses": verses,
+        "users": args.users,
+        "iterations": args.iterations,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    if args.output:
+        save_baseline(args.output, results, meta)
+
+    status = 0
+    if args.baseline:
+        report = compare(results, load_baseline(args.baseline)["results"], tolerance=args.tolerance)
+        print(json.dumps(report, indent=2), file=sys.stderr)
+        if any(entry["regression"] for entry in report.values()):
+            status = 1
+    else:
+        print(json.dumps({"meta": meta, "results": results}, indent=2))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
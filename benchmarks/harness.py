@@ -0,0 +1,208 @@
+"""
+Utilidades de benchmark sin dependencias de Rasa
+Tracker y dispatcher falsos, corpus y bases de datos sintéticas de tamaño
+configurable, estadísticas de latencia y comparación contra una línea base JSON.
+"""
+
+import json
+import math
+import os
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+BOOKS = [
+    "Génesis", "Éxodo", "Salmos", "Proverbios", "Isaías", "Mateo",
+    "Marcos", "Lucas", "Juan", "Romanos", "Filipenses", "Hebreos",
+]
+
+WORDS = [
+    "amor", "paz", "gozo", "fe", "esperanza", "gracia", "luz", "vida",
+    "camino", "verdad", "misericordia", "justicia", "salvación", "perdón",
+    "fortaleza", "sabiduría", "oración", "bendición", "pueblo", "corazón",
+    "espíritu", "palabra", "reino", "cielo", "tierra", "padre", "hijo",
+]
+
+# Tamaños de corpus de referencia: contenido actual, Biblia completa, Biblia con varias versiones
+CORPUS_SIZES = {"small": 67, "bible": 31_102, "multi": 300_000}
+
+
+class FakeTracker:
+    """Lo mínimo de rasa_sdk.Tracker que usan las acciones"""
+
+    def __init__(self, sender_id: str, text: str = "", intent: Optional[str] = None,
+                 entities: Optional[List[Dict[str, Any]]] = None,
+                 slots: Optional[Dict[str, Any]] = None):
+        self.sender_id = sender_id
+        self.slots = dict(slots or {})
+        self.latest_message = {
+            "text": text,
+            "intent": {"name": intent, "confidence": 1.0} if intent else {},
+            "entities": list(entities or []),
+        }
+        self.events: List[Dict[str, Any]] = []
+
+    def get_slot(self, key: str) -> Any:
+        return self.slots.get(key)
+
+    def get_intent_of_latest_message(self, skip_fallback_intent: bool = True) -> Optional[str]:
+        return self.latest_message.get("intent", {}).get("name")
+
+    def get_latest_entity_values(self, entity_type: str):
+        return (e["value"] for e in self.latest_message["entities"] if e.get("entity") == entity_type)
+
+
+class FakeDispatcher:
+    """Como CollectingDispatcher: acumula los mensajes enviados"""
+
+    def __init__(self):
+        self.messages: List[Dict[str, Any]] = []
+
+    def utter_message(self, text: Optional[str] = None, **kwargs: Any) -> None:
+        self.messages.append(dict(kwargs, text=text))
+
+
+def synthetic_corpus(verses: int, seed: int = 0, quiz_questions: int = 50) -> Dict[str, Any]:
+    """Contenido con la forma de data/bible_content.json y `verses` versículos"""
+    rng = random.Random(seed)
+    out, book, chapter, verse = [], 0, 1, 1
+    for _ in range(verses):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20)))
+        out.append({
+            "book": BOOKS[book % len(BOOKS)],
+            "chapter": str(chapter),
+            "verse": str(verse),
+            "text": text.capitalize() + ".",
+        })
+        verse += 1
+        if verse > 30:
+            verse, chapter = 1, chapter + 1
+            if chapter > 50:
+                chapter, book = 1, book + 1
+    questions = [{
+        "id": i + 1,
+        "question": f"Pregunta sintética {i + 1}",
+        "options": ["A", "B", "C", "D"],
+        "correct_answer": i % 4,
+        "explanation": "Explicación sintética.",
+    } for i in range(quiz_questions)]
+    return {
+        "verses": out,
+        "stories": [{"topic": w.capitalize(), "summary": f"Historia sobre {w}."} for w in WORDS],
+        "concepts": [{"term": w, "definition": f"Definición de {w}."} for w in WORDS],
+        "quiz_questions": questions,
+    }
+
+
+def seed_databases(users: int, quizzes_per_user: int = 2, xp_per_user: int = 3,
+                   seed: int = 0, batch_size: int = 5000) -> None:
+    """
+    Puebla MAIKA_DB con `users` usuarios sintéticos
+
+    Escribe quizzes (leaderboard y particiones incluidos) por sqlite_metrics
+    y usuarios con eventos de XP por actions/engine/db.add_xp_many, en lotes.
+    """
+    from sqlite_metrics import encode_quiz_payload, metrics_manager
+    from actions.engine import db
+
+    rng = random.Random(seed)
+    db.migrate()
+    now = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+    rows: List[tuple] = []
+    for i in range(users):
+        user_id = f"bench-user-{i}"
+        for _ in range(quizzes_per_user):
+            score = rng.randint(0, 3)
+            payload = encode_quiz_payload({"questions": [{"id": 1}, {"id": 2}, {"id": 3}],
+                                           "answers": [0, 1, 2]})
+            rows.append((user_id, score, 3, score / 3 * 100, payload, now))
+        if len(rows) >= batch_size:
+            metrics_manager.write_batch({"quiz_results": rows})
+            rows = []
+    if rows:
+        metrics_manager.write_batch({"quiz_results": rows})
+
+    # Por add_xp_many, como las acciones: xp_leaderboard y user_streaks quedan al día
+    for start in range(0, users, batch_size):
+        db.add_xp_many([
+            (f"bench-user-{i}", "trivia_correct", 10, None)
+            for i in range(start, min(users, start + batch_size))
+            for _ in range(xp_per_user)
+        ])
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Percentil por rango más cercano de una lista ya ordenada"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 en milisegundos y operaciones por segundo de una serie de latencias (s)"""
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        "iterations": len(ordered),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "mean_ms": round(total / len(ordered) * 1000, 3) if ordered else 0.0,
+        "ops_per_sec": round(len(ordered) / total, 1) if total else 0.0,
+    }
+
+
+def measure(fn: Callable[[Any], Any], iterations: int, warmup: int = 5,
+            prepare: Optional[Callable[[int], Any]] = None) -> Dict[str, float]:
+    """
+    Ejecuta fn `iterations` veces (tras `warmup` vueltas) y resume las latencias
+
+    Con `prepare`, fn recibe prepare(i), cuyo costo queda fuera de la medición;
+    si no, recibe el número de iteración.
+    """
+    for i in range(warmup):
+        fn(prepare(i) if prepare else i)
+    samples = []
+    for i in range(iterations):
+        arg = prepare(warmup + i) if prepare else i
+        start = time.perf_counter()
+        fn(arg)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            metric: str = "p95_ms", tolerance: float = 0.10) -> Dict[str, Dict[str, Any]]:
+    """
+    Compara `metric` de cada escenario contra la línea base
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Por escenario, valores, cambio relativo y
+        si empeoró más que `tolerance`
+    """
+    report = {}
+    for name, stats in results.items():
+        if name not in baseline or not baseline[name].get(metric):
+            continue
+        before, after = baseline[name][metric], stats[metric]
+        change = (after - before) / before
+        report[name] = {
+            "baseline": before,
+            "current": after,
+            "change": round(change, 3),
+            "regression": change > tolerance,
+        }
+    return report
+
+
+def load_baseline(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, results: Dict[str, Any], meta: Dict[str, Any]) -> None:
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2, sort_keys=True, ensure_ascii=False)
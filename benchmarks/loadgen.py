@@ -0,0 +1,365 @@
+"""
+Generador de carga para el servidor de acciones
+Reproduce conversaciones (de data/stories.yml o de un log grabado) como
+POSTs concurrentes al /webhook de endpoints.yml, con ids de usuario
+sintéticos, concurrencia y tasa controladas, y reporta throughput,
+percentiles de latencia y tasa de errores. Solo necesita el servidor de
+acciones (`rasa run actions`), no Rasa core.
+
+Uso:
+    python -m benchmarks.loadgen --concurrency 32 --rate 200 --duration 60
+    python -m benchmarks.loadgen --log conversaciones.jsonl --conversations 5000
+"""
+
+import argparse
+import http.client
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import yaml
+
+from benchmarks.harness import summarize
+
+DEFAULT_URL = "http://localhost:5055/webhook"
+
+# Versión de Rasa que se anuncia en el payload del webhook
+RASA_VERSION = "3.6.0"
+
+# Un paso: (intent, acción, texto, entidades)
+Step = Tuple[str, str, str, List[Dict[str, Any]]]
+
+_ENTITY_RE = re.compile(r"\[([^\]]+)\]\(([^)]+)\)")
+_ENTITY_VALUE_RE = re.compile(r"(\w+):(.*?)(?=\s+\w+:|$)")
+
+
+def action_url(endpoints_path: str = "endpoints.yml") -> str:
+    """URL del servidor de acciones configurada en endpoints.yml"""
+    try:
+        with open(endpoints_path, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f) or {}
+        return config.get("action_endpoint", {}).get("url") or DEFAULT_URL
+    except FileNotFoundError:
+        return DEFAULT_URL
+
+
+def parse_example(example: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """Quita la anotación de entidades de un ejemplo de NLU y devuelve (texto, entidades)"""
+    entities: List[Dict[str, Any]] = []
+
+    def replace(match: "re.Match") -> str:
+        text, annotation = match.group(1), match.group(2).strip()
+        pairs = _ENTITY_VALUE_RE.findall(annotation)
+        if not pairs:
+            pairs = [(annotation, text)]
+        for entity, value in pairs:
+            entities.append({"entity": entity, "value": value.strip()})
+        return text
+
+    return _ENTITY_RE.sub(replace, example), entities
+
+
+def load_examples(nlu_path: str = "data/nlu.yml") -> Dict[str, List[Tuple[str, List[Dict[str, Any]]]]]:
+    """Ejemplos de NLU por intent, ya sin anotaciones"""
+    with open(nlu_path, "r", encoding="utf-8") as f:
+        data = yaml.safe_load(f) or {}
+    examples: Dict[str, List[Tuple[str, List[Dict[str, Any]]]]] = {}
+    for item in data.get("nlu", []):
+        if "intent" not in item:
+            continue
+        lines = [line.strip()[2:] for line in str(item.get("examples", "")).splitlines()
+                 if line.strip().startswith("- ")]
+        examples[item["intent"]] = [parse_example(line) for line in lines]
+    return examples
+
+
+def load_stories(stories_path: str = "data/stories.yml") -> List[Dict[str, Any]]:
+    """
+    Conversaciones de stories.yml reducidas a las acciones personalizadas
+
+    Returns:
+        List[Dict[str, Any]]: {"name", "steps": [(intent, acción)]}; las
+        respuestas utter_* las resuelve Rasa core y no llegan al webhook
+    """
+    with open(stories_path, "r", encoding="utf-8") as f:
+        data = yaml.safe_load(f) or {}
+    conversations = []
+    for story in data.get("stories", []):
+        intent, steps = None, []
+        for step in story.get("steps", []):
+            if "intent" in step:
+                intent = step["intent"]
+            elif "action" in step and step["action"].startswith("action_") and intent:
+                steps.append((intent, step["action"]))
+        if steps:
+            conversations.append({"name": story.get("story", ""), "steps": steps})
+    return conversations
+
+
+def load_recorded(log_path: str) -> List[Dict[str, Any]]:
+    """
+    Conversaciones de un log JSON Lines grabado
+
+    Cada línea es un payload del webhook (con "next_action" y "tracker") o
+    un objeto {"sender_id", "next_action", "intent", "text", "entities"};
+    las líneas se agrupan por sender_id manteniendo el orden.
+    """
+    by_sender: Dict[str, List[Step]] = {}
+    with open(log_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            tracker = record.get("tracker") or {}
+            message = tracker.get("latest_message") or {}
+            sender = record.get("sender_id") or tracker.get("sender_id") or "anon"
+            intent = record.get("intent") or (message.get("intent") or {}).get("name") or ""
+            text = record.get("text", message.get("text", ""))
+            entities = record.get("entities", message.get("entities", []))
+            by_sender.setdefault(sender, []).append((intent, record["next_action"], text, entities))
+    return [{"name": sender, "steps": steps} for sender, steps in by_sender.items()]
+
+
+def load_domain(domain_path: str = "domain.yml") -> Dict[str, Any]:
+    try:
+        with open(domain_path, "r", encoding="utf-8") as f:
+            return yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        return {}
+
+
+def build_payload(sender_id: str, action: str, intent: str, text: str,
+                  entities: List[Dict[str, Any]], slots: Dict[str, Any],
+                  domain: Dict[str, Any]) -> Dict[str, Any]:
+    """Cuerpo del POST /webhook tal como lo envía Rasa core"""
+    return {
+        "next_action": action,
+        "sender_id": sender_id,
+        "version": RASA_VERSION,
+        "domain": domain,
+        "tracker": {
+            "sender_id": sender_id,
+            "conversation_id": sender_id,
+            "slots": dict(slots),
+            "latest_message": {
+                "text": text,
+                "intent": {"name": intent, "confidence": 1.0},
+                "entities": entities,
+            },
+            "latest_event_time": time.time(),
+            "followup_action": None,
+            "paused": False,
+            "events": [],
+            "latest_input_channel": "loadgen",
+            "active_loop": {},
+            "latest_action": {"action_name": "action_listen"},
+            "latest_action_name": "action_listen",
+        },
+    }
+
+
+class RateLimiter:
+    """Reparte los envíos a `rate` por segundo entre todos los hilos (0 = sin límite)"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class LoadGenerator:
+    """
+    Hilos que reproducen conversaciones contra el webhook
+
+    Cada hilo mantiene una conexión HTTP keep-alive; dentro de una
+    conversación los eventos SlotSet devueltos se aplican a los slots del
+    siguiente paso, como haría Rasa core.
+    """
+
+    def __init__(self, url: str, conversations: List[Dict[str, Any]],
+                 examples: Optional[Dict[str, List[Tuple[str, List[Dict[str, Any]]]]]] = None,
+                 domain: Optional[Dict[str, Any]] = None, concurrency: int = 8,
+                 rate: float = 0.0, timeout: float = 10.0, seed: Optional[int] = None):
+        if not conversations:
+            raise ValueError("No hay conversaciones para reproducir")
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.path = parts.path or "/webhook"
+        self.conversations = conversations
+        self.examples = examples or {}
+        self.domain = domain or {}
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate)
+        self.seed = seed
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.completed_conversations = 0
+        self._lock = threading.Lock()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def _step_message(self, rng: random.Random, step: tuple) -> Step:
+        if len(step) == 4:
+            return step
+        intent, action = step
+        if intent == "responder_quiz":
+            # Las respuestas del quiz son el número de la opción
+            return intent, action, str(rng.randint(1, 4)), []
+        candidates = self.examples.get(intent)
+        text, entities = rng.choice(candidates) if candidates else (intent, [])
+        return intent, action, text, entities
+
+    def _record(self, action: str, elapsed: Optional[float], error: Optional[str]):
+        with self._lock:
+            if error is None:
+                self.latencies.setdefault(action, []).append(elapsed)
+            else:
+                self.errors[error] = self.errors.get(error, 0) + 1
+                self.latencies.setdefault(action, [])
+
+    def _post(self, conn: http.client.HTTPConnection, body: bytes) -> Tuple[int, bytes]:
+        conn.request("POST", self.path, body=body, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        return response.status, response.read()
+
+    def run_conversation(self, conn: http.client.HTTPConnection, rng: random.Random,
+                         conversation: Dict[str, Any]) -> http.client.HTTPConnection:
+        sender_id = f"load-{uuid.UUID(int=rng.getrandbits(128)).hex[:16]}"
+        slots: Dict[str, Any] = {}
+        for step in conversation["steps"]:
+            intent, action, text, entities = self._step_message(rng, step)
+            body = json.dumps(build_payload(sender_id, action, intent, text, entities, slots,
+                                            self.domain)).encode("utf-8")
+            self.limiter.wait()
+            start = time.perf_counter()
+            try:
+                status, payload = self._post(conn, body)
+            except (OSError, http.client.HTTPException) as e:
+                self._record(action, None, type(e).__name__)
+                conn.close()
+                return self._connection()
+            elapsed = time.perf_counter() - start
+            if status != 200:
+                self._record(action, None, f"HTTP {status}")
+                continue
+            self._record(action, elapsed, None)
+            for event in json.loads(payload or b"{}").get("events", []):
+                if event.get("event") == "slot":
+                    slots[event["name"]] = event.get("value")
+        with self._lock:
+            self.completed_conversations += 1
+        return conn
+
+    def run(self, duration: Optional[float] = None,
+            conversations: Optional[int] = None) -> Dict[str, Any]:
+        """Reproduce hasta agotar `duration` segundos o `conversations` conversaciones"""
+        deadline = time.monotonic() + duration if duration else None
+        remaining = [conversations if conversations is not None else (None if duration else 100)]
+        master = random.Random(self.seed)
+        seeds = [master.getrandbits(64) for _ in range(self.concurrency)]
+
+        def take() -> bool:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            with self._lock:
+                if remaining[0] is None:
+                    return True
+                if remaining[0] <= 0:
+                    return False
+                remaining[0] -= 1
+                return True
+
+        def worker(worker_seed: int):
+            rng = random.Random(worker_seed)
+            conn = self._connection()
+            try:
+                while take():
+                    conn = self.run_conversation(conn, rng, rng.choice(self.conversations))
+            finally:
+                conn.close()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(s,), name=f"loadgen-{i}", daemon=True)
+                   for i, s in enumerate(seeds)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.report(time.perf_counter() - started)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        ok = len(all_latencies)
+        failed = sum(self.errors.values())
+        total = ok + failed
+        return {
+            "duration_s": round(elapsed, 3),
+            "concurrency": self.concurrency,
+            "requests": total,
+            "conversations": self.completed_conversations,
+            "throughput_rps": round(ok / elapsed, 1) if elapsed else 0.0,
+            "error_rate": round(failed / total, 4) if total else 0.0,
+            "errors": dict(self.errors),
+            "latency": summarize(all_latencies) if all_latencies else {},
+            "by_action": {action: summarize(values) for action, values in sorted(self.latencies.items())
+                          if values},
+        }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Carga concurrente contra el /webhook del servidor de acciones")
+    parser.add_argument("--url", default=None, help="Por defecto action_endpoint de endpoints.yml")
+    parser.add_argument("--endpoints", default="endpoints.yml")
+    parser.add_argument("--stories", default="data/stories.yml")
+    parser.add_argument("--nlu", default="data/nlu.yml")
+    parser.add_argument("--domain", default="domain.yml")
+    parser.add_argument("--log", default=None, help="Log JSON Lines grabado a reproducir en vez de las historias")
+    parser.add_argument("--concurrency", type=int, default=8, help="Conversaciones simultáneas")
+    parser.add_argument("--rate", type=float, default=0.0, help="Peticiones por segundo (0 = sin límite)")
+    parser.add_argument("--duration", type=float, default=None, help="Segundos de carga")
+    parser.add_argument("--conversations", type=int, default=None, help="Número de conversaciones")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Guardar el reporte JSON")
+    args = parser.parse_args(argv)
+
+    if args.log:
+        conversations, examples = load_recorded(args.log), {}
+    else:
+        conversations, examples = load_stories(args.stories), load_examples(args.nlu)
+    generator = LoadGenerator(
+        args.url or action_url(args.endpoints), conversations, examples, load_domain(args.domain),
+        args.concurrency, args.rate, args.timeout, args.seed,
+    )
+    report = generator.run(args.duration, args.conversations)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    return 0 if report["requests"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,316 @@
+"""
+Instrumentación del servidor de acciones
+Histogramas de latencia por acción, tiempo en SQLite y en carga de contenido,
+aciertos de caché y errores, expuestos en formato de texto de Prometheus
+(endpoint HTTP local) y/o como una línea de log periódica.
+"""
+
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+import profiling
+
+logger = logging.getLogger(__name__)
+
+# Puerto del endpoint /metrics (0 = deshabilitado) y segundos entre líneas de log (0 = nunca)
+METRICS_PORT = int(os.getenv("MAIKA_METRICS_PORT", "0"))
+METRICS_LOG_INTERVAL = float(os.getenv("MAIKA_METRICS_LOG_INTERVAL", "0"))
+
+# Límites superiores (segundos) de los buckets de latencia
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Optional[Dict[str, Any]]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    body = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in items)
+    return "{" + body + "}"
+
+
+class Histogram:
+    """Histograma acumulativo de buckets fijos (compatible con Prometheus)"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Cota superior del bucket que contiene el cuantil `q`"""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Registry:
+    """Contadores e histogramas con etiquetas, seguros entre hilos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    def inc(self, name: str, labels: Optional[Dict[str, Any]] = None, amount: float = 1):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, Any]] = None):
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def counter_value(self, name: str, labels: Optional[Dict[str, Any]] = None) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(_labels(labels), 0)
+
+    def histogram(self, name: str, labels: Optional[Dict[str, Any]] = None) -> Optional[Histogram]:
+        with self._lock:
+            return self._histograms.get(name, {}).get(_labels(labels))
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """Exposición en formato de texto de Prometheus"""
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted(self._counters):
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for name in sorted(self._histograms):
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', f'{bound:g}'))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Resumen compacto para la línea de log: contadores y p50/p95 por serie"""
+        out: Dict[str, Any] = {}
+        with self._lock:
+            for name, series in self._counters.items():
+                for labels, value in series.items():
+                    out[name + _format_labels(labels)] = value
+            for name, series in self._histograms.items():
+                for labels, histogram in series.items():
+                    out[name + _format_labels(labels)] = {
+                        "count": histogram.count,
+                        "avg_ms": round(1000 * histogram.sum / histogram.count, 2) if histogram.count else 0,
+                        "p50_ms": round(1000 * histogram.quantile(0.5), 2),
+                        "p95_ms": round(1000 * histogram.quantile(0.95), 2),
+                    }
+        return out
+
+
+# Registro global del proceso
+REGISTRY = Registry()
+
+# Tiempos acumulados por categoría ("db", "content") de la acción en curso;
+# run_blocking() copia el contexto al pool de hilos para que sigan sumando
+_current_action: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "maika_current_action", default=None
+)
+
+
+def inc(name: str, labels: Optional[Dict[str, Any]] = None, amount: float = 1):
+    REGISTRY.inc(name, labels, amount)
+
+
+def observe(name: str, value: float, labels: Optional[Dict[str, Any]] = None):
+    REGISTRY.observe(name, value, labels)
+
+
+def cache_access(cache: str, hit: bool):
+    """Cuenta un acceso a una caché en memoria"""
+    REGISTRY.inc("maika_cache_requests_total", {"cache": cache, "result": "hit" if hit else "miss"})
+
+
+@contextmanager
+def timed(kind: str):
+    """
+    Mide un bloque de trabajo de tipo `kind` ("db", "content")
+
+    Se registra en el histograma global maika_<kind>_seconds y se suma al
+    tiempo de la acción en curso, si la hay.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(kind, time.perf_counter() - start)
+
+
+def record(kind: str, elapsed: float):
+    """Registra `elapsed` segundos de trabajo de tipo `kind` (ver timed())"""
+    REGISTRY.observe(f"maika_{kind}_seconds", elapsed)
+    timings = _current_action.get()
+    if timings is not None:
+        timings[kind] = timings.get(kind, 0.0) + elapsed
+
+
+def instrumented(cls):
+    """
+    Decorador de clase para acciones de Rasa
+
+    Envuelve `run` para registrar latencia, tiempo en SQLite y en carga de
+    contenido, y errores, etiquetados con el nombre de la acción. Con
+    MAIKA_PROFILE_RATE una fracción de las invocaciones se perfila (ver
+    profiling.py).
+    """
+    run = cls.run
+
+    @functools.wraps(run)
+    async def wrapper(self, dispatcher, tracker, domain):
+        action = self.name()
+        timings: Dict[str, float] = {}
+        token = _current_action.set(timings)
+        start = time.perf_counter()
+        try:
+            if profiling.should_sample():
+                return await profiling.profile_action(action, run(self, dispatcher, tracker, domain))
+            return await run(self, dispatcher, tracker, domain)
+        except Exception:
+            REGISTRY.inc("maika_action_errors_total", {"action": action})
+            logger.exception("Error ejecutando la acción %s", action)
+            raise
+        finally:
+            _current_action.reset(token)
+            REGISTRY.observe("maika_action_seconds", time.perf_counter() - start, {"action": action})
+            for kind, elapsed in timings.items():
+                REGISTRY.observe(f"maika_action_{kind}_seconds", elapsed, {"action": action})
+
+    cls.run = wrapper
+    return cls
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            body = REGISTRY.render().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == "/memory":
+            # Recorre las estructuras registradas: pensado para consultas puntuales
+            import memory_budget
+
+            body = json.dumps(memory_budget.report()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics endpoint: " + format, *args)
+
+
+_started = False
+_start_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Sirve /metrics (y el reporte de memoria en /memory) en un hilo de fondo"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Endpoint de métricas en http://%s:%d/metrics", host, server.server_address[1])
+    return server
+
+
+def start_log_reporter(interval: float) -> threading.Thread:
+    """Emite el resumen de métricas como una línea JSON cada `interval` segundos"""
+    def report():
+        while True:
+            time.sleep(interval)
+            logger.info("metrics %s", json.dumps(REGISTRY.snapshot(), sort_keys=True))
+
+    thread = threading.Thread(target=report, name="metrics-log", daemon=True)
+    thread.start()
+    return thread
+
+
+def start_exporters(port: int = METRICS_PORT, log_interval: float = METRICS_LOG_INTERVAL):
+    """Arranca el endpoint y/o el log periódico según la configuración (una vez por proceso)"""
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    if port:
+        try:
+            start_metrics_server(port)
+        except OSError as e:
+            logger.error("No se pudo abrir el endpoint de métricas en el puerto %d: %s", port, e)
+    if log_interval > 0:
+        start_log_reporter(log_interval)
+
+
+def defer_exporters():
+    """
+    Evita que start_exporters() arranque hilos en este proceso
+
+    Lo usa el padre pre-fork antes de importar las acciones: los exportadores
+    se arrancan en cada worker con after_fork().
+    """
+    global _started
+    with _start_lock:
+        _started = True
+
+
+def after_fork(worker: int):
+    """
+    Reinicia la instrumentación en un worker pre-fork
+
+    Los hilos del padre no sobreviven al fork: el worker empieza con el
+    registro vacío y, si hay endpoint, lo sirve en METRICS_PORT + 1 + worker.
+    """
+    global _started
+    REGISTRY.reset()
+    with _start_lock:
+        _started = False
+    start_exporters(METRICS_PORT + 1 + worker if METRICS_PORT else 0, METRICS_LOG_INTERVAL)
+
@@ -0,0 +1,224 @@
+"""
+Presupuesto e introspección de memoria
+Registro de las estructuras que el servidor de acciones mantiene en memoria
+(índice de contenido, datos bíblicos, quiz) con su tamaño profundo y número
+de entradas, junto al RSS del proceso y el límite del contenedor. Con
+MAIKA_MEMORY_BUDGET_MB el contenido que supere el presupuesto al cargarse se
+guarda en representaciones más compactas (ver actions/engine/content.py).
+
+    python memory_budget.py --path data/bible_content.json
+"""
+
+import gc
+import json
+import logging
+import os
+import sys
+import threading
+import types
+from array import array
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Presupuesto (MB) para el contenido en memoria; 0 = sin presupuesto
+MEMORY_BUDGET_MB = float(os.getenv("MAIKA_MEMORY_BUDGET_MB", "0"))
+
+# Objetos compartidos por todo el proceso que no forman parte de una estructura
+_SKIP_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+               types.MethodType, types.CodeType, types.FrameType)
+
+_structures: Dict[str, Dict[str, Callable[..., Any]]] = {}
+_structures_lock = threading.Lock()
+
+
+def budget_bytes(budget_mb: Optional[float] = None) -> int:
+    budget_mb = MEMORY_BUDGET_MB if budget_mb is None else budget_mb
+    return int(budget_mb * 1024 * 1024)
+
+
+def deep_size(obj: Any, seen: Optional[set] = None) -> int:
+    """
+    Tamaño en bytes de `obj` y de todo lo que alcanza (contenedores, atributos)
+
+    Args:
+        obj: Objeto a medir
+        seen: ids ya contados; compartirlo entre llamadas evita contar dos veces
+              los objetos compartidos entre estructuras
+
+    Returns:
+        int: Bytes (sys.getsizeof acumulado)
+    """
+    seen = set() if seen is None else seen
+    total = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, _SKIP_TYPES):
+            continue
+        seen.add(id(current))
+        total += sys.getsizeof(current)
+
+        if isinstance(current, (str, bytes, bytearray, int, float, bool, array, memoryview)) or current is None:
+            continue
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            stack.extend(current)
+        if hasattr(current, "__dict__"):
+            stack.append(vars(current))
+        for slot in getattr(type(current), "__slots__", ()):
+            if hasattr(current, slot):
+                stack.append(getattr(current, slot))
+    return total
+
+
+def count_entries(obj: Any) -> int:
+    try:
+        return len(obj)
+    except TypeError:
+        return 0
+
+
+def register(name: str, getter: Callable[[], Any], count: Callable[[Any], int] = count_entries):
+    """
+    Registra una estructura para la introspección
+
+    Args:
+        name: Nombre con el que aparece en el reporte
+        getter: Devuelve la estructura actual (los índices se reconstruyen y
+                reasignan, así que se guarda cómo obtenerla y no el objeto)
+        count: Número de entradas de la estructura
+    """
+    with _structures_lock:
+        _structures[name] = {"getter": getter, "count": count}
+
+
+def unregister(name: str):
+    with _structures_lock:
+        _structures.pop(name, None)
+
+
+def measure() -> Dict[str, Dict[str, int]]:
+    """
+    Mide las estructuras registradas, en orden de registro
+
+    Returns:
+        Dict[str, Dict[str, int]]: nombre -> {"bytes", "entries"}; un objeto
+        compartido se atribuye a la primera estructura que lo alcanza
+    """
+    with _structures_lock:
+        structures = list(_structures.items())
+    seen: set = set()
+    sizes = {}
+    for name, spec in structures:
+        obj = spec["getter"]()
+        sizes[name] = {"bytes": deep_size(obj, seen), "entries": spec["count"](obj)}
+    return sizes
+
+
+def rss_bytes() -> Optional[int]:
+    """RSS actual del proceso (Linux), o el pico si /proc no está disponible"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+
+def container_limit() -> Optional[int]:
+    """Límite de memoria del cgroup (v2 o v1), o None si no hay límite"""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path, "r") as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value == "max":
+            return None
+        limit = int(value)
+        # cgroup v1 reporta "sin límite" como un número enorme
+        return limit if limit < 1 << 60 else None
+    return None
+
+
+def report(budget_mb: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Reporte de memoria: estructuras, total, presupuesto, RSS y límite del contenedor
+
+    Returns:
+        Dict[str, Any]: {"structures", "total_bytes", "budget_bytes",
+        "rss_bytes", "limit_bytes", "gc_frozen"}
+    """
+    structures = measure()
+    return {
+        "structures": structures,
+        "total_bytes": sum(s["bytes"] for s in structures.values()),
+        "budget_bytes": budget_bytes(budget_mb),
+        "rss_bytes": rss_bytes(),
+        "limit_bytes": container_limit(),
+        "gc_frozen": gc.get_freeze_count(),
+    }
+
+
+def over_budget(objects: List[Any], budget_mb: Optional[float] = None) -> Optional[int]:
+    """
+    Devuelve el tamaño de `objects` si supera el presupuesto, o None
+
+    Sin presupuesto configurado no se mide nada (medir recorre cada objeto).
+    """
+    budget = budget_bytes(budget_mb)
+    if budget <= 0:
+        return None
+    seen: set = set()
+    size = sum(deep_size(obj, seen) for obj in objects)
+    return size if size > budget else None
+
+
+def format_report(result: Dict[str, Any]) -> str:
+    mb = 1024 * 1024
+    lines = [f"{'MB':>10} {'entradas':>10}  estructura"]
+    for name, size in sorted(result["structures"].items(), key=lambda item: item[1]["bytes"], reverse=True):
+        lines.append(f"{size['bytes'] / mb:10.2f} {size['entries']:10d}  {name}")
+    lines.append(f"{result['total_bytes'] / mb:10.2f} {'':10}  total")
+    for label, key in (("presupuesto", "budget_bytes"), ("RSS", "rss_bytes"), ("límite", "limit_bytes")):
+        if result.get(key):
+            lines.append(f"{result[key] / mb:10.2f} {'':10}  {label}")
+    if result.get("rss_bytes") and result.get("limit_bytes"):
+        lines.append(f"{100 * result['rss_bytes'] / result['limit_bytes']:9.1f}% {'':10}  del límite en uso")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Memoria usada por el contenido cargado en las acciones")
+    parser.add_argument("--path", default="data/bible_content.json", help="Contenido a cargar")
+    parser.add_argument("--budget-mb", type=float, default=None, help="Presupuesto (por defecto MAIKA_MEMORY_BUDGET_MB)")
+    parser.add_argument("--json", action="store_true", help="Salida JSON")
+    args = parser.parse_args(argv)
+
+    # Como script este módulo es __main__: el registro que llenan las acciones es el de memory_budget
+    import memory_budget
+
+    if args.budget_mb is not None:
+        memory_budget.MEMORY_BUDGET_MB = args.budget_mb
+    # Carga el contenido igual que el servidor de acciones (requiere rasa_sdk)
+    from actions.actions import BibleIndexer
+
+    BibleIndexer.load_bible_data(args.path)
+    result = memory_budget.report()
+    print(json.dumps(result, indent=2) if args.json else format_report(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+"""
+Exportación en streaming de métricas desde SQLite
+Recorre las tablas de sqlite_metrics y de actions/engine/db.py por bloques
+(fetchmany) y escribe CSV o JSON Lines de forma incremental, con memoria
+constante sin importar el tamaño de la tabla. Con MAIKA_SHARDS > 1 (o
+--shards) recorre todos los archivos de shard en una sola exportación.
+"""
+
+import csv
+import json
+import logging
+import os
+import sqlite3
+import sys
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+from sqlite_metrics import EVENT_TABLES, decode_quiz_payload
+from sqlite_storage import SHARDS, shard_path
+
+logger = logging.getLogger(__name__)
+
+# Tablas exportables y su columna de tiempo
+EXPORT_TABLES = {
+    "quiz_results": "timestamp",
+    "user_queries": "timestamp",
+    "usage_stats": "timestamp",
+    "leaderboard": "last_updated",
+    "xp_events": "created_at",
+    "srs_reviews": "updated_at",
+    "sessions": "updated_at",
+    "users": "created_at",
+}
+
+# Tablas de actions/engine/db.py: guardan el tiempo con isoformat() ('T' entre fecha y hora);
+# las de sqlite_metrics usan el formato de CURRENT_TIMESTAMP ('YYYY-MM-DD HH:MM:SS')
+ISO_TIME_TABLES = {"xp_events", "srs_reviews", "sessions", "users"}
+
+# Tablas de solo inserción con id entero creciente (admiten modo incremental)
+INCREMENTAL_TABLES = {"quiz_results", "user_queries", "usage_stats", "xp_events"}
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def connect_readonly(db_path: str) -> sqlite3.Connection:
+    """Conexión de solo lectura, independiente de la del MetricsManager"""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
+
+
+def physical_tables(conn: sqlite3.Connection, table: str) -> List[str]:
+    """Tabla base seguida de sus particiones mensuales, de la más antigua a la más reciente"""
+    if table not in EVENT_TABLES:
+        return [table]
+    rows = conn.execute("""
+        SELECT name FROM sqlite_master
+        WHERE type = 'table' AND name GLOB ?
+        ORDER BY name
+    """, (table + "_[0-9][0-9][0-9][0-9][0-9][0-9]",)).fetchall()
+    return [table] + [row[0] for row in rows]
+
+
+def _month_of(value: str) -> str:
+    return value[:4] + value[5:7]
+
+
+def time_bound(table: str, value: str) -> str:
+    """
+    Convierte un límite 'YYYY-MM-DD[ HH:MM:SS]' (o con 'T') al formato con el
+    que `table` guarda el tiempo, para que la comparación como texto sea exacta
+
+    Raises:
+        ValueError: Si el valor no es una fecha u hora ISO
+    """
+    moment = datetime.fromisoformat(value.strip())
+    if table in ISO_TIME_TABLES:
+        return moment.isoformat()
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def iter_rows(conn: sqlite3.Connection, table: str,
+              start: Optional[str] = None, end: Optional[str] = None,
+              since_ids: Optional[Dict[str, int]] = None,
+              chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Genera las filas de una tabla lógica sin cargarla en memoria
+
+    Args:
+        conn: Conexión SQLite
+        table: Tabla lógica (ver EXPORT_TABLES)
+        start: Tiempo mínimo incluido, 'YYYY-MM-DD[ HH:MM:SS]' (opcional);
+            se compara en el formato de tiempo de la tabla (ver time_bound)
+        end: Tiempo máximo excluido (opcional)
+        since_ids: Último id exportado por tabla física (modo incremental)
+        chunk_size: Filas por fetchmany
+
+    Yields:
+        Dict[str, Any]: Fila con "_table" indicando la tabla física de origen
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Tabla no exportable: {table}")
+    if since_ids is not None and table not in INCREMENTAL_TABLES:
+        raise ValueError(f"La tabla {table} no admite exportación incremental")
+    time_column = EXPORT_TABLES[table]
+    start = time_bound(table, start) if start else None
+    end = time_bound(table, end) if end else None
+
+    for physical in physical_tables(conn, table):
+        # Podar particiones fuera del rango de tiempo
+        if physical != table:
+            month = physical[-6:]
+            if (start and month < _month_of(start)) or (end and month > _month_of(end)):
+                continue
+
+        clauses, params = [], []
+        if start:
+            clauses.append(f"{time_column} >= ?")
+            params.append(start)
+        if end:
+            clauses.append(f"{time_column} < ?")
+            params.append(end)
+        if since_ids is not None:
+            clauses.append("id > ?")
+            params.append(since_ids.get(physical, 0))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        order = "ORDER BY id" if table in INCREMENTAL_TABLES else ""
+
+        cursor = conn.execute(f"SELECT * FROM {physical} {where} {order}", params)
+        columns = [description[0] for description in cursor.description]
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            for values in chunk:
+                row = dict(zip(columns, values))
+                if "quiz_data" in row and row["quiz_data"] is not None:
+                    row["quiz_data"] = _quiz_data(row["quiz_data"])
+                row["_table"] = physical
+                yield row
+
+
+def _quiz_data(value) -> Any:
+    # Una fila antigua que no se puede decodificar se exporta tal cual, sin cortar la exportación
+    try:
+        return json.dumps(decode_quiz_payload(value), ensure_ascii=False)
+    except (ValueError, SyntaxError, zlib.error) as e:
+        logger.warning("quiz_data sin decodificar, se exporta en crudo: %s", e)
+        return value
+
+
+def write_jsonl(rows: Iterator[Dict[str, Any]], out: TextIO) -> int:
+    """Escribe una fila JSON por línea; devuelve cuántas escribió"""
+    count = 0
+    for row in rows:
+        out.write(json.dumps(row, ensure_ascii=False, default=str))
+        out.write("\n")
+        count += 1
+    return count
+
+
+def write_csv(rows: Iterator[Dict[str, Any]], out: TextIO) -> int:
+    """Escribe CSV con cabecera tomada de la primera fila; devuelve cuántas escribió"""
+    writer = None
+    count = 0
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(out, fieldnames=list(row.keys()), extrasaction="ignore")
+            writer.writeheader()
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+WRITERS = {"jsonl": write_jsonl, "csv": write_csv}
+
+
+def load_state(path: str) -> Dict[str, Dict[str, int]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(path: str, state: Dict[str, Dict[str, int]]) -> None:
+    # Reemplazo atómico: una exportación interrumpida no avanza el cursor
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def shard_paths(db_path: str, shards: int = SHARDS) -> List[tuple]:
+    """
+    (shard, archivo) a exportar: (None, db_path) sin sharding o los shards que existan
+
+    `db_path` es la ruta base (metrics.db), no la de un shard.
+
+    Raises:
+        FileNotFoundError: Si no existe ninguno de los archivos de shard esperados
+    """
+    if shards <= 1:
+        return [(None, db_path)]
+    paths = [(i, shard_path(db_path, i)) for i in range(shards)]
+    found = [(i, path) for i, path in paths if os.path.exists(path)]
+    if not found:
+        raise FileNotFoundError(
+            f"No existe ningún shard de {db_path} ({paths[0][1]} … {paths[-1][1]}); "
+            "--db debe ser la ruta base, no la de un shard"
+        )
+    return found
+
+
+def export_table(db_path: str, table: str, out: TextIO, fmt: str = "jsonl",
+                 start: Optional[str] = None, end: Optional[str] = None,
+                 state_path: Optional[str] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 shards: int = SHARDS) -> int:
+    """
+    Exporta una tabla a `out` en streaming
+
+    Con `state_path` la exportación es incremental: solo se emiten las filas
+    con id mayor al último exportado y el archivo de estado se actualiza al
+    terminar. Con `shards` > 1 se recorren todos los shards de `db_path` en
+    orden; cada fila lleva "_shard" y el estado guarda el último id por
+    shard y tabla física ("shardN:tabla"), ya que los ids se repiten entre
+    archivos.
+
+    Returns:
+        int: Número de filas exportadas
+    """
+    state = load_state(state_path) if state_path else None
+    table_state = state.get(table, {}) if state is not None else None
+    last_ids: Dict[str, int] = dict(table_state or {})
+
+    def all_rows() -> Iterator[Dict[str, Any]]:
+        for shard, path in shard_paths(db_path, shards):
+            prefix = "" if shard is None else f"shard{shard}:"
+            since_ids = None
+            if table_state is not None:
+                since_ids = {key[len(prefix):]: value for key, value in table_state.items()
+                             if key.startswith(prefix)}
+            conn = connect_readonly(path)
+            try:
+                for row in iter_rows(conn, table, start, end, since_ids, chunk_size):
+                    if shard is not None:
+                        row["_shard"] = shard
+                    if state is not None:
+                        key = prefix + row["_table"]
+                        last_ids[key] = max(last_ids.get(key, 0), row["id"])
+                    yield row
+            finally:
+                conn.close()
+
+    count = WRITERS[fmt](all_rows(), out)
+
+    if state is not None:
+        state[table] = last_ids
+        save_state(state_path, state)
+    return count
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Exporta métricas de SQLite en streaming")
+    parser.add_argument("table", choices=sorted(EXPORT_TABLES))
+    parser.add_argument("--db", default=os.getenv("MAIKA_DB", "metrics.db"))
+    parser.add_argument("--format", choices=sorted(WRITERS), default="jsonl")
+    parser.add_argument("--since", default=None, help="Tiempo mínimo incluido (YYYY-MM-DD[ HH:MM:SS])")
+    parser.add_argument("--until", default=None, help="Tiempo máximo excluido (YYYY-MM-DD[ HH:MM:SS])")
+    parser.add_argument("--state", default=None, help="Archivo JSON con el último id exportado (modo incremental)")
+    parser.add_argument("--output", default="-", help="Archivo de salida ('-' para stdout)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--shards", type=int, default=SHARDS, help="Shards de --db (por defecto MAIKA_SHARDS)")
+    args = parser.parse_args(argv)
+
+    if args.output == "-":
+        out = sys.stdout
+    else:
+        out = open(args.output, "w", encoding="utf-8", newline="")
+    try:
+        count = export_table(args.db, args.table, out, args.format,
+                             args.since, args.until, args.state, args.chunk_size, args.shards)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"{count} filas exportadas de {args.table}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,290 @@
+"""
+Perfilado por muestreo de las acciones (opcional)
+Con MAIKA_PROFILE_RATE > 0 una fracción de las invocaciones se perfila con
+cProfile (los pasos de la acción en el event loop y el trabajo que delega
+a run_blocking) y, con MAIKA_PROFILE_ALLOC=1, registra las asignaciones de
+memoria con tracemalloc (solo las que ocurren dentro de las invocaciones
+muestreadas: sus pasos en el event loop y su trabajo en run_blocking). Los
+resultados se guardan por acción en archivos rotativos y se agregan con:
+
+    python profiling.py report --dir profiles --top 25
+"""
+
+import contextvars
+import cProfile
+import dis
+import glob
+import json
+import logging
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Fracción de invocaciones perfiladas (0 = apagado), directorio y archivos por acción
+PROFILE_RATE = float(os.getenv("MAIKA_PROFILE_RATE", "0"))
+PROFILE_DIR = os.getenv("MAIKA_PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("MAIKA_PROFILE_MAX_FILES", "50"))
+PROFILE_ALLOC = os.getenv("MAIKA_PROFILE_ALLOC", "0") not in ("0", "false", "False")
+
+# Líneas con más memoria asignada que se guardan por muestra
+ALLOC_TOP = 50
+# Profundidad de pila que guarda tracemalloc: debe alcanzar desde la línea que
+# asigna hasta el marco de profiling que ejecuta la acción
+ALLOC_FRAMES = int(os.getenv("MAIKA_PROFILE_ALLOC_FRAMES", "64"))
+
+# Perfiles de la invocación muestreada en curso (uno por hilo que trabajó para ella)
+_current: contextvars.ContextVar[Optional[List[cProfile.Profile]]] = contextvars.ContextVar(
+    "maika_profile", default=None
+)
+
+_tracing = 0
+_tracing_lock = threading.Lock()
+_sequence = 0
+
+
+def should_sample(rate: Optional[float] = None) -> bool:
+    rate = PROFILE_RATE if rate is None else rate
+    return rate > 0 and random.random() < rate
+
+
+def wrap_blocking(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Si la acción en curso se está perfilando, perfila también `fn` en el hilo que la ejecute"""
+    profiles = _current.get()
+    if profiles is None:
+        return fn
+
+    def profiled(*args, **kwargs):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.disable()
+            profiles.append(profile)
+
+    return profiled
+
+
+def _drive(coro, profile: cProfile.Profile):
+    # Reenvía los pasos de la corrutina perfilando solo mientras ella se ejecuta,
+    # no mientras el event loop atiende otras conversaciones
+    value, error = None, None
+    while True:
+        profile.enable()
+        try:
+            yielded = coro.throw(error) if error is not None else coro.send(value)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            profile.disable()
+        try:
+            value, error = (yield yielded), None
+        except BaseException as e:
+            value, error = None, e
+
+
+class _Profiled:
+    def __init__(self, coro, profile: cProfile.Profile):
+        self.coro = coro
+        self.profile = profile
+
+    def __await__(self):
+        return _drive(self.coro, self.profile)
+
+
+def _start_tracing():
+    global _tracing
+    with _tracing_lock:
+        _tracing += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(ALLOC_FRAMES)
+
+
+def _stop_tracing():
+    global _tracing
+    with _tracing_lock:
+        _tracing -= 1
+        if _tracing == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def _sampled_lines() -> set:
+    # Líneas de _drive (pasos de la acción en el event loop) y del envoltorio de
+    # wrap_blocking (su trabajo en otro hilo) por las que pasa la pila de lo que
+    # asigna la acción muestreada
+    codes = [_drive.__code__]
+    codes += [c for c in wrap_blocking.__code__.co_consts if hasattr(c, "co_code")]
+    return {(code.co_filename, line) for code in codes for _, line in dis.findlinestarts(code) if line}
+
+
+def _sampled_totals(snapshot, lines: set) -> Dict[str, List[int]]:
+    # tracemalloc ve todo el proceso: otras conversaciones del event loop y otros
+    # hilos también asignan mientras dura la muestra. Solo cuentan las trazas que
+    # pasan por esas líneas; si hay varias acciones muestreadas a la vez, sus
+    # asignaciones se mezclan entre ellas pero no con el resto del tráfico
+    totals: Dict[str, List[int]] = {}
+    for trace in snapshot.traces:
+        if any((frame.filename, frame.lineno) in lines for frame in trace.traceback):
+            # Traceback va del marco más antiguo al más reciente: el último es la línea que asigna
+            frame = trace.traceback[-1]
+            total = totals.setdefault(f"{frame.filename}:{frame.lineno}", [0, 0])
+            total[0] += trace.size
+            total[1] += 1
+    return totals
+
+
+def _allocation_deltas(before, after, top: int = ALLOC_TOP) -> List[Dict[str, Any]]:
+    lines = _sampled_lines()
+    old, new = _sampled_totals(before, lines), _sampled_totals(after, lines)
+    deltas = []
+    for location in old.keys() | new.keys():
+        size, count = new.get(location, (0, 0))
+        old_size, old_count = old.get(location, (0, 0))
+        if size != old_size or count != old_count:
+            deltas.append({"location": location, "size_diff": size - old_size, "count_diff": count - old_count})
+    deltas.sort(key=lambda delta: abs(delta["size_diff"]), reverse=True)
+    return deltas[:top]
+
+
+def _rotate(directory: str, max_files: int):
+    samples = sorted(glob.glob(os.path.join(directory, "*.prof")), key=os.path.getmtime)
+    for path in samples[:max(0, len(samples) - max_files)]:
+        for stale in (path, path[:-len(".prof")] + ".alloc.json"):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+
+
+def save_sample(action: str, profiles: List[cProfile.Profile], elapsed: float,
+                allocations: Optional[List[Dict[str, Any]]] = None,
+                directory: Optional[str] = None, max_files: Optional[int] = None) -> str:
+    """Guarda una muestra como <dir>/<acción>/<ts>-<pid>-<n>.prof (+ .alloc.json)"""
+    global _sequence
+    directory = os.path.join(directory or PROFILE_DIR, action)
+    os.makedirs(directory, exist_ok=True)
+    _sequence += 1
+    base = os.path.join(directory, f"{int(time.time() * 1000)}-{os.getpid()}-{_sequence}")
+
+    stats = pstats.Stats()
+    for profile in profiles:
+        profile.create_stats()
+        # Un perfil sin llamadas (p. ej. un hilo que no llegó a trabajar) no aporta datos
+        if profile.stats:
+            stats.add(profile)
+    stats.dump_stats(base + ".prof")
+    if allocations is not None:
+        with open(base + ".alloc.json", "w", encoding="utf-8") as f:
+            json.dump({"action": action, "elapsed": elapsed, "allocations": allocations}, f)
+    _rotate(directory, PROFILE_MAX_FILES if max_files is None else max_files)
+    return base + ".prof"
+
+
+async def profile_action(action: str, coro, alloc: Optional[bool] = None,
+                         directory: Optional[str] = None) -> Any:
+    """Ejecuta la corrutina `coro` de una acción perfilándola y guarda la muestra"""
+    alloc = PROFILE_ALLOC if alloc is None else alloc
+    profile = cProfile.Profile()
+    profiles = [profile]
+    token = _current.set(profiles)
+    before = None
+    if alloc:
+        _start_tracing()
+        before = tracemalloc.take_snapshot()
+    start = time.perf_counter()
+    try:
+        return await _Profiled(coro, profile)
+    finally:
+        elapsed = time.perf_counter() - start
+        _current.reset(token)
+        allocations = None
+        if alloc:
+            after = tracemalloc.take_snapshot()
+            # Con el rastreo todavía activo, recorrer las trazas costaría una pila por asignación
+            _stop_tracing()
+            allocations = _allocation_deltas(before, after)
+        try:
+            save_sample(action, profiles, elapsed, allocations, directory)
+        except Exception as e:
+            logger.error("No se pudo guardar el perfil de %s: %s", action, e)
+
+
+def aggregate(directory: str, action: Optional[str] = None, top: int = 25,
+              sort: str = "cumulative") -> Dict[str, Any]:
+    """
+    Agrega las muestras guardadas
+
+    Returns:
+        Dict[str, Any]: "samples", "functions" (top por `sort`) y
+        "allocations" (top por bytes asignados, sumados entre muestras)
+    """
+    pattern = os.path.join(directory, action or "*")
+    prof_files = sorted(glob.glob(os.path.join(pattern, "*.prof")))
+    functions: List[Dict[str, Any]] = []
+    if prof_files:
+        stats = pstats.Stats()
+        for path in prof_files:
+            try:
+                stats.add(path)
+            except (TypeError, EOFError, ValueError):
+                # Muestra vacía o a medio escribir por otro worker
+                continue
+        key = {"cumulative": 3, "tottime": 2, "calls": 1}[sort]
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][key], reverse=True)[:top]
+        for (filename, line, name), (_, calls, tottime, cumtime, _) in rows:
+            functions.append({
+                "function": f"{filename}:{line}({name})",
+                "calls": calls,
+                "tottime": round(tottime, 6),
+                "cumtime": round(cumtime, 6),
+            })
+
+    totals: Dict[str, Dict[str, int]] = {}
+    for path in glob.glob(os.path.join(pattern, "*.alloc.json")):
+        with open(path, "r", encoding="utf-8") as f:
+            for entry in json.load(f)["allocations"]:
+                total = totals.setdefault(entry["location"], {"size_diff": 0, "count_diff": 0})
+                total["size_diff"] += entry["size_diff"]
+                total["count_diff"] += entry["count_diff"]
+    allocations = [dict(location=location, **total) for location, total in
+                   sorted(totals.items(), key=lambda item: item[1]["size_diff"], reverse=True)[:top]]
+    return {"samples": len(prof_files), "functions": functions, "allocations": allocations}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Agrega los perfiles muestreados de las acciones")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report = subparsers.add_parser("report", help="Top de funciones y de asignaciones")
+    report.add_argument("--dir", default=PROFILE_DIR)
+    report.add_argument("--action", default=None, help="Solo esta acción")
+    report.add_argument("--top", type=int, default=25)
+    report.add_argument("--sort", choices=["cumulative", "tottime", "calls"], default="cumulative")
+    report.add_argument("--json", action="store_true", help="Salida JSON")
+    args = parser.parse_args(argv)
+
+    result = aggregate(args.dir, args.action, args.top, args.sort)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+    print(f"{result['samples']} muestras")
+    print(f"\n{'cumtime':>10} {'tottime':>10} {'calls':>8}  función")
+    for row in result["functions"]:
+        print(f"{row['cumtime']:10.4f} {row['tottime']:10.4f} {row['calls']:8d}  {row['function']}")
+    if result["allocations"]:
+        print(f"\n{'KiB':>10} {'bloques':>8}  línea")
+        for row in result["allocations"]:
+            print(f"{row['size_diff'] / 1024:10.1f} {row['count_diff']:8d}  {row['location']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
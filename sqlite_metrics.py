@@ -3,82 +3,567 @@ Sistema de métricas local usando SQLite
 Almacena resultados del quiz, consultas y otras interacciones del usuario
 """
 
-import sqlite3
 import os
-from datetime import datetime
+import ast
+import json
+import zlib
+import sqlite3
+import logging
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional
 from contextlib import contextmanager
 
+import instrumentation
+from sqlite_storage import (
+    DB_PATH, SHARDS, Storage, all_storages, get_storage, shard_index, shard_path
+)
+
+logger = logging.getLogger(__name__)
+
+# Antigüedad (en días) a partir de la cual los eventos crudos se compactan
+COMPACT_AFTER_DAYS = int(os.getenv("MAIKA_COMPACT_AFTER_DAYS", "90"))
+
+# Ingesta asíncrona: tamaño de la cola, filas por transacción y espera entre lotes
+METRICS_ASYNC = os.getenv("MAIKA_METRICS_ASYNC", "1") not in ("0", "false", "False")
+METRICS_QUEUE_SIZE = int(os.getenv("MAIKA_METRICS_QUEUE_SIZE", "10000"))
+METRICS_BATCH_SIZE = int(os.getenv("MAIKA_METRICS_BATCH_SIZE", "500"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("MAIKA_METRICS_FLUSH_INTERVAL", "0.5"))
+
+# Top-K del leaderboard en memoria: tamaño y segundos antes de recargar desde SQLite
+LEADERBOARD_CACHE_SIZE = int(os.getenv("MAIKA_LEADERBOARD_CACHE_SIZE", "50"))
+LEADERBOARD_CACHE_TTL = float(os.getenv("MAIKA_LEADERBOARD_CACHE_TTL", "60"))
+
+# Tablas de eventos: columnas e índices secundarios, comunes a la tabla base
+# (datos anteriores al particionado) y a sus particiones mensuales
+EVENT_TABLES = {
+    "quiz_results": """
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        total_questions INTEGER NOT NULL,
+        percentage REAL NOT NULL,
+        quiz_data TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    """,
+    "user_queries": """
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        intent TEXT NOT NULL,
+        entities TEXT,
+        response_helpful BOOLEAN,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    """,
+    "usage_stats": """
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        action_type TEXT NOT NULL,
+        success BOOLEAN,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    """,
+}
+
+EVENT_INDEXES = {
+    # Historial por usuario (cubre get_user_quiz_history sin tocar la tabla)
+    # y ventanas de tiempo de compact()
+    "quiz_results": [
+        ("user_ts", "user_id, timestamp, score, total_questions, percentage"),
+        ("ts_pct", "timestamp, percentage"),
+    ],
+    "user_queries": [
+        ("user_ts", "user_id, timestamp"),
+        ("ts_intent", "timestamp, intent"),
+    ],
+    "usage_stats": [
+        ("user_ts", "user_id, timestamp"),
+        ("ts_action", "timestamp, action_type"),
+    ],
+}
+
+# Acumulación de las filas anteriores a un día de corte en los agregados diarios;
+# {table} es la tabla base o una de sus particiones
+ROLLUP_SQL = {
+    "user_queries": """
+        INSERT INTO user_queries_daily (day, user_id, intent, queries, helpful, not_helpful)
+        SELECT date(timestamp), user_id, intent, COUNT(*),
+               COUNT(*) FILTER (WHERE response_helpful = 1),
+               COUNT(*) FILTER (WHERE response_helpful = 0)
+        FROM {table}
+        WHERE timestamp < ?
+        GROUP BY date(timestamp), user_id, intent
+        ON CONFLICT (day, user_id, intent) DO UPDATE SET
+            queries = queries + excluded.queries,
+            helpful = helpful + excluded.helpful,
+            not_helpful = not_helpful + excluded.not_helpful
+    """,
+    "usage_stats": """
+        INSERT INTO usage_stats_daily (day, user_id, action_type, total, successes)
+        SELECT date(timestamp), user_id, action_type, COUNT(*),
+               COUNT(*) FILTER (WHERE success = 1)
+        FROM {table}
+        WHERE timestamp < ?
+        GROUP BY date(timestamp), user_id, action_type
+        ON CONFLICT (day, user_id, action_type) DO UPDATE SET
+            total = total + excluded.total,
+            successes = successes + excluded.successes
+    """,
+    "quiz_results": """
+        INSERT INTO quiz_results_daily (day, user_id, quizzes, score_sum, questions_sum,
+                                        percentage_sum, best_percentage)
+        SELECT date(timestamp), user_id, COUNT(*), SUM(score), SUM(total_questions),
+               SUM(percentage), MAX(percentage)
+        FROM {table}
+        WHERE timestamp < ?
+        GROUP BY date(timestamp), user_id
+        ON CONFLICT (day, user_id) DO UPDATE SET
+            quizzes = quizzes + excluded.quizzes,
+            score_sum = score_sum + excluded.score_sum,
+            questions_sum = questions_sum + excluded.questions_sum,
+            percentage_sum = percentage_sum + excluded.percentage_sum,
+            best_percentage = MAX(best_percentage, excluded.best_percentage)
+    """,
+}
+
+def _utc_timestamp() -> str:
+    """Timestamp con el mismo formato que CURRENT_TIMESTAMP de SQLite"""
+    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+def _hour_bucket(timestamp: str) -> str:
+    """Trunca un timestamp 'YYYY-MM-DD HH:MM:SS' a su hora"""
+    return timestamp[:13] + ":00:00"
+
+def _month_key(timestamp: str) -> str:
+    """Mes de un timestamp como 'YYYYMM' (sufijo de la partición)"""
+    return timestamp[:4] + timestamp[5:7]
+
+def _month_end(month: str) -> str:
+    """Primer día del mes siguiente a 'YYYYMM', como 'YYYY-MM-DD'"""
+    year, mon = int(month[:4]), int(month[4:])
+    year, mon = (year + 1, 1) if mon == 12 else (year, mon + 1)
+    return f"{year:04d}-{mon:02d}-01"
+
+def encode_quiz_payload(quiz_data: Optional[Dict[str, Any]]):
+    """
+    Codifica el quiz para la columna quiz_data
+    
+    Si todas las preguntas tienen id se guarda un JSON compacto con ids y
+    respuestas elegidas; si no, el payload completo comprimido con zlib (BLOB).
+    """
+    if not quiz_data:
+        return None
+    questions = quiz_data.get("questions") or []
+    ids = [q.get("id") if isinstance(q, dict) else None for q in questions]
+    if ids and all(qid is not None for qid in ids):
+        compact = {"v": 1, "q": ids, "a": list(quiz_data.get("answers") or [])}
+        if quiz_data.get("start_time"):
+            compact["t"] = quiz_data["start_time"]
+        return json.dumps(compact, separators=(",", ":"))
+    raw = json.dumps(quiz_data, ensure_ascii=False, separators=(",", ":"), default=str)
+    return zlib.compress(raw.encode("utf-8"))
+
+def decode_quiz_payload(value) -> Optional[Dict[str, Any]]:
+    """Inverso de encode_quiz_payload; también entiende el repr antiguo"""
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        return json.loads(zlib.decompress(value).decode("utf-8"))
+    if value.startswith("{'") or value == "{}":
+        return ast.literal_eval(value)
+    return json.loads(value)
+
+def _leaderboard_entry(row) -> Dict[str, Any]:
+    return {
+        "user_id": row[0],
+        "best_score": row[1],
+        "best_percentage": row[2],
+        "total_quizzes": row[3]
+    }
+
+def _report_error(op: str, message: str, error: Exception):
+    """Registra en el log y cuenta un error de una operación de métricas"""
+    logger.error("%s: %s", message, error, extra={"op": op})
+    instrumentation.inc("maika_metrics_errors_total", {"op": op})
+
+def _usage_summary(totals: List[tuple], days: int) -> Dict[str, Any]:
+    """Combina las sumas de usage_totals() de uno o varios shards"""
+    queries_by_intent: Dict[str, int] = {}
+    total_quizzes, percentage_sum = 0, 0
+    for intents, quizzes, pct in totals:
+        for intent, count in intents.items():
+            queries_by_intent[intent] = queries_by_intent.get(intent, 0) + count
+        total_quizzes += quizzes
+        percentage_sum += pct
+    queries_by_intent = dict(
+        sorted(queries_by_intent.items(), key=lambda item: item[1], reverse=True)
+    )
+    avg_score = (percentage_sum / total_quizzes) if total_quizzes else 0
+    return {
+        "total_queries": sum(queries_by_intent.values()),
+        "queries_by_intent": queries_by_intent,
+        "total_quizzes": total_quizzes,
+        "average_quiz_score": round(avg_score, 1),
+        "period_days": days
+    }
+
+class LeaderboardCache:
+    """
+    Top-K del leaderboard mantenido en memoria del proceso
+    
+    Como las mejores marcas de un usuario solo pueden subir, basta con
+    ofrecer cada fila actualizada: entra si supera al último del top-K.
+    Se recarga desde SQLite cuando vence el TTL, para ver las escrituras
+    de otros procesos.
+    """
+    
+    def __init__(self, capacity: int = LEADERBOARD_CACHE_SIZE, ttl: float = LEADERBOARD_CACHE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: Optional[List[Dict]] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _rank_key(entry: Dict) -> tuple:
+        return (-entry["best_percentage"], -entry["best_score"])
+    
+    def load(self, entries: List[Dict]):
+        """Reemplaza el contenido con las primeras filas del ranking"""
+        with self._lock:
+            self._entries = [dict(e) for e in entries[:self.capacity]]
+            self._loaded_at = time.monotonic()
+    
+    def invalidate(self):
+        with self._lock:
+            self._entries = None
+    
+    def offer(self, entry: Dict):
+        """Incorpora la fila actualizada de un usuario"""
+        with self._lock:
+            if self._entries is None:
+                return
+            entries = [e for e in self._entries if e["user_id"] != entry["user_id"]]
+            if len(entries) == len(self._entries) and len(entries) >= self.capacity \
+                    and self._rank_key(entry) >= self._rank_key(entries[-1]):
+                return
+            entries.append(dict(entry))
+            entries.sort(key=self._rank_key)
+            self._entries = entries[:self.capacity]
+    
+    def top(self, limit: int) -> Optional[List[Dict]]:
+        """Devuelve el top `limit`, o None si hay que leer de SQLite"""
+        with self._lock:
+            fresh = self._entries is not None and time.monotonic() - self._loaded_at < self.ttl
+            if not fresh or limit > self.capacity:
+                self.misses += 1
+                instrumentation.cache_access("leaderboard", False)
+                return None
+            self.hits += 1
+            instrumentation.cache_access("leaderboard", True)
+            return [dict(e) for e in self._entries[:limit]]
+
 class MetricsManager:
-    """Maneja el almacenamiento de métricas en SQLite"""
+    """
+    Maneja el almacenamiento de métricas en SQLite
     
-    def __init__(self, db_path: str = "metrics.db"):
-        self.db_path = db_path
+    Fachada sobre sqlite_storage: la conexión, los pragmas y el registro de
+    migraciones son los del Storage compartido del archivo.
+    """
+    
+    def __init__(self, db_path: Optional[str] = None, storage: Optional[Storage] = None):
+        self.storage = storage or get_storage(db_path)
+        self.db_path = self.storage.db_path
+        self._lock = self.storage.lock
+        self.leaderboard_cache = LeaderboardCache()
+        self._partitions: Dict[str, set] = {base: set() for base in EVENT_TABLES}
+        self._schema_version: Optional[int] = None
         self.init_database()
     
     def init_database(self):
         """Inicializa la base de datos con las tablas necesarias"""
+        self.storage.ensure_schema("metrics", self._create_schema)
+        self.storage.run_once("metrics_quiz_payloads_v1", self._migrate_quiz_payloads)
         with self.get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Tabla para resultados del quiz
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS quiz_results (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    score INTEGER NOT NULL,
-                    total_questions INTEGER NOT NULL,
-                    percentage REAL NOT NULL,
-                    quiz_data TEXT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Tabla para consultas del usuario
+            self._load_partitions(conn.cursor())
+    
+    def _create_schema(self, cursor):
+        """Crea las tablas e índices de métricas (idempotente)"""
+        # Tablas base de eventos (quiz_results, user_queries, usage_stats);
+        # los eventos nuevos van a sus particiones mensuales
+        for base in EVENT_TABLES:
+            self._create_event_table(cursor, base, base)
+        
+        # Tabla para leaderboard
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS leaderboard (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                best_score INTEGER NOT NULL,
+                best_percentage REAL NOT NULL,
+                total_quizzes INTEGER DEFAULT 1,
+                last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Agregados diarios de eventos compactados (ver compact())
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS user_queries_daily (
+                day TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                intent TEXT NOT NULL,
+                queries INTEGER NOT NULL DEFAULT 0,
+                helpful INTEGER NOT NULL DEFAULT 0,
+                not_helpful INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, user_id, intent)
+            )
+        """)
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS usage_stats_daily (
+                day TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                action_type TEXT NOT NULL,
+                total INTEGER NOT NULL DEFAULT 0,
+                successes INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, user_id, action_type)
+            )
+        """)
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS quiz_results_daily (
+                day TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                quizzes INTEGER NOT NULL DEFAULT 0,
+                score_sum INTEGER NOT NULL DEFAULT 0,
+                questions_sum INTEGER NOT NULL DEFAULT 0,
+                percentage_sum REAL NOT NULL DEFAULT 0,
+                best_percentage REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, user_id)
+            )
+        """)
+        
+        self._migrate_indexes(cursor)
+        self._migrate_hourly_counters(cursor)
+    
+    def _create_event_table(self, cursor, name: str, base: str):
+        """Crea una tabla de eventos (base o partición) con sus índices"""
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {name} ({EVENT_TABLES[base]})")
+        for suffix, columns in EVENT_INDEXES[base]:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_{suffix} ON {name} ({columns})")
+    
+    def _load_partitions(self, cursor):
+        """Lee de sqlite_master los meses particionados de cada tabla de eventos"""
+        # La versión se lee antes: un cambio concurrente fuerza otra lectura en el próximo uso
+        cursor.execute("PRAGMA schema_version")
+        self._schema_version = cursor.fetchone()[0]
+        self._partitions = {base: set() for base in EVENT_TABLES}
+        for base in EVENT_TABLES:
             cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_queries (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    intent TEXT NOT NULL,
-                    entities TEXT,
-                    response_helpful BOOLEAN,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Tabla para estadísticas de uso
+                SELECT name FROM sqlite_master
+                WHERE type = 'table' AND name GLOB ?
+            """, (base + "_[0-9][0-9][0-9][0-9][0-9][0-9]",))
+            self._partitions[base].update(row[0][-6:] for row in cursor.fetchall())
+    
+    def _refresh_partitions(self, cursor):
+        """
+        Relee las particiones si el esquema cambió desde la última lectura
+        
+        Otros procesos crean particiones de meses nuevos y compact() o
+        archive_partition() (p. ej. desde la CLI) las borran; PRAGMA
+        schema_version cambia con cada CREATE/DROP y leerlo no toca tablas.
+        """
+        cursor.execute("PRAGMA schema_version")
+        if cursor.fetchone()[0] != self._schema_version:
+            self._load_partitions(cursor)
+    
+    def _route(self, cursor, base: str, rows: List[tuple]) -> Dict[str, List[tuple]]:
+        """Agrupa filas (timestamp al final) por partición mensual, creándolas si faltan"""
+        routed: Dict[str, List[tuple]] = {}
+        for row in rows:
+            month = _month_key(row[-1])
+            if month not in self._partitions[base]:
+                self._create_event_table(cursor, f"{base}_{month}", base)
+                self._partitions[base].add(month)
+            routed.setdefault(f"{base}_{month}", []).append(row)
+        return routed
+    
+    def partitions(self, base: str, since: Optional[str] = None) -> List[str]:
+        """
+        Tablas físicas de una tabla de eventos, de la más reciente a la más antigua
+        
+        Args:
+            base: Tabla lógica ("quiz_results", "user_queries", "usage_stats")
+            since: Timestamp mínimo; descarta particiones anteriores (opcional)
+        
+        Returns:
+            List[str]: Particiones mensuales y, al final, la tabla base
+        """
+        with self.storage.connection() as conn:
+            self._refresh_partitions(conn.cursor())
+            months = sorted(self._partitions[base], reverse=True)
+        if since:
+            months = [m for m in months if m >= _month_key(since)]
+        return [f"{base}_{m}" for m in months] + [base]
+    
+    def _migrate_indexes(self, cursor):
+        """Crea los índices secundarios de las consultas de métricas"""
+        # Un único registro de leaderboard por usuario
+        cursor.execute("""
+            SELECT 1 FROM sqlite_master
+            WHERE type = 'index' AND name = 'idx_leaderboard_user'
+        """)
+        if cursor.fetchone() is None:
+            self._merge_duplicate_leaderboard_rows(cursor)
             cursor.execute("""
-                CREATE TABLE IF NOT EXISTS usage_stats (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    action_type TEXT NOT NULL,
-                    success BOOLEAN,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
+                CREATE UNIQUE INDEX idx_leaderboard_user ON leaderboard (user_id)
             """)
-            
-            # Tabla para leaderboard
+        
+        # Orden del ranking (cubre get_leaderboard sin ordenar toda la tabla)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_leaderboard_rank
+            ON leaderboard (best_percentage DESC, best_score DESC, user_id, total_quizzes)
+        """)
+    
+    def _migrate_hourly_counters(self, cursor):
+        """Crea los contadores por hora que alimentan get_usage_stats"""
+        cursor.execute("""
+            SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'quiz_hourly'
+        """)
+        needs_backfill = cursor.fetchone() is None
+        
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS usage_hourly_intent (
+                hour TEXT NOT NULL,
+                intent TEXT NOT NULL,
+                queries INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (hour, intent)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS usage_hourly_action (
+                hour TEXT NOT NULL,
+                action_type TEXT NOT NULL,
+                total INTEGER NOT NULL DEFAULT 0,
+                successes INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (hour, action_type)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS quiz_hourly (
+                hour TEXT PRIMARY KEY,
+                quizzes INTEGER NOT NULL DEFAULT 0,
+                score_sum INTEGER NOT NULL DEFAULT 0,
+                percentage_sum REAL NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        
+        if not needs_backfill:
+            return
+        
+        # Bases existentes: reconstruir los contadores desde las filas crudas
+        # y desde los agregados diarios ya compactados (a las 00:00 del día)
+        cursor.execute("""
+            INSERT INTO usage_hourly_intent (hour, intent, queries)
+            SELECT hour, intent, SUM(n) FROM (
+                SELECT strftime('%Y-%m-%d %H:00:00', timestamp) AS hour, intent, COUNT(*) AS n
+                FROM user_queries GROUP BY 1, 2
+                UNION ALL
+                SELECT day || ' 00:00:00', intent, SUM(queries) FROM user_queries_daily GROUP BY 1, 2
+            )
+            GROUP BY hour, intent
+        """)
+        cursor.execute("""
+            INSERT INTO usage_hourly_action (hour, action_type, total, successes)
+            SELECT hour, action_type, SUM(n), SUM(ok) FROM (
+                SELECT strftime('%Y-%m-%d %H:00:00', timestamp) AS hour, action_type,
+                       COUNT(*) AS n, COUNT(*) FILTER (WHERE success = 1) AS ok
+                FROM usage_stats GROUP BY 1, 2
+                UNION ALL
+                SELECT day || ' 00:00:00', action_type, SUM(total), SUM(successes)
+                FROM usage_stats_daily GROUP BY 1, 2
+            )
+            GROUP BY hour, action_type
+        """)
+        cursor.execute("""
+            INSERT INTO quiz_hourly (hour, quizzes, score_sum, percentage_sum)
+            SELECT hour, SUM(n), SUM(score), SUM(pct) FROM (
+                SELECT strftime('%Y-%m-%d %H:00:00', timestamp) AS hour,
+                       COUNT(*) AS n, SUM(score) AS score, SUM(percentage) AS pct
+                FROM quiz_results GROUP BY 1
+                UNION ALL
+                SELECT day || ' 00:00:00', SUM(quizzes), SUM(score_sum), SUM(percentage_sum)
+                FROM quiz_results_daily GROUP BY 1
+            )
+            GROUP BY hour
+        """)
+    
+    def _migrate_quiz_payloads(self, cursor, chunk_size: int = 500):
+        """Recodifica los quiz_data guardados como repr de Python"""
+        last_id = 0
+        while True:
             cursor.execute("""
-                CREATE TABLE IF NOT EXISTS leaderboard (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT NOT NULL,
-                    best_score INTEGER NOT NULL,
-                    best_percentage REAL NOT NULL,
-                    total_quizzes INTEGER DEFAULT 1,
-                    last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            conn.commit()
+                SELECT id, quiz_data FROM quiz_results
+                WHERE id > ? AND typeof(quiz_data) = 'text' AND quiz_data LIKE '{''%'
+                ORDER BY id LIMIT ?
+            """, (last_id, chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            updates = []
+            for row_id, value in rows:
+                try:
+                    updates.append((encode_quiz_payload(decode_quiz_payload(value)), row_id))
+                except (ValueError, SyntaxError):
+                    # Repr no parseable (p. ej. objetos arbitrarios): solo comprimir
+                    raw = json.dumps({"raw": value}, ensure_ascii=False)
+                    updates.append((zlib.compress(raw.encode("utf-8")), row_id))
+            cursor.executemany("UPDATE quiz_results SET quiz_data = ? WHERE id = ?", updates)
+            last_id = rows[-1][0]
+    
+    def _merge_duplicate_leaderboard_rows(self, cursor):
+        """Fusiona filas repetidas de un mismo usuario antes de crear el índice único"""
+        cursor.execute("""
+            CREATE TEMP TABLE leaderboard_merged AS
+            SELECT user_id, MAX(best_score) AS best_score, MAX(best_percentage) AS best_percentage,
+                   SUM(total_quizzes) AS total_quizzes, MAX(last_updated) AS last_updated
+            FROM leaderboard
+            GROUP BY user_id
+            HAVING COUNT(*) > 1
+        """)
+        cursor.execute("""
+            DELETE FROM leaderboard WHERE user_id IN (SELECT user_id FROM leaderboard_merged)
+        """)
+        cursor.execute("""
+            INSERT INTO leaderboard (user_id, best_score, best_percentage, total_quizzes, last_updated)
+            SELECT user_id, best_score, best_percentage, total_quizzes, last_updated
+            FROM leaderboard_merged
+        """)
+        cursor.execute("DROP TABLE leaderboard_merged")
     
     @contextmanager
     def get_connection(self):
-        """Context manager para conexiones a SQLite"""
-        conn = sqlite3.connect(self.db_path)
+        """
+        Context manager que presta la conexión persistente del Storage
+        
+        La conexión se comparte entre hilos y se serializa con un lock;
+        si el bloque falla, la transacción abierta se revierte.
+        """
         try:
-            yield conn
-        finally:
-            conn.close()
+            with self.storage.connection() as conn:
+                yield conn
+        except Exception:
+            # El rollback puede deshacer particiones creadas o borradas
+            with self.storage.connection() as conn:
+                self._load_partitions(conn.cursor())
+            raise
+    
+    def close(self):
+        """Cierra la conexión persistente (se reabre en el próximo uso)"""
+        self.storage.close()
     
     def save_quiz_result(self, user_id: str, score: int, total_questions: int, 
                         quiz_data: Dict[str, Any]) -> bool:
@@ -97,59 +582,54 @@ class MetricsManager:
         try:
             percentage = (score / total_questions) * 100
             
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Insertar resultado del quiz
-                cursor.execute("""
-                    INSERT INTO quiz_results (user_id, score, total_questions, percentage, quiz_data)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (user_id, score, total_questions, percentage, str(quiz_data)))
-                
-                # Actualizar leaderboard
-                self._update_leaderboard(cursor, user_id, score, percentage)
-                
-                conn.commit()
-                
-                print(f"Resultado del quiz guardado: {score}/{total_questions} ({percentage:.1f}%)")
-                return True
+            # Insertar resultado del quiz y actualizar leaderboard
+            self.write_batch({"quiz_results": [
+                (user_id, score, total_questions, percentage,
+                 encode_quiz_payload(quiz_data), _utc_timestamp())
+            ]})
+            
+            logger.debug("Resultado del quiz guardado: %s/%s (%.1f%%)", score, total_questions, percentage)
+            return True
                 
         except Exception as e:
-            print(f"Error guardando resultado del quiz: {e}")
+            _report_error("save_quiz_result", "Error guardando resultado del quiz", e)
             return False
     
-    def _update_leaderboard(self, cursor, user_id: str, score: int, percentage: float):
-        """Actualiza el leaderboard del usuario"""
-        # Verificar si el usuario ya existe en el leaderboard
-        cursor.execute("""
-            SELECT best_score, best_percentage, total_quizzes 
-            FROM leaderboard WHERE user_id = ?
-        """, (user_id,))
+    def _update_leaderboard(self, cursor, rows: List[tuple]) -> List[Dict]:
+        """
+        Actualiza el leaderboard con los quizzes de un lote
         
-        result = cursor.fetchone()
+        Un único upsert atómico por usuario: los mejores valores se combinan
+        con MAX() dentro de SQLite, sin leer-y-luego-escribir.
         
-        if result:
-            best_score, best_percentage, total_quizzes = result
-            
-            # Actualizar si es mejor puntuación
-            if score > best_score or percentage > best_percentage:
-                cursor.execute("""
-                    UPDATE leaderboard 
-                    SET best_score = ?, best_percentage = ?, total_quizzes = ?, last_updated = CURRENT_TIMESTAMP
-                    WHERE user_id = ?
-                """, (max(score, best_score), max(percentage, best_percentage), total_quizzes + 1, user_id))
-            else:
-                cursor.execute("""
-                    UPDATE leaderboard 
-                    SET total_quizzes = ?, last_updated = CURRENT_TIMESTAMP
-                    WHERE user_id = ?
-                """, (total_quizzes + 1, user_id))
-        else:
-            # Insertar nuevo usuario
+        Returns:
+            List[Dict]: Filas resultantes de los usuarios afectados
+        """
+        per_user: Dict[str, List] = {}
+        for user_id, score, _total, percentage, _data, _ts in rows:
+            entry = per_user.setdefault(user_id, [score, percentage, 0])
+            entry[0] = max(entry[0], score)
+            entry[1] = max(entry[1], percentage)
+            entry[2] += 1
+        
+        cursor.executemany("""
+            INSERT INTO leaderboard (user_id, best_score, best_percentage, total_quizzes)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                best_score = MAX(best_score, excluded.best_score),
+                best_percentage = MAX(best_percentage, excluded.best_percentage),
+                total_quizzes = total_quizzes + excluded.total_quizzes,
+                last_updated = CURRENT_TIMESTAMP
+        """, [(user_id, score, pct, n) for user_id, (score, pct, n) in per_user.items()])
+        
+        updated = []
+        for user_id in per_user:
             cursor.execute("""
-                INSERT INTO leaderboard (user_id, best_score, best_percentage, total_quizzes)
-                VALUES (?, ?, ?, 1)
-            """, (user_id, score, percentage))
+                SELECT user_id, best_score, best_percentage, total_quizzes
+                FROM leaderboard WHERE user_id = ?
+            """, (user_id,))
+            updated.append(_leaderboard_entry(cursor.fetchone()))
+        return updated
     
     def save_user_query(self, user_id: str, intent: str, entities: Optional[str] = None, 
                        response_helpful: Optional[bool] = None) -> bool:
@@ -166,19 +646,13 @@ class MetricsManager:
             bool: True si se guardó exitosamente
         """
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute("""
-                    INSERT INTO user_queries (user_id, intent, entities, response_helpful)
-                    VALUES (?, ?, ?, ?)
-                """, (user_id, intent, entities, response_helpful))
-                
-                conn.commit()
-                return True
+            self.write_batch({"user_queries": [
+                (user_id, intent, entities, response_helpful, _utc_timestamp())
+            ]})
+            return True
                 
         except Exception as e:
-            print(f"Error guardando consulta del usuario: {e}")
+            _report_error("save_user_query", "Error guardando consulta del usuario", e)
             return False
     
     def save_usage_stat(self, user_id: str, action_type: str, success: bool = True) -> bool:
@@ -194,21 +668,124 @@ class MetricsManager:
             bool: True si se guardó exitosamente
         """
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute("""
-                    INSERT INTO usage_stats (user_id, action_type, success)
-                    VALUES (?, ?, ?)
-                """, (user_id, action_type, success))
-                
-                conn.commit()
-                return True
+            self.write_batch({"usage_stats": [
+                (user_id, action_type, success, _utc_timestamp())
+            ]})
+            return True
                 
         except Exception as e:
-            print(f"Error guardando estadística de uso: {e}")
+            _report_error("save_usage_stat", "Error guardando estadística de uso", e)
             return False
     
+    def write_batch(self, batch: Dict[str, List[tuple]]) -> int:
+        """
+        Inserta un lote de métricas en una sola transacción
+        
+        Args:
+            batch: Filas por tabla ("user_queries", "usage_stats", "quiz_results"),
+                   cada una terminada en su timestamp UTC 'YYYY-MM-DD HH:MM:SS'
+        
+        Returns:
+            int: Número de filas escritas
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Con filas pendientes del llamador (p. ej. add_xp_many) no se puede revertir para reintentar
+            can_retry = not conn.in_transaction
+            self._refresh_partitions(cursor)
+            try:
+                written, leaderboard_rows = self._insert_batch(cursor, batch)
+            except sqlite3.OperationalError as e:
+                # Una partición borrada por otro proceso entre la comprobación y el INSERT
+                if not can_retry or "no such table" not in str(e):
+                    raise
+                conn.rollback()
+                self._load_partitions(cursor)
+                written, leaderboard_rows = self._insert_batch(cursor, batch)
+            conn.commit()
+        
+        # Solo tras el commit: un rollback no debe ensuciar el top-K en memoria
+        for entry in leaderboard_rows:
+            self.leaderboard_cache.offer(entry)
+        return written
+    
+    def _insert_batch(self, cursor, batch: Dict[str, List[tuple]]) -> tuple:
+        """Inserta las filas del lote en sus particiones; devuelve (filas, leaderboard actualizado)"""
+        written = 0
+        leaderboard_rows: List[Dict] = []
+        rows = batch.get("user_queries")
+        if rows:
+            for table, part_rows in self._route(cursor, "user_queries", rows).items():
+                cursor.executemany(f"""
+                    INSERT INTO {table} (user_id, intent, entities, response_helpful, timestamp)
+                    VALUES (?, ?, ?, ?, ?)
+                """, part_rows)
+            self._bump_intent_counters(cursor, rows)
+            written += len(rows)
+        
+        rows = batch.get("usage_stats")
+        if rows:
+            for table, part_rows in self._route(cursor, "usage_stats", rows).items():
+                cursor.executemany(f"""
+                    INSERT INTO {table} (user_id, action_type, success, timestamp)
+                    VALUES (?, ?, ?, ?)
+                """, part_rows)
+            self._bump_action_counters(cursor, rows)
+            written += len(rows)
+        
+        rows = batch.get("quiz_results")
+        if rows:
+            for table, part_rows in self._route(cursor, "quiz_results", rows).items():
+                cursor.executemany(f"""
+                    INSERT INTO {table} (user_id, score, total_questions, percentage, quiz_data, timestamp)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, part_rows)
+            leaderboard_rows = self._update_leaderboard(cursor, rows)
+            self._bump_quiz_counters(cursor, rows)
+            written += len(rows)
+        return written, leaderboard_rows
+    
+    def _bump_intent_counters(self, cursor, rows: List[tuple]):
+        """Suma las consultas del lote a sus buckets por hora e intención"""
+        counts: Dict[tuple, int] = {}
+        for _user, intent, _entities, _helpful, timestamp in rows:
+            key = (_hour_bucket(timestamp), intent)
+            counts[key] = counts.get(key, 0) + 1
+        cursor.executemany("""
+            INSERT INTO usage_hourly_intent (hour, intent, queries) VALUES (?, ?, ?)
+            ON CONFLICT (hour, intent) DO UPDATE SET queries = queries + excluded.queries
+        """, [(hour, intent, n) for (hour, intent), n in counts.items()])
+    
+    def _bump_action_counters(self, cursor, rows: List[tuple]):
+        """Suma las acciones del lote a sus buckets por hora y tipo"""
+        counts: Dict[tuple, List[int]] = {}
+        for _user, action_type, success, timestamp in rows:
+            bucket = counts.setdefault((_hour_bucket(timestamp), action_type), [0, 0])
+            bucket[0] += 1
+            bucket[1] += 1 if success else 0
+        cursor.executemany("""
+            INSERT INTO usage_hourly_action (hour, action_type, total, successes) VALUES (?, ?, ?, ?)
+            ON CONFLICT (hour, action_type) DO UPDATE SET
+                total = total + excluded.total,
+                successes = successes + excluded.successes
+        """, [(hour, action, n, ok) for (hour, action), (n, ok) in counts.items()])
+    
+    def _bump_quiz_counters(self, cursor, rows: List[tuple]):
+        """Suma los quizzes del lote a sus buckets por hora"""
+        counts: Dict[str, List[float]] = {}
+        for _user, score, _total, percentage, _data, timestamp in rows:
+            bucket = counts.setdefault(_hour_bucket(timestamp), [0, 0, 0.0])
+            bucket[0] += 1
+            bucket[1] += score
+            bucket[2] += percentage
+        cursor.executemany("""
+            INSERT INTO quiz_hourly (hour, quizzes, score_sum, percentage_sum) VALUES (?, ?, ?, ?)
+            ON CONFLICT (hour) DO UPDATE SET
+                quizzes = quizzes + excluded.quizzes,
+                score_sum = score_sum + excluded.score_sum,
+                percentage_sum = percentage_sum + excluded.percentage_sum
+        """, [(hour, n, score, pct) for hour, (n, score, pct) in counts.items()])
+    
     def get_user_quiz_history(self, user_id: str, limit: int = 10) -> List[Dict]:
         """
         Obtiene el historial de quizzes de un usuario
@@ -224,27 +801,31 @@ class MetricsManager:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute("""
-                    SELECT score, total_questions, percentage, timestamp
-                    FROM quiz_results 
-                    WHERE user_id = ?
-                    ORDER BY timestamp DESC
-                    LIMIT ?
-                """, (user_id, limit))
-                
+                # Recorrer las particiones desde la más reciente hasta completar el límite
                 results = []
-                for row in cursor.fetchall():
-                    results.append({
-                        "score": row[0],
-                        "total_questions": row[1],
-                        "percentage": row[2],
-                        "timestamp": row[3]
-                    })
+                for table in self.partitions("quiz_results"):
+                    cursor.execute(f"""
+                        SELECT score, total_questions, percentage, timestamp
+                        FROM {table} 
+                        WHERE user_id = ?
+                        ORDER BY timestamp DESC
+                        LIMIT ?
+                    """, (user_id, limit - len(results)))
+                    
+                    for row in cursor.fetchall():
+                        results.append({
+                            "score": row[0],
+                            "total_questions": row[1],
+                            "percentage": row[2],
+                            "timestamp": row[3]
+                        })
+                    if len(results) >= limit:
+                        break
                 
                 return results
                 
         except Exception as e:
-            print(f"Error obteniendo historial del usuario: {e}")
+            _report_error("get_user_quiz_history", "Error obteniendo historial del usuario", e)
             return []
     
     def get_leaderboard(self, limit: int = 10) -> List[Dict]:
@@ -258,29 +839,28 @@ class MetricsManager:
             List[Dict]: Lista de mejores puntuaciones
         """
         try:
+            cached = self.leaderboard_cache.top(limit)
+            if cached is not None:
+                return cached
+            
             with self.get_connection() as conn:
                 cursor = conn.cursor()
                 
+                # Cargar al menos la capacidad del top-K para servir las siguientes lecturas
                 cursor.execute("""
                     SELECT user_id, best_score, best_percentage, total_quizzes
                     FROM leaderboard 
                     ORDER BY best_percentage DESC, best_score DESC
                     LIMIT ?
-                """, (limit,))
-                
-                results = []
-                for row in cursor.fetchall():
-                    results.append({
-                        "user_id": row[0],
-                        "best_score": row[1],
-                        "best_percentage": row[2],
-                        "total_quizzes": row[3]
-                    })
+                """, (max(limit, self.leaderboard_cache.capacity),))
                 
-                return results
+                results = [_leaderboard_entry(row) for row in cursor.fetchall()]
+            
+            self.leaderboard_cache.load(results)
+            return results[:limit]
                 
         except Exception as e:
-            print(f"Error obteniendo leaderboard: {e}")
+            _report_error("get_leaderboard", "Error obteniendo leaderboard", e)
             return []
     
     def get_usage_stats(self, days: int = 30) -> Dict[str, Any]:
@@ -293,70 +873,422 @@ class MetricsManager:
         Returns:
             Dict[str, Any]: Estadísticas de uso
         """
+        try:
+            return _usage_summary([self.usage_totals(days)], days)
+        except Exception as e:
+            _report_error("get_usage_stats", "Error obteniendo estadísticas", e)
+            return {}
+    
+    def usage_totals(self, days: int = 30) -> tuple:
+        """
+        Sumas crudas de la ventana: (consultas por intent, quizzes, suma de porcentajes)
+        
+        Se exponen sin promediar para poder combinarlas entre shards.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Una sola agregación sobre los contadores por hora de la ventana
+            since = _hour_bucket(
+                (datetime.utcnow() - timedelta(days=int(days))).strftime("%Y-%m-%d %H:%M:%S")
+            )
+            cursor.execute("""
+                SELECT intent, SUM(queries), NULL
+                FROM usage_hourly_intent
+                WHERE hour >= ?
+                GROUP BY intent
+                UNION ALL
+                SELECT NULL, SUM(quizzes), SUM(percentage_sum)
+                FROM quiz_hourly
+                WHERE hour >= ?
+            """, (since, since))
+            
+            queries_by_intent = {}
+            total_quizzes, percentage_sum = 0, 0
+            for intent, count, pct in cursor.fetchall():
+                if intent is None:
+                    total_quizzes, percentage_sum = count or 0, pct or 0
+                else:
+                    queries_by_intent[intent] = count
+            return queries_by_intent, total_quizzes, percentage_sum
+
+    def compact(self, older_than_days: int = COMPACT_AFTER_DAYS,
+                archive_path: Optional[str] = None) -> Dict[str, int]:
+        """
+        Compacta los eventos crudos antiguos en agregados diarios
+        
+        Los días completos anteriores a la ventana se acumulan en las tablas
+        *_daily, las filas crudas se eliminan (o se copian antes a otro
+        archivo SQLite) y se libera espacio con vacuum incremental.
+        
+        Args:
+            older_than_days: Edad mínima de los eventos a compactar
+            archive_path: Archivo SQLite donde archivar las filas crudas (opcional)
+        
+        Returns:
+            Dict[str, int]: Filas compactadas por tabla
+        """
+        cutoff = "-{} days".format(int(older_than_days))
+        compacted = {}
         try:
             with self.get_connection() as conn:
                 cursor = conn.cursor()
+                cursor.execute("SELECT date('now', ?)", (cutoff,))
+                cutoff_day = cursor.fetchone()[0]
                 
-                # Total de consultas
-                cursor.execute("""
-                    SELECT COUNT(*) FROM user_queries 
-                    WHERE timestamp >= datetime('now', '-{} days')
-                """.format(days))
-                total_queries = cursor.fetchone()[0]
+                # ATTACH no se permite dentro de una transacción
+                if archive_path:
+                    cursor.execute("ATTACH DATABASE ? AS archive", (archive_path,))
                 
-                # Consultas por intención
-                cursor.execute("""
-                    SELECT intent, COUNT(*) 
-                    FROM user_queries 
-                    WHERE timestamp >= datetime('now', '-{} days')
-                    GROUP BY intent
-                    ORDER BY COUNT(*) DESC
-                """.format(days))
-                queries_by_intent = dict(cursor.fetchall())
+                for base, rollup_sql in ROLLUP_SQL.items():
+                    compacted[base] = 0
+                    for table in self.partitions(base):
+                        month = table[-6:] if table != base else None
+                        if month and f"{month[:4]}-{month[4:]}-01" >= cutoff_day:
+                            continue
+                        
+                        cursor.execute(rollup_sql.format(table=table), (cutoff_day,))
+                        if archive_path:
+                            cursor.execute(
+                                f"CREATE TABLE IF NOT EXISTS archive.{table} AS SELECT * FROM main.{table} WHERE 0"
+                            )
+                            cursor.execute(
+                                f"INSERT INTO archive.{table} SELECT * FROM main.{table} WHERE timestamp < ?",
+                                (cutoff_day,)
+                            )
+                        
+                        if month and _month_end(month) <= cutoff_day:
+                            # Partición entera fuera de la ventana: DROP en vez de borrar fila a fila
+                            cursor.execute(f"SELECT COUNT(*) FROM main.{table}")
+                            compacted[base] += cursor.fetchone()[0]
+                            cursor.execute(f"DROP TABLE main.{table}")
+                            self._partitions[base].discard(month)
+                        else:
+                            cursor.execute(f"DELETE FROM main.{table} WHERE timestamp < ?", (cutoff_day,))
+                            compacted[base] += cursor.rowcount
                 
-                # Total de quizzes
-                cursor.execute("""
-                    SELECT COUNT(*) FROM quiz_results 
-                    WHERE timestamp >= datetime('now', '-{} days')
-                """.format(days))
-                total_quizzes = cursor.fetchone()[0]
+                conn.commit()
+                self._reclaim_space(cursor)
                 
-                # Promedio de puntuación
-                cursor.execute("""
-                    SELECT AVG(percentage) FROM quiz_results 
-                    WHERE timestamp >= datetime('now', '-{} days')
-                """.format(days))
-                avg_score = cursor.fetchone()[0] or 0
+                logger.info("Métricas compactadas hasta %s: %s", cutoff_day, compacted)
+                return compacted
+                
+        except Exception as e:
+            _report_error("compact", "Error compactando métricas", e)
+            return compacted
+        finally:
+            if archive_path:
+                self._detach("archive")
+    
+    def archive_partition(self, month: str, archive_path: Optional[str] = None) -> List[str]:
+        """
+        Saca de la base principal todas las particiones de un mes
+        
+        Con `archive_path` las tablas se copian antes a ese archivo SQLite,
+        que queda como archivo autónomo del mes; sin él simplemente se
+        descartan. Los contadores por hora y el leaderboard no cambian.
+        
+        Args:
+            month: Mes como 'YYYYMM'
+            archive_path: Archivo SQLite de destino (opcional)
+        
+        Returns:
+            List[str]: Tablas retiradas
+        """
+        removed = []
+        try:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                if archive_path:
+                    cursor.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+                
+                self._refresh_partitions(cursor)
+                for base in EVENT_TABLES:
+                    if month not in self._partitions[base]:
+                        continue
+                    table = f"{base}_{month}"
+                    if archive_path:
+                        cursor.execute(f"CREATE TABLE archive.{table} AS SELECT * FROM main.{table}")
+                    cursor.execute(f"DROP TABLE main.{table}")
+                    self._partitions[base].discard(month)
+                    removed.append(table)
                 
-                return {
-                    "total_queries": total_queries,
-                    "queries_by_intent": queries_by_intent,
-                    "total_quizzes": total_quizzes,
-                    "average_quiz_score": round(avg_score, 1),
-                    "period_days": days
-                }
+                conn.commit()
+                self._reclaim_space(cursor)
+                return removed
                 
         except Exception as e:
-            print(f"Error obteniendo estadísticas: {e}")
+            _report_error("archive_partition", f"Error archivando la partición {month}", e)
+            return removed
+        finally:
+            if archive_path:
+                self._detach("archive")
+    
+    def _detach(self, alias: str):
+        """Desadjunta una base auxiliar de la conexión persistente, si está adjunta"""
+        with self.get_connection() as conn:
+            attached = [row[1] for row in conn.execute("PRAGMA database_list")]
+            if alias in attached:
+                conn.execute(f"DETACH DATABASE {alias}")
+    
+    def _reclaim_space(self, cursor):
+        """Libera las páginas vacías del archivo tras una compactación"""
+        cursor.execute("PRAGMA auto_vacuum")
+        if cursor.fetchone()[0] != 2:
+            # Bases creadas antes del modo incremental: convertir una sola vez
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            cursor.execute("VACUUM")
+        else:
+            cursor.execute("PRAGMA incremental_vacuum")
+            cursor.fetchall()
+
+class MetricsWriter:
+    """
+    Ingesta de métricas fuera del camino de la petición
+    
+    Los helpers encolan filas en una cola acotada y un hilo de fondo las
+    vacía en lotes con executemany, una transacción por lote. Si la cola
+    está llena la fila se descarta y se cuenta en `dropped`.
+    """
+    
+    def __init__(self, manager: MetricsManager, max_queue: int = METRICS_QUEUE_SIZE,
+                 batch_size: int = METRICS_BATCH_SIZE,
+                 flush_interval: float = METRICS_FLUSH_INTERVAL):
+        self.manager = manager
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.written = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+    
+    def submit(self, table: str, row: tuple) -> bool:
+        """Encola una fila para `table`; devuelve False si se descartó"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((table, row))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Espera a que se escriba todo lo encolado hasta ahora"""
+        self._ensure_started()
+        done = threading.Event()
+        self._queue.put(("__flush__", done))
+        return done.wait(timeout)
+    
+    def close(self, timeout: Optional[float] = 5.0):
+        """Vacía la cola y detiene el hilo escritor"""
+        if self._thread is None:
+            return
+        self._queue.put(("__stop__", None))
+        self._thread.join(timeout)
+        self._thread = None
+    
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="metrics-writer", daemon=True
+                )
+                self._thread.start()
+    
+    def _run(self):
+        stop = False
+        while not (stop and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            
+            items = [first]
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            batch: Dict[str, List[tuple]] = {}
+            markers = []
+            for table, row in items:
+                if table == "__flush__":
+                    markers.append(row)
+                elif table == "__stop__":
+                    stop = True
+                else:
+                    batch.setdefault(table, []).append(row)
+            
+            if batch:
+                try:
+                    self.written += self.manager.write_batch(batch)
+                except Exception as e:
+                    lost = sum(len(rows) for rows in batch.values())
+                    self.dropped += lost
+                    _report_error("write_batch", f"Error escribiendo lote de métricas ({lost} filas)", e)
+            
+            for marker in markers:
+                marker.set()
+
+class ShardedMetricsManager:
+    """
+    Métricas repartidas en varios archivos SQLite por hash de user_id
+    
+    Cada shard tiene su propio MetricsManager (y por tanto su propia
+    conexión y lock de escritura); las escrituras y lecturas por usuario van
+    a un único shard y las consultas globales (leaderboard, estadísticas,
+    compactación) se reparten entre todos y se combinan.
+    """
+    
+    def __init__(self, db_path: Optional[str] = None, shards: int = SHARDS):
+        self.db_path = db_path or DB_PATH
+        self.shards = [MetricsManager(storage=storage)
+                       for storage in all_storages(self.db_path, shards)]
+    
+    def shard_for(self, user_id: str) -> MetricsManager:
+        """Manager del shard que guarda los datos de `user_id`"""
+        return self.shards[shard_index(user_id, len(self.shards))]
+    
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+    
+    def save_quiz_result(self, user_id: str, score: int, total_questions: int, 
+                        quiz_data: Dict[str, Any]) -> bool:
+        return self.shard_for(user_id).save_quiz_result(user_id, score, total_questions, quiz_data)
+    
+    def save_user_query(self, user_id: str, intent: str, entities: Optional[str] = None, 
+                       response_helpful: Optional[bool] = None) -> bool:
+        return self.shard_for(user_id).save_user_query(user_id, intent, entities, response_helpful)
+    
+    def save_usage_stat(self, user_id: str, action_type: str, success: bool = True) -> bool:
+        return self.shard_for(user_id).save_usage_stat(user_id, action_type, success)
+    
+    def write_batch(self, batch: Dict[str, List[tuple]]) -> int:
+        """Reparte el lote por shard (user_id es la primera columna de cada fila)"""
+        per_shard: Dict[int, Dict[str, List[tuple]]] = {}
+        for table, rows in batch.items():
+            for row in rows:
+                index = shard_index(row[0], len(self.shards))
+                per_shard.setdefault(index, {}).setdefault(table, []).append(row)
+        return sum(self.shards[index].write_batch(shard_batch)
+                   for index, shard_batch in per_shard.items())
+    
+    def get_user_quiz_history(self, user_id: str, limit: int = 10) -> List[Dict]:
+        return self.shard_for(user_id).get_user_quiz_history(user_id, limit)
+    
+    def get_leaderboard(self, limit: int = 10) -> List[Dict]:
+        """Une el top `limit` de cada shard (cada usuario vive en un solo shard)"""
+        entries = []
+        for shard in self.shards:
+            entries.extend(shard.get_leaderboard(limit))
+        entries.sort(key=LeaderboardCache._rank_key)
+        return entries[:limit]
+    
+    def get_usage_stats(self, days: int = 30) -> Dict[str, Any]:
+        try:
+            return _usage_summary([shard.usage_totals(days) for shard in self.shards], days)
+        except Exception as e:
+            _report_error("get_usage_stats", "Error obteniendo estadísticas", e)
             return {}
+    
+    def compact(self, older_than_days: int = COMPACT_AFTER_DAYS,
+                archive_path: Optional[str] = None) -> Dict[str, int]:
+        """Compacta cada shard; el archivo de cada uno va a su propio archivo de archivo"""
+        compacted: Dict[str, int] = {}
+        for i, shard in enumerate(self.shards):
+            shard_archive = shard_path(archive_path, i) if archive_path else None
+            for base, count in shard.compact(older_than_days, shard_archive).items():
+                compacted[base] = compacted.get(base, 0) + count
+        return compacted
+    
+    def archive_partition(self, month: str, archive_path: Optional[str] = None) -> List[str]:
+        removed = []
+        for i, shard in enumerate(self.shards):
+            shard_archive = shard_path(archive_path, i) if archive_path else None
+            removed.extend(shard.archive_partition(month, shard_archive))
+        return removed
+
+class ShardedMetricsWriter:
+    """Un MetricsWriter (cola e hilo propios) por shard"""
+    
+    def __init__(self, manager: ShardedMetricsManager, **kwargs):
+        self.manager = manager
+        self.writers = [MetricsWriter(shard, **kwargs) for shard in manager.shards]
+    
+    @property
+    def dropped(self) -> int:
+        return sum(writer.dropped for writer in self.writers)
+    
+    @property
+    def written(self) -> int:
+        return sum(writer.written for writer in self.writers)
+    
+    def submit(self, table: str, row: tuple) -> bool:
+        return self.writers[shard_index(row[0], len(self.writers))].submit(table, row)
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        return all([writer.flush(timeout) for writer in self.writers])
+    
+    def close(self, timeout: Optional[float] = 5.0):
+        for writer in self.writers:
+            writer.close(timeout)
 
-# Instancia global del manager
-metrics_manager = MetricsManager()
+def create_metrics(db_path: Optional[str] = None, shards: int = SHARDS) -> tuple:
+    """Crea el manager y el escritor, particionados si `shards` > 1"""
+    if shards > 1:
+        manager = ShardedMetricsManager(db_path, shards)
+        return manager, ShardedMetricsWriter(manager)
+    manager = MetricsManager(db_path)
+    return manager, MetricsWriter(manager)
+
+# Instancia global del manager y del escritor en segundo plano
+metrics_manager, metrics_writer = create_metrics()
+atexit.register(metrics_manager.close)
+
+# El escritor se cierra antes que el manager: atexit es LIFO
+atexit.register(metrics_writer.close)
 
 # Funciones helper para uso en actions.py
 def save_quiz_result(user_id: str, score: int, total_questions: int, 
                     quiz_data: Dict[str, Any]) -> bool:
     """Función helper para guardar resultados del quiz"""
-    return metrics_manager.save_quiz_result(user_id, score, total_questions, quiz_data)
+    if not METRICS_ASYNC:
+        return metrics_manager.save_quiz_result(user_id, score, total_questions, quiz_data)
+    try:
+        # Mismo cálculo que MetricsManager.save_quiz_result: un error aquí devuelve False, no llega a la acción
+        percentage = (score / total_questions) * 100
+        row = (user_id, score, total_questions, percentage,
+               encode_quiz_payload(quiz_data), _utc_timestamp())
+    except Exception as e:
+        _report_error("save_quiz_result", "Error guardando resultado del quiz", e)
+        return False
+    return metrics_writer.submit("quiz_results", row)
 
 def save_user_query(user_id: str, intent: str, entities: Optional[str] = None, 
                    response_helpful: Optional[bool] = None) -> bool:
     """Función helper para guardar consultas del usuario"""
-    return metrics_manager.save_user_query(user_id, intent, entities, response_helpful)
+    if not METRICS_ASYNC:
+        return metrics_manager.save_user_query(user_id, intent, entities, response_helpful)
+    return metrics_writer.submit("user_queries", (
+        user_id, intent, entities, response_helpful, _utc_timestamp()
+    ))
 
 def save_usage_stat(user_id: str, action_type: str, success: bool = True) -> bool:
     """Función helper para guardar estadísticas de uso"""
-    return metrics_manager.save_usage_stat(user_id, action_type, success)
+    if not METRICS_ASYNC:
+        return metrics_manager.save_usage_stat(user_id, action_type, success)
+    return metrics_writer.submit("usage_stats", (
+        user_id, action_type, success, _utc_timestamp()
+    ))
+
+def flush_metrics(timeout: Optional[float] = None) -> bool:
+    """Función helper para esperar a que se escriban las métricas encoladas"""
+    return metrics_writer.flush(timeout)
 
 def get_user_quiz_history(user_id: str, limit: int = 10) -> List[Dict]:
     """Función helper para obtener historial del usuario"""
@@ -368,4 +1300,30 @@ def get_leaderboard(limit: int = 10) -> List[Dict]:
 
 def get_usage_stats(days: int = 30) -> Dict[str, Any]:
     """Función helper para obtener estadísticas de uso"""
-    return metrics_manager.get_usage_stats(days) 
\ No newline at end of file
+    return metrics_manager.get_usage_stats(days)
+
+def compact_metrics(older_than_days: int = COMPACT_AFTER_DAYS,
+                    archive_path: Optional[str] = None) -> Dict[str, int]:
+    """Función helper para compactar métricas antiguas"""
+    return metrics_manager.compact(older_than_days, archive_path)
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Mantenimiento de la base de métricas")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser("compact", help="Compacta eventos antiguos en agregados diarios")
+    compact_parser.add_argument("--older-than-days", type=int, default=COMPACT_AFTER_DAYS)
+    compact_parser.add_argument("--archive", default=None, help="Archivo SQLite donde archivar las filas crudas")
+    subparsers.add_parser("backfill-streaks", help="Recalcula las rachas diarias desde el historial de XP")
+    args = parser.parse_args()
+    
+    if args.command == "compact":
+        from actions.engine.db import migrate, compact_xp_events
+        migrate()
+        compact_metrics(args.older_than_days, args.archive)
+        compact_xp_events(args.older_than_days)
+    elif args.command == "backfill-streaks":
+        from actions.engine.db import migrate, backfill_streaks
+        migrate()
+        print(f"Rachas recalculadas para {backfill_streaks()} usuarios")
@@ -0,0 +1,203 @@
+"""
+Capa de almacenamiento SQLite compartida
+Una conexión persistente, pragmas y migraciones por archivo de base de datos,
+usada tanto por sqlite_metrics como por actions/engine/db.py
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import instrumentation
+
+# Archivo por defecto de métricas y gamificación
+DB_PATH = os.getenv("MAIKA_DB", "metrics.db")
+
+# Modo particionado por usuario: número de archivos (1 = un solo archivo)
+SHARDS = int(os.getenv("MAIKA_SHARDS", "1"))
+
+# Tiempo máximo (ms) que una escritura espera a que se libere el lock de SQLite
+BUSY_TIMEOUT_MS = int(os.getenv("MAIKA_DB_BUSY_TIMEOUT_MS", "5000"))
+
+
+def _ensure_parent_dir(path: str) -> None:
+    parent = os.path.dirname(os.path.abspath(path))
+    if parent and not os.path.exists(parent):
+        os.makedirs(parent, exist_ok=True)
+
+
+class Storage:
+    """
+    Dueño único de un archivo SQLite
+
+    Mantiene una conexión persistente en modo WAL compartida entre hilos
+    (serializada con un RLock), aplica los pragmas y registra qué esquemas
+    y migraciones de datos ya se aplicaron.
+    """
+
+    def __init__(self, db_path: str, busy_timeout_ms: int = BUSY_TIMEOUT_MS):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.lock = threading.RLock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._schemas: set = set()
+        self._migrations: set = set()
+        self._depth = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """Abre la conexión persistente configurada para WAL"""
+        _ensure_parent_dir(self.db_path)
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        # En bases nuevas, habilitar vacuum incremental antes de crear tablas
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # WAL: los lectores no bloquean a los escritores y viceversa
+        cursor.execute("PRAGMA journal_mode = WAL")
+        cursor.execute("PRAGMA synchronous = NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Presta la conexión persistente
+
+        Si el bloque falla, la transacción abierta se revierte. El commit
+        queda a cargo de quien escribe (ver transaction()). El préstamo más
+        externo (espera del lock incluida) se mide como tiempo en SQLite.
+        """
+        start = time.perf_counter()
+        outermost = False
+        try:
+            with self.lock:
+                outermost = self._depth == 0
+                self._depth += 1
+                try:
+                    if self._conn is None:
+                        self._conn = self._connect()
+                    try:
+                        yield self._conn
+                    except Exception:
+                        self._conn.rollback()
+                        raise
+                finally:
+                    self._depth -= 1
+        finally:
+            if outermost:
+                instrumentation.record("db", time.perf_counter() - start)
+
+    @contextmanager
+    def transaction(self):
+        """Como connection(), pero confirma la transacción al salir sin errores"""
+        with self.connection() as conn:
+            yield conn
+            conn.commit()
+
+    def ensure_schema(self, name: str, create: Callable[[sqlite3.Cursor], None]) -> None:
+        """
+        Aplica una función de esquema una sola vez por proceso
+
+        Las funciones de esquema deben ser idempotentes (CREATE ... IF NOT
+        EXISTS); tras la primera llamada esto cuesta una búsqueda en un set.
+        """
+        if name in self._schemas:
+            return
+        with self.transaction() as conn:
+            if name not in self._schemas:
+                create(conn.cursor())
+                self._schemas.add(name)
+
+    def run_once(self, name: str, migrate: Callable[[sqlite3.Cursor], None]) -> None:
+        """
+        Ejecuta una migración de datos una sola vez por archivo
+
+        Las ya aplicadas se recuerdan en memoria: tras la primera llamada del
+        proceso esto cuesta una búsqueda en un set, como ensure_schema().
+        """
+        if name in self._migrations:
+            return
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    name TEXT PRIMARY KEY,
+                    applied_at TEXT NOT NULL
+                )
+            """)
+            cursor.execute("SELECT 1 FROM schema_migrations WHERE name = ?", (name,))
+            if cursor.fetchone() is None:
+                migrate(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (name, applied_at) VALUES (?, ?)",
+                    (name, datetime.utcnow().isoformat())
+                )
+        self._migrations.add(name)
+
+    def close(self):
+        """Cierra la conexión persistente (se reabre en el próximo uso)"""
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._schemas.clear()
+            self._migrations.clear()
+
+
+_storages: Dict[str, Storage] = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage(db_path: Optional[str] = None) -> Storage:
+    """Devuelve el Storage compartido de un archivo (por defecto MAIKA_DB)"""
+    key = os.path.abspath(db_path or DB_PATH)
+    storage = _storages.get(key)
+    if storage is None:
+        with _storages_lock:
+            storage = _storages.setdefault(key, Storage(db_path or DB_PATH))
+    return storage
+
+
+def close_all() -> None:
+    """Cierra las conexiones de todos los archivos abiertos"""
+    with _storages_lock:
+        for storage in _storages.values():
+            storage.close()
+
+
+def shard_index(user_id: str, shards: int = SHARDS) -> int:
+    """Shard estable de un usuario (crc32, igual en todos los procesos)"""
+    return zlib.crc32(user_id.encode("utf-8")) % shards
+
+
+def shard_path(db_path: str, index: int) -> str:
+    """'metrics.db' -> 'metrics.shard3.db'"""
+    root, ext = os.path.splitext(db_path)
+    return f"{root}.shard{index}{ext or '.db'}"
+
+
+def all_storages(db_path: Optional[str] = None, shards: int = SHARDS) -> List[Storage]:
+    """Storages de todos los shards (o el único archivo si no hay sharding)"""
+    db_path = db_path or DB_PATH
+    if shards <= 1:
+        return [get_storage(db_path)]
+    return [get_storage(shard_path(db_path, i)) for i in range(shards)]
+
+
+def get_user_storage(user_id: str, db_path: Optional[str] = None, shards: int = SHARDS) -> Storage:
+    """Storage del shard que guarda las tablas por usuario de `user_id`"""
+    db_path = db_path or DB_PATH
+    if shards <= 1:
+        return get_storage(db_path)
+    return get_storage(shard_path(db_path, shard_index(user_id, shards)))
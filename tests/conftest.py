@@ -0,0 +1,19 @@
+from pathlib import Path
+import sys
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture
+def engine_db(tmp_path, monkeypatch):
+    """Point the gamification DB at an isolated file and create its schema."""
+    from actions.engine import db
+
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "engine.db"))
+    monkeypatch.setattr(db, "_rank_caches", {})
+    db.migrate()
+    return db
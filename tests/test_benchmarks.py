@@ -0,0 +1,65 @@
+from pathlib import Path
+import sys
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from benchmarks.harness import (
+    FakeDispatcher, FakeTracker, compare, measure, percentile, summarize, synthetic_corpus,
+)
+
+
+def test_summary_percentiles_and_baseline_comparison():
+    samples = [i / 1000 for i in range(1, 101)]
+    stats = summarize(samples)
+    assert stats["iterations"] == 100
+    assert stats["p50_ms"] == pytest.approx(50)
+    assert stats["p95_ms"] == pytest.approx(95)
+    assert stats["p99_ms"] == pytest.approx(99)
+    assert stats["ops_per_sec"] == pytest.approx(100 / sum(samples), rel=1e-3)
+    assert percentile([], 0.5) == 0.0
+
+    report = compare({"a": {"p95_ms": 12.0}, "b": {"p95_ms": 9.0}, "new": {"p95_ms": 1.0}},
+                     {"a": {"p95_ms": 10.0}, "b": {"p95_ms": 10.0}})
+    assert report["a"]["regression"] is True
+    assert report["b"]["regression"] is False
+    assert "new" not in report
+
+    prepared = []
+    measure(lambda arg: prepared.append(arg), 3, warmup=1, prepare=lambda i: i * 10)
+    assert prepared == [0, 10, 20, 30]
+
+
+def test_synthetic_corpus_and_fakes():
+    corpus = synthetic_corpus(1000, seed=1)
+    assert len(corpus["verses"]) == 1000
+    keys = {(v["book"], v["chapter"], v["verse"]) for v in corpus["verses"]}
+    assert len(keys) == 1000
+    assert synthetic_corpus(1000, seed=1) == corpus
+
+    tracker = FakeTracker("u1", "Juan 3:16", "preguntar_versiculo",
+                          [{"entity": "libro_biblico", "value": "Juan"}], {"quiz_data": None})
+    assert tracker.get_intent_of_latest_message() == "preguntar_versiculo"
+    assert list(tracker.get_latest_entity_values("libro_biblico")) == ["Juan"]
+    assert tracker.get_slot("quiz_data") is None
+
+    dispatcher = FakeDispatcher()
+    dispatcher.utter_message(text="hola")
+    assert dispatcher.messages == [{"text": "hola"}]
+
+
+def test_seeded_users_have_leaderboard_and_streak_rows(tmp_path, monkeypatch):
+    import sqlite_metrics
+    from actions.engine import db
+    from benchmarks.harness import seed_databases
+
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "bench.db"))
+    monkeypatch.setattr(sqlite_metrics, "metrics_manager", sqlite_metrics.MetricsManager(db.DB_PATH))
+    seed_databases(20, quizzes_per_user=1, xp_per_user=2, batch_size=7)
+
+    with db.get_connection(True) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM xp_leaderboard WHERE period = 'all' AND xp = 20").fetchone()[0] == 20
+        assert conn.execute("SELECT COUNT(*) FROM user_streaks").fetchone()[0] == 20
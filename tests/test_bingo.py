@@ -0,0 +1,87 @@
+from pathlib import Path
+import sys
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from actions.engine import bingo
+
+
+def test_win_masks_cover_rows_columns_and_diagonals():
+    masks = bingo.win_masks(3)
+    assert len(masks) == 8
+    assert 0b111 in masks and 0b001001001 in masks and 0b100010001 in masks and 0b001010100 in masks
+    assert bingo.has_bingo(0b111000000)
+    assert not bingo.has_bingo(0b011010001)
+
+
+def test_boards_are_deterministic_per_seed_and_player():
+    players = [f"kid-{i}" for i in range(120)]
+    boards = bingo.generate_boards(players, seed=42)
+    assert boards == bingo.generate_boards(list(reversed(players)), seed=42)
+    assert boards["kid-0"] != bingo.generate_boards(["kid-0"], seed=43)["kid-0"]
+    assert all(sorted(v for row in b for v in row) == sorted(bingo.bingo_values()) for b in boards.values())
+
+
+def test_group_game_detects_winners_and_rewards_them_once(engine_db):
+    players = [f"kid-{i}" for i in range(120)]
+    game = bingo.BingoGame("game-1", "teacher", players, seed=7)
+    first_row = game.boards["kid-0"][0]
+
+    winners = []
+    for value in first_row:
+        winners += game.call(value)
+    assert "kid-0" in winners
+    assert winners == game.winners()
+    assert all(first_row[0] in [v for row in game.boards[p] for v in row] for p in players)
+
+    assert game.reward_winners() == winners
+    assert game.reward_winners() == []
+    assert engine_db.get_user_xp("kid-0") == bingo.BINGO_XP
+
+    game.save()
+    restored = bingo.BingoGame.load("game-1", "teacher")
+    assert restored.marks == game.marks
+    assert restored.boards == game.boards
+    assert restored.rewarded == winners
+    assert bingo.BingoGame.load("missing", "teacher") is None
+
+
+def test_a_winner_is_rewarded_once_across_copies_of_the_game(engine_db):
+    players = ["kid-0", "kid-1"]
+    game = bingo.BingoGame("game-2", "teacher", players, seed=3)
+    # Another process loaded the same game before this one saved its rewards
+    other = bingo.BingoGame("game-2", "teacher", players, seed=3)
+    for value in game.boards["kid-0"][0]:
+        game.call(value)
+        other.call(value)
+
+    assert "kid-0" in game.reward_winners()
+    assert other.reward_winners() == []
+    assert engine_db.get_user_xp("kid-0") == bingo.BINGO_XP
+    assert other.rewarded == game.rewarded
+
+
+def test_calls_and_marks_of_a_stored_game(engine_db):
+    game = bingo.start_game("kid-0")
+    assert bingo.call_next("missing", "kid-0") is None
+
+    awarded = []
+    for _ in range(len(bingo.bingo_values())):
+        _, value, new = bingo.call_next(game.game_id, "kid-0")
+        awarded += new
+        if value is None:
+            break
+    restored = bingo.BingoGame.load(game.game_id, "kid-0")
+    assert awarded == ["kid-0"] and restored.rewarded == ["kid-0"]
+    assert sorted(restored.called) == sorted(set(v for row in game.boards["kid-0"] for v in row))
+    assert "✔" in restored.render("kid-0")
+    assert engine_db.get_user_xp("kid-0") == bingo.BINGO_XP
+
+    fresh = bingo.start_game("kid-1")
+    assert bingo.mark_cell(fresh.game_id, "kid-1", "kid-1", 0, 0)[1] is False
+    assert bingo.mark_cell(fresh.game_id, "kid-1", "kid-1", 5, 0)[1] is False
+    _, value, _ = bingo.call_next(fresh.game_id, "kid-1")
+    row, col = next((r, c) for r, cells in enumerate(fresh.boards["kid-1"]) for c, v in enumerate(cells) if v == value)
+    assert bingo.mark_cell(fresh.game_id, "kid-1", "kid-1", row, col)[1] is True
@@ -0,0 +1,151 @@
+from pathlib import Path
+import sys
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from actions.engine import classroom
+
+
+def test_round_scores_the_class_and_writes_everything_once(engine_db):
+    from sqlite_metrics import MetricsManager, decode_quiz_payload
+
+    manager = MetricsManager(engine_db.DB_PATH)
+    members = [f"kid-{i}" for i in range(30)]
+    round_ = classroom.start_round("teacher", members, 3)
+    assert len(round_.questions) == 3
+    correct = [q["correct"] for q in round_.questions]
+
+    # Alumnos que responden pregunta a pregunta y otros con el vector completo
+    for index, choice in enumerate(correct):
+        round_.answer("kid-0", index, choice)
+    round_.answer("kid-1", 2, correct[2])
+    round_.submit("kid-2", [correct[0], (correct[1] + 1) % 4])
+    with pytest.raises(ValueError):
+        round_.answer("intruso", 0, 1)
+
+    restored = classroom.ClassroomRound.load(round_.session_id, "teacher")
+    assert [q["id"] for q in restored.questions] == [q["id"] for q in round_.questions]
+    assert restored.answers()["kid-1"] == [classroom.UNANSWERED, classroom.UNANSWERED, correct[2]]
+
+    scores = restored.close(manager)
+    assert scores["kid-0"] == 3 and scores["kid-1"] == 1 and scores["kid-2"] == 1 and scores["kid-3"] == 0
+    assert restored.close(manager) is None
+    assert classroom.ClassroomRound.load(round_.session_id, "teacher").closed
+
+    assert engine_db.get_user_xp("kid-0") == 3 * classroom.TRIVIA_XP
+    assert engine_db.get_user_xp("kid-3") == 0
+    history = manager.get_user_quiz_history("kid-2", 5)
+    assert len(history) == 1 and history[0]["score"] == 1
+    with manager.get_connection() as conn:
+        payload = conn.execute(
+            f"SELECT quiz_data FROM {manager.partitions('quiz_results')[0]} WHERE user_id = ?", ("kid-2",)
+        ).fetchone()[0]
+    assert decode_quiz_payload(payload)["a"] == [correct[0], (correct[1] + 1) % 4, classroom.UNANSWERED]
+    assert len(manager.get_leaderboard(50)) == 30
+
+
+def test_next_round_uses_new_questions(engine_db):
+    first = classroom.start_round("teacher", ["kid-0"], 2)
+    second = classroom.start_round("teacher", ["kid-0"], 2)
+    assert {q["id"] for q in first.questions}.isdisjoint(q["id"] for q in second.questions)
+
+
+def test_retrying_a_failed_close_finishes_the_awards_once(engine_db, monkeypatch):
+    from sqlite_metrics import MetricsManager
+
+    manager = MetricsManager(engine_db.DB_PATH)
+    round_ = classroom.start_round("teacher", ["kid-0"], 2)
+    round_.submit("kid-0", [q["correct"] for q in round_.questions])
+
+    def broken(batch):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(manager, "write_batch", broken)
+    with pytest.raises(RuntimeError):
+        round_.close(manager)
+    # Closed for answers, but the awards are still pending
+    stale = classroom.ClassroomRound.load(round_.session_id, "teacher")
+    assert stale.closed
+    assert engine_db.get_user_xp("kid-0") == 0
+
+    monkeypatch.delattr(manager, "write_batch")
+    assert stale.close(manager) == {"kid-0": 2}
+    assert round_.close(manager) is None
+    assert engine_db.get_user_xp("kid-0") == 2 * classroom.TRIVIA_XP
+    assert len(manager.get_user_quiz_history("kid-0")) == 1
+
+
+def test_partial_failure_across_shards_is_completed_on_retry(engine_db, monkeypatch, tmp_path):
+    from sqlite_metrics import MetricsManager
+    from sqlite_storage import shard_index
+
+    monkeypatch.setattr(engine_db, "SHARDS", 2)
+    engine_db.migrate()
+    manager = MetricsManager(str(tmp_path / "metrics.db"))
+    members = [f"kid-{i}" for i in range(8)]
+    failing = next(m for m in members if shard_index(m, 2) != shard_index("teacher", 2))
+    round_ = classroom.start_round("teacher", members, 2)
+    for member in members:
+        round_.submit(member, [q["correct"] for q in round_.questions])
+
+    insert_xp = engine_db._insert_xp
+
+    def fail_once(conn, events, now):
+        if any(event[0] == failing for event in events):
+            monkeypatch.setattr(engine_db, "_insert_xp", insert_xp)
+            raise RuntimeError("disk full")
+        return insert_xp(conn, events, now)
+
+    monkeypatch.setattr(engine_db, "_insert_xp", fail_once)
+    with pytest.raises(RuntimeError):
+        round_.close(manager)
+    assert engine_db.get_user_xp(failing) == 0
+
+    assert round_.close(manager) == {m: 2 for m in members}
+    assert {engine_db.get_user_xp(m) for m in members} == {2 * classroom.TRIVIA_XP}
+    assert all(len(manager.get_user_quiz_history(m)) == 1 for m in members)
+
+
+def test_a_round_closed_elsewhere_rejects_answers(engine_db):
+    from sqlite_metrics import MetricsManager
+
+    round_ = classroom.start_round("teacher", ["kid-0"], 2)
+    stale = classroom.ClassroomRound.load(round_.session_id, "teacher")
+    round_.close(MetricsManager(engine_db.DB_PATH))
+
+    assert not stale.closed
+    with pytest.raises(ValueError):
+        stale.answer("kid-0", 0, 1)
+    with pytest.raises(ValueError):
+        classroom.ClassroomRound(round_.session_id, "teacher", ["kid-0"], round_.questions).submit("kid-0", [1, 1])
+    assert engine_db.get_classroom_answers(round_.session_id, "teacher") == {}
+
+
+def test_closed_round_rejects_answers_and_keeps_retired_questions_aligned(engine_db, monkeypatch):
+    import sqlite_metrics
+
+    manager = sqlite_metrics.MetricsManager(engine_db.DB_PATH)
+    monkeypatch.setattr(sqlite_metrics, "metrics_manager", manager)
+    round_ = classroom.start_round("teacher", ["kid-0"], 3)
+    correct = [q["correct"] for q in round_.questions]
+    round_.submit("kid-0", correct)
+
+    # The first question disappears from the bank: the stored answers still line up
+    retired = round_.questions[0]["id"]
+    bank = classroom.trivia_bank()
+    monkeypatch.setattr(bank, "_by_id", {k: v for k, v in bank._by_id.items() if k != retired})
+    restored = classroom.ClassroomRound.load(round_.session_id, "teacher")
+    assert [q["id"] for q in restored.questions] == [q["id"] for q in round_.questions]
+    assert restored.questions[0]["correct"] is None
+
+    # Without an explicit manager the results go to the default one
+    assert restored.close() == {"kid-0": 2}
+    assert manager.get_user_quiz_history("kid-0")[0]["score"] == 2
+    with pytest.raises(ValueError):
+        restored.answer("kid-0", 0, 1)
+    with pytest.raises(ValueError):
+        classroom.ClassroomRound.load(round_.session_id, "teacher").submit("kid-0", correct)
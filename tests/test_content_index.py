@@ -0,0 +1,51 @@
+from pathlib import Path
+import json
+import random
+import re
+import sys
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from actions.engine.content import ContentIndex, normalize
+
+
+def _reference_search(verses, message, limit):
+    """The original dict-of-lists topic search, kept as an oracle."""
+    topic_index = {}
+    for verse in verses:
+        for word in re.findall(r'\b\w+\b', verse["text"].lower()):
+            if len(word) > 2:
+                topic_index.setdefault(word, []).append(verse)
+    relevant = []
+    for keyword in re.findall(r'\b\w+\b', message):
+        for word, matches in topic_index.items():
+            if normalize(keyword) in normalize(word):
+                relevant.extend(matches)
+    unique, seen = [], set()
+    for verse in relevant:
+        key = (verse["book"], verse["chapter"], verse["verse"])
+        if key not in seen:
+            unique.append(verse)
+            seen.add(key)
+    return unique[:limit]
+
+
+def test_content_index_matches_original_lookups_and_topic_search():
+    with open(ROOT / "data" / "bible_content.json", encoding="utf-8") as f:
+        verses = json.load(f)["verses"]
+    index = ContentIndex(verses)
+
+    assert len(index) == len(verses)
+    assert [index.verse(i) for i in range(len(verses))] == verses
+    first = verses[0]
+    assert index.lookup(first["book"].lower(), first["chapter"], first["verse"]) == first["text"]
+    assert index.lookup("juan", "99", "99") is None
+
+    for message in ["amor", "fe y esperanza", "dios", "paz del señor", "xyz", "creó"]:
+        assert index.search(re.findall(r'\b\w+\b', message), 5) == _reference_search(verses, message, 5)
+
+    sample = index.sample(3, random.Random(1))
+    assert len(sample) == 3 and all(verse in verses for verse in sample)
+    assert ContentIndex([]).sample(3) == []
@@ -0,0 +1,76 @@
+from pathlib import Path
+import sys
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+def test_compact_xp_events_keeps_user_totals(engine_db):
+    engine_db.add_xp("user-1", "trivia_correct", 10)
+    with engine_db.get_connection() as conn:
+        conn.execute(
+            "INSERT INTO xp_events(user_id, kind, amount, created_at) VALUES (?,?,?,?)",
+            ("user-1", "srs_review", 5, "2020-01-01T10:00:00"),
+        )
+
+    assert engine_db.compact_xp_events(older_than_days=30) == 1
+    assert engine_db.get_user_xp("user-1") == 15
+
+    with engine_db.get_connection(True) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM xp_events").fetchone()[0] == 1
+
+
+def test_engine_and_metrics_share_one_storage(engine_db):
+    from sqlite_metrics import MetricsManager
+
+    manager = MetricsManager(engine_db.DB_PATH)
+    with manager.get_connection() as metrics_conn, engine_db.get_connection(True) as engine_conn:
+        assert metrics_conn is engine_conn
+
+    engine_db.add_xp("user-1", "bingo_complete", 30)
+    assert manager.save_usage_stat("user-1", "bingo", True)
+    assert engine_db.get_user_xp("user-1") == 30
+
+
+def test_sharded_engine_routes_users_to_their_file(engine_db, monkeypatch):
+    import sqlite_storage
+
+    monkeypatch.setattr(engine_db, "SHARDS", 2)
+    engine_db.migrate()
+    users = [f"user-{i}" for i in range(6)]
+    for user in users:
+        engine_db.add_xp(user, "trivia_correct", 10)
+        assert engine_db.get_user_xp(user) == 10
+
+    for i, storage in enumerate(sqlite_storage.all_storages(engine_db.DB_PATH, 2)):
+        expected = {user for user in users if sqlite_storage.shard_index(user, 2) == i}
+        with storage.connection() as conn:
+            stored = {row[0] for row in conn.execute("SELECT user_id FROM xp_events")}
+        assert stored == expected
+
+
+def test_migrate_does_not_touch_the_database_after_the_first_call(engine_db):
+    statements = []
+    with engine_db.get_connection(True) as conn:
+        conn.set_trace_callback(statements.append)
+    try:
+        engine_db.migrate()
+    finally:
+        with engine_db.get_connection(True) as conn:
+            conn.set_trace_callback(None)
+    assert statements == []
+
+
+def test_get_user_xp_reads_only_the_user_rows(engine_db):
+    with engine_db.get_connection(True) as conn:
+        plan = " ".join(row[3] for row in conn.execute(
+            """
+            EXPLAIN QUERY PLAN
+            SELECT (SELECT COALESCE(SUM(amount),0) FROM xp_events WHERE user_id = ?)
+                 + (SELECT COALESCE(SUM(amount),0) FROM xp_daily WHERE user_id = ?)
+            """,
+            ("user-1", "user-1"),
+        ))
+    assert "SCAN xp_" not in plan
+    assert "idx_xp_events_user" in plan and "idx_xp_daily_user" in plan
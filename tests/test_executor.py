@@ -0,0 +1,51 @@
+from pathlib import Path
+import asyncio
+import sys
+import threading
+import time
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from actions.engine import executor
+
+
+def test_run_blocking_keeps_event_loop_responsive():
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        thread_name = await executor.run_blocking(
+            lambda delay: time.sleep(delay) or threading.current_thread().name, 0.2
+        )
+        task.cancel()
+        return thread_name, ticks
+
+    thread_name, ticks = asyncio.run(scenario())
+    assert thread_name.startswith("maika-io")
+    assert ticks >= 5
+    assert executor.get_executor()._max_workers == executor.IO_WORKERS
+
+
+def test_shutdown_worker_flushes_queued_metrics(tmp_path, monkeypatch):
+    import sqlite_metrics
+    from actions import prefork
+
+    manager = sqlite_metrics.MetricsManager(str(tmp_path / "metrics.db"))
+    writer = sqlite_metrics.MetricsWriter(manager, flush_interval=60)
+    monkeypatch.setattr(sqlite_metrics, "metrics_writer", writer)
+    assert writer.submit("usage_stats", ("user-1", "quiz", True, sqlite_metrics._utc_timestamp()))
+
+    # os._exit() skips atexit: the worker must drain the queue itself
+    prefork.shutdown_worker()
+    assert writer.written == 1
+    with manager.get_connection() as conn:
+        assert sum(conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+                   for t in manager.partitions("usage_stats")) == 1
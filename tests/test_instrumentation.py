@@ -0,0 +1,94 @@
+from pathlib import Path
+import asyncio
+import sys
+import urllib.request
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import instrumentation
+from actions.engine.executor import run_blocking
+from sqlite_storage import Storage
+
+
+@pytest.fixture
+def registry():
+    instrumentation.REGISTRY.reset()
+    yield instrumentation.REGISTRY
+    instrumentation.REGISTRY.reset()
+
+
+def test_instrumented_action_records_latency_db_time_and_errors(tmp_path, registry):
+    storage = Storage(str(tmp_path / "metrics.db"))
+
+    def touch_db():
+        with storage.transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS t (x INTEGER)")
+            with storage.connection() as nested:
+                nested.execute("INSERT INTO t VALUES (1)")
+
+    @instrumentation.instrumented
+    class FakeAction:
+        def name(self):
+            return "action_fake"
+
+        async def run(self, dispatcher, tracker, domain):
+            await run_blocking(touch_db)
+            if tracker == "boom":
+                raise RuntimeError("boom")
+            return []
+
+    assert asyncio.run(FakeAction().run(None, None, {})) == []
+    with pytest.raises(RuntimeError):
+        asyncio.run(FakeAction().run(None, "boom", {}))
+    storage.close()
+
+    labels = {"action": "action_fake"}
+    assert registry.histogram("maika_action_seconds", labels).count == 2
+    # Nested connection() calls count once per outer borrow
+    assert registry.histogram("maika_action_db_seconds", labels).count == 2
+    assert registry.counter_value("maika_action_errors_total", labels) == 1
+
+    text = registry.render()
+    assert 'maika_action_seconds_count{action="action_fake"} 2' in text
+    assert 'maika_action_errors_total{action="action_fake"} 1' in text
+
+
+def test_metrics_endpoint_serves_prometheus_text(tmp_path, registry):
+    from sqlite_metrics import MetricsManager
+
+    manager = MetricsManager(str(tmp_path / "metrics.db"))
+    manager.get_leaderboard()
+    manager.get_leaderboard()
+    manager.close()
+
+    server = instrumentation.start_metrics_server(0)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            body = response.read().decode("utf-8")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert 'maika_cache_requests_total{cache="leaderboard",result="hit"} 1' in body
+    assert 'maika_cache_requests_total{cache="leaderboard",result="miss"} 1' in body
+    assert "# TYPE maika_db_seconds histogram" in body
+
+
+def test_prefork_parent_defers_exporters_to_the_workers(monkeypatch, registry):
+    started = []
+    monkeypatch.setattr(instrumentation, "_started", False)
+    monkeypatch.setattr(instrumentation, "METRICS_PORT", 9400)
+    monkeypatch.setattr(instrumentation, "METRICS_LOG_INTERVAL", 0)
+    monkeypatch.setattr(instrumentation, "start_metrics_server", started.append)
+
+    instrumentation.defer_exporters()
+    instrumentation.start_exporters(9400, 0)
+    assert started == []
+
+    instrumentation.after_fork(2)
+    assert started == [9403]
@@ -0,0 +1,69 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import json
+import sys
+import threading
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from benchmarks.loadgen import LoadGenerator, load_examples, load_stories, parse_example
+
+
+def test_stories_and_examples_are_parsed_into_webhook_steps():
+    text, entities = parse_example("busco [Génesis 1:1](libro_biblico:Génesis capitulo:1 versiculo:1)")
+    assert text == "busco Génesis 1:1"
+    assert entities == [
+        {"entity": "libro_biblico", "value": "Génesis"},
+        {"entity": "capitulo", "value": "1"},
+        {"entity": "versiculo", "value": "1"},
+    ]
+
+    stories = load_stories(str(ROOT / "data" / "stories.yml"))
+    quiz = next(s for s in stories if s["name"] == "flujo de quiz completo")
+    assert quiz["steps"][0] == ("start_quiz", "action_start_quiz")
+    assert all(action.startswith("action_") for s in stories for _, action in s["steps"])
+    assert "preguntar_versiculo" in load_examples(str(ROOT / "data" / "nlu.yml"))
+
+
+def test_load_generator_carries_slots_and_reports_errors():
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            seen.append((payload["next_action"], payload["tracker"]["slots"].get("step")))
+            if payload["next_action"] == "action_fail":
+                self.send_response(500)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            step = (payload["tracker"]["slots"].get("step") or 0) + 1
+            body = json.dumps({"events": [{"event": "slot", "name": "step", "value": step}],
+                               "responses": []}).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        conversations = [{"name": "c", "steps": [("a", "action_one"), ("b", "action_two"), ("c", "action_fail")]}]
+        generator = LoadGenerator(f"http://127.0.0.1:{server.server_address[1]}/webhook",
+                                  conversations, concurrency=2, seed=7)
+        report = generator.run(conversations=4)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert report["requests"] == 12
+    assert report["conversations"] == 4
+    assert report["errors"] == {"HTTP 500": 4}
+    assert report["error_rate"] == round(4 / 12, 4)
+    assert set(report["by_action"]) == {"action_one", "action_two"}
+    assert ("action_two", 1) in seen and ("action_fail", 2) in seen
@@ -0,0 +1,68 @@
+from pathlib import Path
+import json
+import sys
+import urllib.request
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import instrumentation
+import memory_budget
+from actions.engine.content import ContentIndex, LazyRecords, lean_content
+
+DATA = json.loads((ROOT / "data" / "bible_content.json").read_text(encoding="utf-8"))
+
+
+def test_deep_size_follows_containers_and_attributes():
+    small = memory_budget.deep_size(["x"])
+    assert memory_budget.deep_size(["x" * 10000]) > small + 9000
+    index = ContentIndex(DATA["verses"])
+    assert memory_budget.deep_size(index) > len(index._blob)
+
+    shared = "y" * 5000
+    seen = set()
+    first = memory_budget.deep_size([shared], seen)
+    assert memory_budget.deep_size([shared], seen) < first - 4000
+
+
+def test_lean_content_drops_raw_verses_and_loads_bodies_lazily():
+    lean = lean_content(DATA)
+    assert lean["verses"] == []
+    assert lean["church"] == DATA["church"]
+    assert isinstance(lean["stories"], LazyRecords)
+
+    for original, record in zip(DATA["stories"], lean["stories"]):
+        assert record["topic"] == original["topic"]
+        assert record["summary"] == original["summary"]
+        assert dict(record) == original
+    assert lean["concepts"][-1]["definition"] == DATA["concepts"][-1]["definition"]
+    assert len(lean["concepts"][2:5]) == 3
+
+    assert memory_budget.deep_size(lean) < memory_budget.deep_size(DATA) / 2
+
+
+def test_report_and_budget():
+    index = ContentIndex(DATA["verses"])
+    memory_budget.register("test_index", lambda: index)
+    try:
+        result = memory_budget.report(budget_mb=512)
+        assert result["structures"]["test_index"]["entries"] == len(DATA["verses"])
+        assert result["structures"]["test_index"]["bytes"] > 0
+        assert result["budget_bytes"] == 512 * 1024 * 1024
+
+        server = instrumentation.start_metrics_server(0)
+        try:
+            port = server.server_address[1]
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/memory") as response:
+                served = json.loads(response.read().decode("utf-8"))
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert "test_index" in served["structures"]
+    finally:
+        memory_budget.unregister("test_index")
+
+    assert memory_budget.over_budget([index, DATA], budget_mb=0) is None
+    assert memory_budget.over_budget([index, DATA], budget_mb=100) is None
+    assert memory_budget.over_budget([index, DATA], budget_mb=0.001) > 1024
@@ -1,4 +1,6 @@
+from datetime import datetime, timedelta
 from pathlib import Path
+import sqlite3
 import sys
 
 import pytest
@@ -7,7 +9,14 @@ ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from sqlite_metrics import MetricsManager
+from sqlite_metrics import (
+    MetricsManager,
+    MetricsWriter,
+    ShardedMetricsManager,
+    ShardedMetricsWriter,
+    decode_quiz_payload,
+)
+from sqlite_storage import Storage, shard_index, shard_path
 
 
 def create_manager(tmp_path: Path) -> MetricsManager:
@@ -16,6 +25,10 @@ def create_manager(tmp_path: Path) -> MetricsManager:
     return MetricsManager(str(db_path))
 
 
+def _days_ago(days: int) -> str:
+    return (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+
 def test_quiz_result_persists_and_updates_leaderboard(tmp_path):
     manager = create_manager(tmp_path)
 
@@ -43,3 +56,316 @@ def test_user_queries_and_usage_stats(tmp_path):
     assert stats["total_queries"] == 1
     assert stats["total_quizzes"] == 0
     assert stats["queries_by_intent"].get("preguntar_versiculo") == 1
+
+
+def test_compact_rolls_old_rows_into_daily_aggregates(tmp_path):
+    manager = create_manager(tmp_path)
+
+    old = _days_ago(100)
+    manager.write_batch({
+        "user_queries": [("user-old", "preguntar_versiculo", None, None, old)],
+        "quiz_results": [("user-old", 3, 3, 100.0, None, old)],
+    })
+    assert manager.save_user_query("user-new", "preguntar_versiculo")
+
+    compacted = manager.compact(older_than_days=90)
+    assert compacted["user_queries"] == 1
+    assert compacted["quiz_results"] == 1
+
+    with manager.get_connection() as conn:
+        remaining = sum(
+            conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in manager.partitions("user_queries")
+        )
+        assert remaining == 1
+
+    stats = manager.get_usage_stats(days=365)
+    assert stats["total_queries"] == 2
+    assert stats["queries_by_intent"]["preguntar_versiculo"] == 2
+    assert stats["total_quizzes"] == 1
+    assert stats["average_quiz_score"] == 100.0
+
+    recent = manager.get_usage_stats(days=7)
+    assert recent["total_queries"] == 1
+    assert recent["total_quizzes"] == 0
+
+
+def test_manager_reuses_wal_connection_until_closed(tmp_path):
+    manager = create_manager(tmp_path)
+
+    with manager.get_connection() as first:
+        assert first.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    with manager.get_connection() as second:
+        assert second is first
+
+    manager.close()
+    with manager.get_connection() as reopened:
+        assert reopened is not first
+    manager.close()
+
+
+def test_compact_can_archive_raw_rows(tmp_path):
+    manager = create_manager(tmp_path)
+    archive_path = tmp_path / "archive.db"
+
+    old = _days_ago(200)
+    manager.write_batch({"usage_stats": [("user-old", "verse_search", True, old)]})
+    partition = "usage_stats_" + old[:4] + old[5:7]
+
+    assert manager.compact(older_than_days=90, archive_path=str(archive_path))["usage_stats"] == 1
+    assert partition not in manager.partitions("usage_stats")
+    manager.close()
+
+    with sqlite3.connect(archive_path) as archive:
+        assert archive.execute(f"SELECT COUNT(*) FROM {partition}").fetchone()[0] == 1
+
+
+def test_metrics_writer_batches_and_counts_drops(tmp_path):
+    manager = create_manager(tmp_path)
+    writer = MetricsWriter(manager, max_queue=2, batch_size=10, flush_interval=0.01)
+
+    # With the writer thread held back the queue fills up and extra rows are dropped
+    writer._ensure_started = lambda: None
+    now = _days_ago(0)
+    assert writer.submit("user_queries", ("user-1", "saludar", None, None, now))
+    assert writer.submit("usage_stats", ("user-1", "verse_search", True, now))
+    assert not writer.submit("usage_stats", ("user-1", "verse_search", True, now))
+    assert writer.dropped == 1
+
+    del writer._ensure_started
+    assert writer.flush(timeout=5)
+    assert writer.written == 2
+    writer.close()
+
+    stats = manager.get_usage_stats(days=1)
+    assert stats["total_queries"] == 1
+
+
+def test_quiz_result_helpers_reject_empty_quizzes_in_both_modes(tmp_path, monkeypatch):
+    import sqlite_metrics
+
+    manager = create_manager(tmp_path)
+    writer = MetricsWriter(manager)
+    monkeypatch.setattr(sqlite_metrics, "metrics_manager", manager)
+    monkeypatch.setattr(sqlite_metrics, "metrics_writer", writer)
+    for async_mode in (False, True):
+        monkeypatch.setattr(sqlite_metrics, "METRICS_ASYNC", async_mode)
+        assert sqlite_metrics.save_quiz_result("user-1", 0, 0, {}) is False
+    writer.close()
+    assert manager.get_user_quiz_history("user-1") == []
+
+
+def _query_plan(manager: MetricsManager, sql: str, params: tuple) -> str:
+    with manager.get_connection() as conn:
+        rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return " | ".join(row[-1] for row in rows)
+
+
+def test_metrics_queries_use_secondary_indexes(tmp_path):
+    manager = create_manager(tmp_path)
+
+    history_plan = _query_plan(
+        manager,
+        "SELECT score, total_questions, percentage, timestamp FROM quiz_results "
+        "WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?",
+        ("user-1", 10),
+    )
+    assert "COVERING INDEX idx_quiz_results_user_ts" in history_plan
+    assert "TEMP B-TREE" not in history_plan
+
+    window_plan = _query_plan(
+        manager,
+        "SELECT intent, COUNT(*) FROM user_queries WHERE timestamp >= datetime('now', ?) GROUP BY intent",
+        ("-30 days",),
+    )
+    assert "idx_user_queries_ts_intent" in window_plan
+
+    leaderboard_plan = _query_plan(
+        manager, "SELECT best_score FROM leaderboard WHERE user_id = ?", ("user-1",)
+    )
+    assert "idx_leaderboard_user" in leaderboard_plan
+
+
+def test_index_migration_merges_duplicate_leaderboard_rows(tmp_path):
+    db_path = tmp_path / "metrics.db"
+    with sqlite3.connect(db_path) as conn:
+        conn.execute(
+            "CREATE TABLE leaderboard (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, "
+            "best_score INTEGER NOT NULL, best_percentage REAL NOT NULL, total_quizzes INTEGER DEFAULT 1, "
+            "last_updated DATETIME DEFAULT CURRENT_TIMESTAMP)"
+        )
+        conn.executemany(
+            "INSERT INTO leaderboard (user_id, best_score, best_percentage, total_quizzes) VALUES (?, ?, ?, ?)",
+            [("dup", 2, 66.7, 1), ("dup", 3, 100.0, 2)],
+        )
+    conn.close()
+
+    manager = MetricsManager(str(db_path))
+    assert manager.get_leaderboard() == [
+        {"user_id": "dup", "best_score": 3, "best_percentage": 100.0, "total_quizzes": 3}
+    ]
+
+
+def test_usage_stats_read_hourly_counters(tmp_path):
+    manager = create_manager(tmp_path)
+
+    manager.write_batch({
+        "user_queries": [
+            ("user-1", "buscar_por_tema", None, None, _days_ago(0)),
+            ("user-2", "buscar_por_tema", None, None, _days_ago(0)),
+            ("user-1", "preguntar_versiculo", None, None, _days_ago(20)),
+        ],
+        "quiz_results": [
+            ("user-1", 1, 2, 50.0, None, _days_ago(0)),
+            ("user-2", 2, 2, 100.0, None, _days_ago(200)),
+        ],
+    })
+
+    with manager.get_connection() as conn:
+        assert conn.execute("SELECT SUM(queries) FROM usage_hourly_intent").fetchone()[0] == 3
+
+    week = manager.get_usage_stats(days=7)
+    assert week["queries_by_intent"] == {"buscar_por_tema": 2}
+    assert week["total_quizzes"] == 1
+    assert week["average_quiz_score"] == 50.0
+
+    year = manager.get_usage_stats(days=365)
+    assert list(year["queries_by_intent"]) == ["buscar_por_tema", "preguntar_versiculo"]
+    assert year["total_queries"] == 3
+    assert year["average_quiz_score"] == 75.0
+
+
+def test_leaderboard_upsert_keeps_best_marks_and_cached_top(tmp_path):
+    manager = create_manager(tmp_path)
+    assert manager.get_leaderboard(5) == []
+
+    manager.save_quiz_result("ana", 2, 3, {})
+    manager.save_quiz_result("ana", 1, 3, {})
+    manager.save_quiz_result("beto", 3, 3, {})
+
+    top = manager.get_leaderboard(5)
+    assert [entry["user_id"] for entry in top] == ["beto", "ana"]
+    assert top[1]["best_score"] == 2
+    assert top[1]["total_quizzes"] == 2
+    assert manager.leaderboard_cache.hits >= 1
+
+    manager.leaderboard_cache.invalidate()
+    assert manager.get_leaderboard(5) == top
+
+    with manager.get_connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM leaderboard").fetchone()[0] == 2
+
+    plan = _query_plan(
+        manager,
+        "SELECT user_id, best_score, best_percentage, total_quizzes FROM leaderboard "
+        "ORDER BY best_percentage DESC, best_score DESC LIMIT ?",
+        (5,),
+    )
+    assert "idx_leaderboard_rank" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_quiz_payload_is_stored_compactly_and_legacy_rows_migrate(tmp_path):
+    manager = create_manager(tmp_path)
+    quiz = {
+        "questions": [{"id": 3, "question": "¿Quién?", "options": ["a", "b"]}, {"id": 5}],
+        "answers": [1, 0],
+        "score": 1,
+        "start_time": "2026-01-01T10:00:00",
+    }
+    assert manager.save_quiz_result("user-1", 1, 2, quiz)
+
+    with manager.get_connection() as conn:
+        partition = manager.partitions("quiz_results")[0]
+        stored = conn.execute(f"SELECT quiz_data FROM {partition}").fetchone()[0]
+        conn.execute(
+            "INSERT INTO quiz_results (user_id, score, total_questions, percentage, quiz_data) "
+            "VALUES ('legacy', 1, 1, 100.0, ?)",
+            (str({"questions": [{"question": "Q"}], "score": 1}),),
+        )
+        conn.execute("DELETE FROM schema_migrations WHERE name = 'metrics_quiz_payloads_v1'")
+        conn.commit()
+    assert decode_quiz_payload(stored) == {"v": 1, "q": [3, 5], "a": [1, 0], "t": "2026-01-01T10:00:00"}
+    manager.close()
+
+    manager = MetricsManager(str(tmp_path / "metrics.db"))
+    with manager.get_connection() as conn:
+        legacy = conn.execute("SELECT quiz_data FROM quiz_results WHERE user_id = 'legacy'").fetchone()[0]
+    assert isinstance(legacy, bytes)
+    assert decode_quiz_payload(legacy) == {"questions": [{"question": "Q"}], "score": 1}
+
+
+def test_events_are_routed_to_monthly_partitions(tmp_path):
+    manager = create_manager(tmp_path)
+    manager.write_batch({"quiz_results": [
+        ("user-1", 1, 3, 33.3, None, "2026-01-15 10:00:00"),
+        ("user-1", 2, 3, 66.7, None, "2026-03-02 09:30:00"),
+        ("user-1", 3, 3, 100.0, None, "2026-03-20 18:00:00"),
+    ]})
+
+    assert manager.partitions("quiz_results") == [
+        "quiz_results_202603", "quiz_results_202601", "quiz_results",
+    ]
+    assert manager.partitions("quiz_results", since="2026-02-01 00:00:00") == [
+        "quiz_results_202603", "quiz_results",
+    ]
+    history = manager.get_user_quiz_history("user-1", limit=3)
+    assert [entry["score"] for entry in history] == [3, 2, 1]
+
+    archive_path = tmp_path / "2026-01.db"
+    assert manager.archive_partition("202601", str(archive_path)) == ["quiz_results_202601"]
+    assert [entry["score"] for entry in manager.get_user_quiz_history("user-1")] == [3, 2]
+    manager.close()
+
+    with sqlite3.connect(archive_path) as archive:
+        assert archive.execute("SELECT COUNT(*) FROM quiz_results_202601").fetchone()[0] == 1
+
+
+def test_partitions_created_or_dropped_by_another_process_are_seen(tmp_path):
+    db_path = str(tmp_path / "metrics.db")
+    # Separate Storage objects stand in for two processes with their own connections
+    process_a = MetricsManager(storage=Storage(db_path))
+    process_b = MetricsManager(storage=Storage(db_path))
+
+    process_a.write_batch({"quiz_results": [("user-1", 2, 3, 66.7, None, "2026-04-01 10:00:00")]})
+    assert [entry["score"] for entry in process_b.get_user_quiz_history("user-1")] == [2]
+
+    process_b.write_batch({"quiz_results": [("user-1", 3, 3, 100.0, None, "2026-05-01 10:00:00")]})
+    assert process_a.archive_partition("202605") == ["quiz_results_202605"]
+    # B still remembers the dropped month: the write is routed again instead of lost
+    assert process_b.write_batch({"quiz_results": [("user-1", 1, 3, 33.3, None, "2026-05-02 10:00:00")]}) == 1
+    assert [entry["score"] for entry in process_a.get_user_quiz_history("user-1")] == [1, 2]
+    process_a.close()
+    process_b.close()
+
+
+def test_sharded_manager_routes_users_and_merges_global_queries(tmp_path):
+    db_path = str(tmp_path / "metrics.db")
+    manager = ShardedMetricsManager(db_path, shards=2)
+    users = [f"user-{i}" for i in range(8)]
+    assert {shard_index(user, 2) for user in users} == {0, 1}
+
+    writer = ShardedMetricsWriter(manager)
+    for i, user in enumerate(users):
+        assert writer.submit("quiz_results", (user, i, 8, i * 12.5, None, _days_ago(0)))
+        assert writer.submit("user_queries", (user, "saludo", None, None, _days_ago(0)))
+    assert writer.flush(timeout=5)
+    assert writer.written == 16
+    writer.close()
+
+    for user in users:
+        shard_file = shard_path(db_path, shard_index(user, 2))
+        with sqlite3.connect(shard_file) as conn:
+            assert conn.execute(
+                "SELECT COUNT(*) FROM leaderboard WHERE user_id = ?", (user,)
+            ).fetchone()[0] == 1
+        assert len(manager.get_user_quiz_history(user)) == 1
+
+    leaderboard = manager.get_leaderboard(3)
+    assert [entry["user_id"] for entry in leaderboard] == ["user-7", "user-6", "user-5"]
+
+    stats = manager.get_usage_stats(1)
+    assert stats["total_queries"] == 8
+    assert stats["total_quizzes"] == 8
+    assert stats["average_quiz_score"] == pytest.approx(43.8)
+    manager.close()
@@ -0,0 +1,101 @@
+from io import StringIO
+from pathlib import Path
+import json
+import sqlite3
+import sys
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from metrics_export import export_table
+from sqlite_metrics import MetricsManager
+
+
+def test_export_streams_partitions_incrementally(tmp_path):
+    db_path = str(tmp_path / "metrics.db")
+    state_path = str(tmp_path / "export_state.json")
+    manager = MetricsManager(db_path)
+    manager.write_batch({"user_queries": [
+        ("user-1", "saludar", None, None, "2026-01-10 08:00:00"),
+        ("user-2", "buscar_por_tema", None, True, "2026-02-03 09:00:00"),
+    ]})
+
+    out = StringIO()
+    assert export_table(db_path, "user_queries", out, state_path=state_path, chunk_size=1) == 2
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [row["intent"] for row in rows] == ["saludar", "buscar_por_tema"]
+
+    manager.write_batch({"user_queries": [("user-3", "saludar", None, None, "2026-02-04 10:00:00")]})
+    out = StringIO()
+    assert export_table(db_path, "user_queries", out, state_path=state_path) == 1
+    assert json.loads(out.getvalue())["user_id"] == "user-3"
+
+    out = StringIO()
+    assert export_table(db_path, "user_queries", out, fmt="csv", start="2026-02-01", end="2026-03-01") == 2
+    assert out.getvalue().splitlines()[0].startswith("id,user_id,intent")
+    manager.close()
+
+
+def test_export_fans_out_over_shards(tmp_path):
+    from sqlite_metrics import ShardedMetricsManager
+    from sqlite_storage import shard_index
+
+    db_path = str(tmp_path / "metrics.db")
+    state_path = str(tmp_path / "export_state.json")
+    manager = ShardedMetricsManager(db_path, shards=2)
+    users = [f"user-{i}" for i in range(6)]
+    manager.write_batch({"usage_stats": [(user, "quiz", True, "2026-03-01 10:00:00") for user in users]})
+
+    out = StringIO()
+    assert export_table(db_path, "usage_stats", out, state_path=state_path, shards=2) == 6
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert {row["user_id"]: row["_shard"] for row in rows} == {user: shard_index(user, 2) for user in users}
+
+    # Ids repeat across files: the incremental cursor is kept per shard
+    manager.write_batch({"usage_stats": [("user-0", "quiz", False, "2026-03-02 10:00:00")]})
+    out = StringIO()
+    assert export_table(db_path, "usage_stats", out, state_path=state_path, shards=2) == 1
+    assert json.loads(out.getvalue())["success"] == 0
+    manager.close()
+
+
+def test_export_fails_when_no_shard_file_exists(tmp_path):
+    # Passing a shard file as --db would look for metrics.shard0.shardN.db
+    shard_db = str(tmp_path / "metrics.shard0.db")
+    with pytest.raises(FileNotFoundError):
+        export_table(shard_db, "usage_stats", StringIO(), shards=2)
+
+
+def test_time_bounds_match_each_table_format(tmp_path):
+    db_path = str(tmp_path / "metrics.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE xp_events (id INTEGER PRIMARY KEY, user_id TEXT, created_at TEXT)")
+    conn.executemany("INSERT INTO xp_events(user_id, created_at) VALUES (?,?)", [
+        ("user-1", "2026-02-01T00:00:00.500000"),
+        ("user-2", "2026-02-28T23:59:59"),
+        ("user-3", "2026-03-01T00:00:00"),
+    ])
+    conn.commit()
+    conn.close()
+
+    out = StringIO()
+    assert export_table(db_path, "xp_events", out, start="2026-02-01 00:00:00", end="2026-03-01") == 2
+    assert [json.loads(line)["user_id"] for line in out.getvalue().splitlines()] == ["user-1", "user-2"]
+    with pytest.raises(ValueError):
+        export_table(db_path, "xp_events", StringIO(), start="ayer")
+
+
+def test_undecodable_quiz_payload_is_exported_raw(tmp_path):
+    db_path = str(tmp_path / "metrics.db")
+    manager = MetricsManager(db_path)
+    manager.write_batch({"quiz_results": [("user-1", 1, 2, 50.0, "{'broken", "2026-01-10 08:00:00")]})
+    manager.write_batch({"quiz_results": [("user-2", 2, 2, 100.0, "{}", "2026-01-10 09:00:00")]})
+    manager.close()
+
+    out = StringIO()
+    assert export_table(db_path, "quiz_results", out) == 2
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [row["quiz_data"] for row in rows] == ["{'broken", "{}"]
@@ -0,0 +1,49 @@
+from pathlib import Path
+from datetime import date, timedelta
+import json
+import sys
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from actions.engine import missions
+
+
+def test_calendar_matches_the_strftime_rotation():
+    data = json.loads((ROOT / "data" / "content" / "missions_weekly.json").read_text(encoding="utf-8"))
+    calendar = missions.MissionCalendar(data)
+    for offset in range(0, 800, 7):
+        day = date(2025, 12, 25) + timedelta(days=offset)
+        daily = data["daily"][int(day.strftime("%j")) % len(data["daily"])]
+        weekly = data["weekly"][int(day.strftime("%U")) % len(data["weekly"])]
+        assert calendar.daily(day)["title"] == daily["title"]
+        assert calendar.weekly(day)["title"] == weekly["title"]
+    assert calendar.period("weekly", date(2026, 1, 4)) == "2026-U01"
+
+
+def test_completion_is_idempotent_per_period(engine_db):
+    day = date(2026, 3, 2)
+    mission = missions.daily_mission(day=day)
+    assert missions.complete_mission("user-1", {"title": mission["title"]}, day)
+    assert not missions.complete_mission("user-1", {"title": mission["title"]}, day)
+    assert engine_db.get_user_xp("user-1") == missions.MISSION_XP
+
+    # Otro día, otra misión del calendario
+    next_day = missions.daily_mission(day=day + timedelta(days=1))
+    assert missions.complete_mission("user-1", next_day, day + timedelta(days=1))
+    assert engine_db.get_user_xp("user-1") == 2 * missions.MISSION_XP
+
+
+def test_group_status_in_one_query_per_shard(engine_db, monkeypatch):
+    monkeypatch.setattr(engine_db, "SHARDS", 3)
+    engine_db.migrate()
+    day = date(2026, 3, 2)
+    mission = missions.weekly_mission(day=day)
+    members = [f"kid-{i}" for i in range(30)]
+    for member in members[::3]:
+        missions.complete_mission(member, mission, day)
+
+    status = missions.group_mission_status(members, mission, day + timedelta(days=2))
+    assert [m for m, done in status.items() if done] == members[::3]
+    assert not any(missions.group_mission_status(members, mission, day + timedelta(days=7)).values())
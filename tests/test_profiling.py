@@ -0,0 +1,89 @@
+from pathlib import Path
+import asyncio
+import sys
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import profiling
+from actions.engine.executor import run_blocking
+
+
+def _blocking_hot_spot(n):
+    return sum(i * i for i in range(n))
+
+
+def test_sampled_action_profiles_loop_steps_and_offloaded_work(tmp_path):
+    async def action():
+        await asyncio.sleep(0)
+        chunks = [bytearray(1024) for _ in range(200)]
+        total = await run_blocking(_blocking_hot_spot, 20000)
+        return total, len(chunks)
+
+    async def scenario():
+        results = []
+        for _ in range(3):
+            results.append(await profiling.profile_action(
+                "action_fake", action(), alloc=True, directory=str(tmp_path)
+            ))
+        return results
+
+    results = asyncio.run(scenario())
+    assert results[0] == (_blocking_hot_spot(20000), 200)
+
+    samples = list((tmp_path / "action_fake").glob("*.prof"))
+    assert len(samples) == 3
+    assert len(list((tmp_path / "action_fake").glob("*.alloc.json"))) == 3
+
+    report = profiling.aggregate(str(tmp_path), top=50)
+    assert report["samples"] == 3
+    functions = " ".join(row["function"] for row in report["functions"])
+    assert "_blocking_hot_spot" in functions
+    assert "action" in functions
+    assert any("test_profiling.py" in row["location"] and row["size_diff"] > 0
+               for row in report["allocations"])
+
+    profiling.save_sample("action_fake", [profiling.cProfile.Profile()], 0.0,
+                          directory=str(tmp_path), max_files=2)
+    assert len(list((tmp_path / "action_fake").glob("*.prof"))) == 2
+    assert profiling.aggregate(str(tmp_path))["samples"] == 2
+
+
+def test_sampling_is_off_by_default():
+    assert profiling.should_sample(0) is False
+    assert profiling.should_sample(1.0) is True
+    assert profiling.wrap_blocking(len) is len
+
+
+def test_allocations_of_other_coroutines_are_not_attributed_to_the_sample(tmp_path):
+    def _unrelated_hot_spot():
+        return [bytearray(4096) for _ in range(500)]
+
+    async def busy_neighbour(started, done):
+        started.set()
+        kept = []
+        while not done.is_set():
+            kept.append(_unrelated_hot_spot())
+            await asyncio.sleep(0)
+        return len(kept)
+
+    async def action():
+        for _ in range(5):
+            await asyncio.sleep(0)
+        return [bytearray(1024) for _ in range(200)]
+
+    async def scenario():
+        started, done = asyncio.Event(), asyncio.Event()
+        neighbour = asyncio.create_task(busy_neighbour(started, done))
+        await started.wait()
+        await profiling.profile_action("action_fake", action(), alloc=True, directory=str(tmp_path))
+        done.set()
+        return await neighbour
+
+    assert asyncio.run(scenario()) > 0
+    report = profiling.aggregate(str(tmp_path), top=50)
+    locations = [row["location"] for row in report["allocations"]]
+    assert any("test_profiling.py" in location for location in locations)
+    line = _unrelated_hot_spot.__code__.co_firstlineno + 1
+    assert not any(location.endswith(f"test_profiling.py:{line}") for location in locations)
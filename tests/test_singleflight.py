@@ -0,0 +1,47 @@
+from pathlib import Path
+import asyncio
+import sys
+import threading
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from actions.engine.singleflight import SingleFlight
+
+
+def test_concurrent_identical_calls_share_one_computation():
+    release = threading.Event()
+    calls = []
+
+    def search(query):
+        calls.append(query)
+        release.wait(5)
+        if query == "boom":
+            raise ValueError(query)
+        return [query.upper()]
+
+    async def scenario():
+        flight = SingleFlight("test")
+        same = [asyncio.ensure_future(flight.do(("topic", "esperanza"), search, "esperanza"))
+                for _ in range(20)]
+        other = asyncio.ensure_future(flight.do(("topic", "paz"), search, "paz"))
+        failing = [asyncio.ensure_future(flight.do("boom", search, "boom")) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        # A cancelled caller must not cancel the shared computation
+        same[0].cancel()
+        assert flight.inflight() == 3
+        release.set()
+
+        results = await asyncio.gather(*same[1:], other)
+        errors = await asyncio.gather(*failing, return_exceptions=True)
+        return flight, results, errors
+
+    flight, results, errors = asyncio.run(scenario())
+    assert sorted(calls) == ["boom", "esperanza", "paz"]
+    assert results[:-1] == [["ESPERANZA"]] * 19
+    assert results[-1] == ["PAZ"]
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert flight.calls == 24
+    assert flight.coalesced == 21
+    assert flight.inflight() == 0
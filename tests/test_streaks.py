@@ -0,0 +1,55 @@
+from pathlib import Path
+from datetime import date, datetime, timedelta
+import sys
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from actions.engine.streaks import advance, current_as_of
+
+
+def _replay(days):
+    state = (0, 0, None)
+    for day in days:
+        state = advance(*state, day)
+    return state
+
+
+def test_advance_counts_consecutive_days():
+    d = date(2026, 3, 1)
+    assert _replay([d, d, d + timedelta(1), d + timedelta(2)]) == (3, 3, d + timedelta(2))
+    assert _replay([d, d + timedelta(1), d + timedelta(5)]) == (1, 2, d + timedelta(5))
+    assert current_as_of(4, d, d + timedelta(1)) == 4
+    assert current_as_of(4, d, d + timedelta(2)) == 0
+
+
+def _insert_events(storage_db, rows):
+    with storage_db.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO xp_events(user_id, kind, amount, created_at) VALUES (?,?,?,?)",
+            [(user, "srs_review", 5, f"{day.isoformat()}T12:00:00") for user, day in rows],
+        )
+
+
+def test_add_xp_updates_the_streak_and_backfill_matches(engine_db):
+    today = datetime.utcnow().date()
+    days = [today - timedelta(n) for n in (6, 5, 3, 2, 1)]
+    _insert_events(engine_db, [("ana", d) for d in days] + [("beto", today - timedelta(9))])
+
+    assert engine_db.backfill_streaks() == 2
+    assert engine_db.get_streak("ana") == {
+        "current": 3, "longest": 3, "last_active_day": (today - timedelta(1)).isoformat(),
+    }
+    assert engine_db.get_streak("beto")["current"] == 0
+
+    engine_db.add_xp("ana", "trivia_correct", 10)
+    engine_db.add_xp("ana", "trivia_correct", 10)
+    engine_db.add_xp_many([("beto", "bingo_complete", 30, None), ("caro", "bingo_complete", 30, None)])
+    assert engine_db.get_streak("ana") == {"current": 4, "longest": 4, "last_active_day": today.isoformat()}
+    assert engine_db.get_streak("beto") == {"current": 1, "longest": 1, "last_active_day": today.isoformat()}
+    assert engine_db.get_streak("nadie") == {"current": 0, "longest": 0, "last_active_day": None}
+
+    incremental = {user: engine_db.get_streak(user) for user in ("ana", "beto", "caro")}
+    engine_db.backfill_streaks()
+    assert {user: engine_db.get_streak(user) for user in ("ana", "beto", "caro")} == incremental
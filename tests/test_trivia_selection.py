@@ -0,0 +1,87 @@
+from pathlib import Path
+import random
+import sys
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from actions.engine import trivia
+from actions.engine.selection import QuestionBank, pick_unseen
+
+
+def _bank(n=40):
+    return QuestionBank([
+        {"id": 100 + i, "question": f"q{i}", "difficulty": "facil" if i % 2 else "dificil",
+         "category": ["personajes", "lugares"][i % 4 // 2]}
+        for i in range(n)
+    ])
+
+
+def test_sample_filters_by_bucket_and_never_repeats_until_exhausted():
+    bank = _bank()
+    rng = random.Random(7)
+    seen = bytearray()
+    assert bank.bucket_size("facil", "lugares") == 10
+
+    bucket = {q["id"] for q in bank.questions if q["difficulty"] == "facil" and q["category"] == "lugares"}
+    first = [q["id"] for q in bank.sample(4, seen, "facil", "lugares", rng)]
+    second = [q["id"] for q in bank.sample(4, seen, "facil", "lugares", rng)]
+    assert len(set(first + second)) == 8 and set(first + second) <= bucket
+
+    # Quedan 2 sin ver: salen primero y el resto empieza otra vuelta sin repetir en el quiz
+    third = [q["id"] for q in bank.sample(4, seen, "facil", "lugares", rng)]
+    assert len(set(third)) == 4
+    assert bucket - set(first + second) <= set(third)
+
+    assert bank.sample(3, bytearray(), "media") == []
+
+
+def test_pick_unseen_persists_the_bitset_per_user(engine_db):
+    bank = _bank(6)
+    first = pick_unseen(bank, "user-1", "trivia", 3)
+    second = pick_unseen(bank, "user-1", "trivia", 3)
+    assert {q["id"] for q in first}.isdisjoint(q["id"] for q in second)
+    assert len(pick_unseen(bank, "user-2", "trivia", 6)) == 6
+
+    seen = engine_db.get_seen_questions("user-1", "trivia")
+    assert all(bank._is_seen(seen, q["id"]) for q in first + second)
+    assert engine_db.get_seen_questions("user-1", "quiz") == bytearray()
+
+
+def test_concurrent_picks_for_one_user_do_not_lose_marks(engine_db, monkeypatch):
+    import threading
+    import time
+
+    bank = _bank(40)
+    sample = bank.sample
+
+    def slow_sample(*args):
+        # Widen the window between reading and saving the bitset
+        time.sleep(0.01)
+        return sample(*args)
+
+    monkeypatch.setattr(bank, "sample", slow_sample)
+    barrier = threading.Barrier(8)
+    picked = []
+
+    def quiz():
+        barrier.wait()
+        picked.extend(q["id"] for q in pick_unseen(bank, "user-1", "trivia", 5))
+
+    threads = [threading.Thread(target=quiz) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(picked) == len(set(picked)) == 40
+    seen = engine_db.get_seen_questions("user-1", "trivia")
+    assert all(bank._is_seen(seen, qid) for qid in picked)
+
+
+def test_start_trivia_uses_the_indexed_bank(engine_db):
+    session = trivia.start_trivia("user-1", 3, category="personajes")
+    assert [q["category"] for q in session["questions"]] == ["personajes", "personajes"]
+    assert session["current"] == 0
+    assert len(trivia.start_trivia("user-1", 5)["questions"]) == 5
@@ -0,0 +1,93 @@
+from pathlib import Path
+from datetime import date, datetime
+import sys
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from actions.engine import db, leaderboard
+from actions.engine.leaderboard import RankCache, period_key
+
+
+def test_rank_cache_orders_by_xp_with_shared_ranks():
+    cache = RankCache("all")
+    cache.load([("ana", 30), ("beto", 50), ("caro", 30)], players=3)
+    assert cache.top(2) == [("beto", 50), ("ana", 30)]
+    assert cache.rank("caro") == (2, 30)
+    cache.set("caro", 55)
+    cache.set("dani", 5)
+    assert cache.rank("caro") == (1, 55)
+    assert cache.rank("beto") == (2, 50)
+    assert cache.rank("dani") == (4, 5)
+    assert cache.rank("nadie") is None
+    assert cache.players == 4
+
+    # Fijar el total es idempotente aunque la recarga ya incluyera la escritura
+    cache.set("caro", 55)
+    assert cache.rank("caro") == (1, 55)
+
+
+def test_rank_cache_keeps_only_the_top_k():
+    cache = RankCache("all", capacity=2)
+    cache.load([("ana", 30), ("beto", 50)], players=3)
+    assert not cache.complete
+    assert cache.top(3) is None
+    cache.set("caro", 10)
+    assert cache.rank("caro") is None
+    cache.set("caro", 40)
+    assert cache.top(2) == [("beto", 50), ("caro", 40)]
+    assert cache.rank("ana") is None
+
+
+def test_windows_are_maintained_on_each_add_xp(engine_db, monkeypatch):
+    monkeypatch.setattr(engine_db, "SHARDS", 2)
+    engine_db.migrate()
+    for user, amount in [("ana", 10), ("beto", 30), ("ana", 10), ("caro", 5)]:
+        engine_db.add_xp(user, "trivia_correct", amount)
+
+    assert [(r["user_id"], r["xp"]) for r in engine_db.get_xp_leaderboard("week", 2)] == [("beto", 30), ("ana", 20)]
+    assert engine_db.get_xp_rank("caro", "day") == {"rank": 3, "xp": 5, "players": 3}
+
+    # La caché ya cargada se actualiza con las escrituras del proceso
+    engine_db.add_xp_many([("caro", "bingo_complete", 30, None)])
+    assert engine_db.get_xp_rank("caro", "week")["rank"] == 1
+    assert engine_db.get_xp_leaderboard("all", 1)[0] == {"rank": 1, "user_id": "caro", "xp": 35}
+
+    # Fuera del top-K en memoria, el puesto y el top se leen del índice
+    monkeypatch.setattr(leaderboard, "XP_RANK_CACHE_SIZE", 1)
+    monkeypatch.setattr(engine_db, "_rank_caches", {})
+    assert engine_db.get_xp_rank("ana", "week") == {"rank": 3, "xp": 20, "players": 3}
+    assert engine_db.get_xp_rank("beto", "week") == {"rank": 2, "xp": 30, "players": 3}
+    assert [r["user_id"] for r in engine_db.get_xp_leaderboard("week", 3)] == ["caro", "beto", "ana"]
+    engine_db.add_xp("ana", "trivia_correct", 40)
+    assert engine_db.get_xp_rank("ana", "week")["rank"] == 1
+
+    # Otra semana empieza vacía
+    assert engine_db.get_xp_leaderboard("week", 5, day=date(2020, 1, 1)) == []
+
+
+def test_existing_history_is_backfilled_and_old_periods_pruned(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "legacy.db"))
+    monkeypatch.setattr(db, "_rank_caches", {})
+    import sqlite_storage
+
+    storage = sqlite_storage.get_storage(db.DB_PATH)
+    storage.ensure_schema("engine", db._create_schema)
+    with storage.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO xp_events(user_id, kind, amount, created_at) VALUES (?,?,?,?)",
+            [("ana", "srs_review", 5, "2020-01-01T10:00:00"), ("ana", "srs_review", 5, datetime.utcnow().isoformat())],
+        )
+    db.migrate()
+
+    assert db.get_xp_rank("ana", "all")["xp"] == 10
+    assert db.get_xp_rank("ana", "day")["xp"] == 5
+    assert db.get_xp_rank("ana", "day", day=date(2020, 1, 1))["xp"] == 5
+    assert db.get_xp_rank("ana", "week", day=date(2020, 1, 1))["xp"] == 5
+
+    db.compact_xp_events(older_than_days=30)
+    with db.get_connection(True) as conn:
+        periods = {row[0] for row in conn.execute("SELECT period FROM xp_leaderboard")}
+    assert period_key("day", date(2020, 1, 1)) not in periods
+    assert "all" in periods and period_key("day", datetime.utcnow().date()) in periods